@@ -0,0 +1,191 @@
+"""
+Benchmark the MME embed pipeline on a synthetic collection.
+
+Usage:
+    python benchmarks/benchmark.py --files 500 --depth 2 --file-size 200000 [MME options] [--output results.json]
+
+A tree of JPEG/TIFF files and a CSV with every column of data/maps.json are generated in a temporary directory, then
+MME runs on them. The report is printed as JSON (MME's own output goes to stderr), so it can be saved and compared
+between versions:
+- seconds: time to generate the collection, and total run time,
+- phases: count, total time and p50/p95/p99/max latencies of every phase of the run (rows, index, lookups, reads, and
+  the delete/write commands of each standard), summed over the workers,
+- files_per_second and tags_per_second: files rewritten and mapped tags of the processed rows, per second of the run,
+- bytes_rewritten: size of the files rewritten by exiftool,
+- peak_rss_bytes: peak resident memory of MME, and of the largest exiftool process.
+
+With --rerun, the XMP values of the CSV are then changed, and MME runs again on the written files with --diff (with
+--in-place too, if set, so the XMP packets are updated in place). The files
+are checked with "exiftool -validate", and the rerun reports its time, errors, files rewritten and the number of
+duplicate XMP properties found (0 unless the rewrite of embedded files is broken).
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+
+from typing import Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mme import MME, SCRIPT_PATH, Settings  # noqa: E402
+import synthetic  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _peak_rss() -> dict[str, Optional[int]]:
+    """ Peak resident memory of this process, and of its largest finished child process (exiftool), in bytes """
+    if resource is None:
+        return {'mme': None, 'exiftool': None}
+    scale = 1 if sys.platform == 'darwin' else 1024  # ru_maxrss is in bytes on macOS, in KiB elsewhere
+    return {'mme': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            'exiftool': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale}
+
+
+def _snapshot(images_root_path: str) -> dict[str, tuple[int, int]]:
+    """ (mtime ns, size) of every file of the collection """
+    snapshot = {}
+    for root, _, files in os.walk(images_root_path):
+        for filename in files:
+            stat = os.stat(os.path.join(root, filename))
+            snapshot[os.path.join(root, filename)] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def _version(command: list[str]) -> Optional[str]:
+    """ First line of the output of a version command, if it runs """
+    try:
+        return subprocess.run(command, capture_output=True, text=True, cwd=SCRIPT_PATH).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _duplicate_properties(images_root_path: str) -> int:
+    """ Number of "Duplicate XMP property" warnings of exiftool -validate on the files of the collection """
+    command = ['exiftool', '-config', f'{SCRIPT_PATH}/data/exiftool_configs/mme.config', '-validate', '-warning',
+               '-a', '-r', images_root_path]
+    stdout = subprocess.run(command, capture_output=True, text=True).stdout
+    return sum('Duplicate XMP property' in line for line in stdout.splitlines())
+
+
+def _run_mme(csv_filepath: str, images_root_path: str, files: int, depth: int, **mme_options) -> tuple[MME, float]:
+    """ Run MME on a collection, its output to stderr. Return it (its logs removed) and the run time """
+    with contextlib.redirect_stdout(sys.stderr):
+        # Time a cold scan, and keep temporary roots out of the cache
+        mme = MME(csv_filepath, images_root_path,
+                  Settings.from_options(row_progress_notify=max(files // 10, 1), max_depth=depth + 1,
+                                        index_cache=False, **mme_options))
+        start_time = time.perf_counter()
+        mme.run()
+        run_seconds = time.perf_counter() - start_time
+    for log in (mme.exif_tool_error_log, mme.exif_tool_success_log, mme.diff_report):
+        if log is not None:
+            os.remove(log.filepath)  # Logs are written next to mme.py
+    return mme, run_seconds
+
+
+def run_benchmark(work_path: str, files: int, depth: int, fanout: int, file_size: int, formats: tuple[str, ...],
+                  rerun: bool = False, **mme_options) -> dict:
+    """ Generate a collection in work_path, run MME on it (and again with changed values and --diff, if rerun) and
+    return the report """
+    images_root_path = os.path.join(work_path, 'images')
+    csv_filepath = os.path.join(work_path, 'benchmark.csv')
+    with open(f'{SCRIPT_PATH}/data/maps.json', 'r', encoding='utf-8') as r_file:
+        maps = json.load(r_file)
+
+    start_time = time.perf_counter()
+    filenames = synthetic.generate_collection(images_root_path, files, depth=depth, fanout=fanout,
+                                              file_size=file_size, formats=formats)
+    columns = synthetic.generate_csv(csv_filepath, filenames, maps)
+    generate_seconds = time.perf_counter() - start_time
+    before = _snapshot(images_root_path)
+
+    mme, run_seconds = _run_mme(csv_filepath, images_root_path, files, depth, **mme_options)
+    after = _snapshot(images_root_path)
+    # exiftool keeps the originals as new "_original" files, only the files of the collection count
+    rewritten = [filepath for filepath, state in before.items() if after.get(filepath) != state]
+
+    report = {
+        'mme_version': _version(['git', 'describe', '--always', '--dirty']),
+        'exiftool_version': _version(['exiftool', '-ver']),
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {'files': files, 'depth': depth, 'fanout': fanout, 'file_size': file_size,
+                       'formats': list(formats), **mme_options},
+        'rows': mme.row_count,
+        'tags': mme.row_count * columns,
+        'errors': len(mme.exif_tool_error_log),
+        'successes': len(mme.exif_tool_success_log),
+        'seconds': {'generate': round(generate_seconds, 3), 'total': round(run_seconds, 3)},
+        'phases': mme.metrics.summary(),
+        'files_rewritten': len(rewritten),
+        'files_per_second': round(len(rewritten) / run_seconds, 2),
+        'tags_per_second': round(mme.row_count * columns / run_seconds, 2),
+        'bytes_rewritten': sum(after[filepath][1] for filepath in rewritten),
+        'peak_rss_bytes': _peak_rss(),
+    }
+    if rerun:
+        synthetic.generate_csv(csv_filepath, filenames, maps, revision=1)
+        rerun_mme, rerun_seconds = _run_mme(csv_filepath, images_root_path, files, depth,
+                                            **{**mme_options, 'diff': True})
+        rerun_after = _snapshot(images_root_path)
+        report['rerun'] = {
+            'errors': len(rerun_mme.exif_tool_error_log),
+            'seconds': round(rerun_seconds, 3),
+            'files_rewritten': sum(rerun_after.get(filepath) != after[filepath] for filepath in before),
+            'duplicate_properties': _duplicate_properties(images_root_path),
+        }
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog='MME benchmark', description='Benchmark MME on a synthetic collection of '
+                                                                       'JPEG/TIFF files, and print a JSON report.')
+    parser.add_argument('--files', type=int, default=200, help='Number of files to generate. 200 by default')
+    parser.add_argument('--depth', type=int, default=2, help='Levels of sub-folders. 2 by default')
+    parser.add_argument('--fanout', type=int, default=4, help='Sub-folders per folder. 4 by default')
+    parser.add_argument('--file-size', type=int, default=100_000, help='Size of each file, in bytes. 100000 by default')
+    parser.add_argument('--formats', type=str, default='jpg,tif', help='Comma separated formats to alternate: jpg, '
+                                                                       'tif. jpg,tif by default')
+    parser.add_argument('--workers', '-w', type=int, default=1, help='MME --workers. 1 by default')
+    parser.add_argument('--single-pass', '-s', action='store_true', help='Run MME with --single-pass')
+    parser.add_argument('--diff', action='store_true', help='Run MME with --diff')
+    parser.add_argument('--in-place', action='store_true', help='Run MME with --in-place')
+    parser.add_argument('--rerun', action='store_true',
+                        help='Then change the XMP values of the CSV, run MME again with --diff, and check the files '
+                             'with exiftool -validate')
+    parser.add_argument('--work-dir', type=str, default=None,
+                        help='Directory for the collection, kept after the run. A temporary directory, removed after '
+                             'the run, by default')
+    parser.add_argument('--output', '-o', type=str, default=None, help='Also write the report to this JSON file')
+    args = parser.parse_args()
+
+    formats = tuple(extension.strip().lower() for extension in args.formats.split(','))
+    work_path = args.work_dir or tempfile.mkdtemp(prefix='mme-benchmark-')
+    os.makedirs(work_path, exist_ok=True)
+    try:
+        report = run_benchmark(work_path, args.files, args.depth, args.fanout, args.file_size, formats,
+                               rerun=args.rerun, workers=args.workers, single_pass=args.single_pass, diff=args.diff,
+                               in_place=args.in_place)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_path, ignore_errors=True)
+
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as w_file:
+            json.dump(report, w_file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Synthetic collections for the MME benchmarks: a tree of JPEG/TIFF files and a CSV with every column of maps.json.
+
+The images are generated without any imaging library: a flat grey baseline JPEG, padded to the requested size with
+comment (COM) segments, and a flat grey uncompressed TIFF of about the requested size. They are valid files for
+exiftool, which only reads and rewrites their metadata.
+"""
+import os
+import csv
+import math
+import struct
+
+JPEG_COMMENT_MAX = 65533  # Largest COM segment payload
+
+
+def make_jpeg(file_size: int, width: int = 64, height: int = 64) -> bytes:
+    """ A flat grey baseline JPEG of at least file_size bytes (width and height multiples of 8) """
+    blocks = (width // 8) * (height // 8)
+    header = b''.join([
+        b'\xff\xd8',  # SOI
+        b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00',  # APP0
+        b'\xff\xdb' + struct.pack('>HB', 67, 0) + b'\x01' * 64,  # DQT
+        b'\xff\xc0' + struct.pack('>HBHHB', 11, 8, height, width, 1) + b'\x01\x11\x00',  # SOF0, 1 component
+        b'\xff\xc4' + struct.pack('>HB', 20, 0x00) + bytes([1] + [0] * 15) + b'\x00',  # DHT DC: "0" -> category 0
+        b'\xff\xc4' + struct.pack('>HB', 20, 0x10) + bytes([1] + [0] * 15) + b'\x00',  # DHT AC: "0" -> EOB
+    ])
+    # Every block is "0" (no DC difference) then "0" (end of block), the last byte is padded with 1 bits
+    bits = blocks * 2
+    scan = b'\xff\xda' + struct.pack('>HB', 8, 1) + b'\x01\x00\x00\x3f\x00' + bytes(bits // 8)
+    if bits % 8:
+        scan += bytes([0xff >> (bits % 8)])
+    footer = b'\xff\xd9'  # EOI
+
+    comments = []
+    padding = file_size - len(header) - len(scan) - len(footer)
+    while padding > 4:
+        payload = min(padding - 4, JPEG_COMMENT_MAX)
+        comments.append(b'\xff\xfe' + struct.pack('>H', payload + 2) + b' ' * payload)
+        padding -= payload + 4
+    return header + b''.join(comments) + scan + footer
+
+
+def make_tiff(file_size: int) -> bytes:
+    """ A flat grey 8-bit uncompressed TIFF of about file_size bytes """
+    side = max(8, int(math.sqrt(max(file_size - 160, 64))))
+    image = b'\x80' * (side * side)
+    resolution = struct.pack('<IIII', 72, 1, 72, 1)  # 72/1 for XResolution, then for YResolution
+    tags = [(256, 4, side),  # ImageWidth
+            (257, 4, side),  # ImageLength
+            (258, 3, 8),  # BitsPerSample
+            (259, 3, 1),  # Compression: none
+            (262, 3, 1),  # PhotometricInterpretation: BlackIsZero
+            (273, 4, 0),  # StripOffsets, after the IFD and the resolution
+            (277, 3, 1),  # SamplesPerPixel
+            (278, 4, side),  # RowsPerStrip
+            (279, 4, len(image)),  # StripByteCounts
+            (282, 5, 0),  # XResolution, after the IFD
+            (283, 5, 8),  # YResolution, after XResolution
+            (296, 3, 2)]  # ResolutionUnit: inches
+    resolution_offset = 8 + 2 + len(tags) * 12 + 4
+    image_offset = resolution_offset + len(resolution)
+
+    ifd = struct.pack('<H', len(tags))
+    for tag, tag_type, value in tags:
+        if tag == 273:
+            value = image_offset
+        elif tag_type == 5:
+            value += resolution_offset
+        if tag_type == 3:
+            ifd += struct.pack('<HHIHH', tag, tag_type, 1, value, 0)
+        else:
+            ifd += struct.pack('<HHII', tag, tag_type, 1, value)
+    ifd += struct.pack('<I', 0)  # No next IFD
+    return b'II*\x00' + struct.pack('<I', 8) + ifd + resolution + image
+
+
+def _directories(depth: int, fanout: int) -> list[str]:
+    """ Relative paths of a tree of fanout sub-folders per directory, depth levels deep """
+    directories, level = [], ['']
+    for _ in range(depth):
+        level = [os.path.join(parent, f'd{i:02d}') for parent in level for i in range(fanout)]
+        directories.extend(level)
+    return directories or ['']
+
+
+def generate_collection(root_path: str, files: int, depth: int = 2, fanout: int = 4, file_size: int = 100_000,
+                        formats: tuple[str, ...] = ('jpg', 'tif')) -> list[str]:
+    """ Write files synthetic images under root_path, spread over a tree of depth levels with fanout sub-folders per
+    directory, alternating the formats. Return their filenames (unique in the whole tree) """
+    images = {'jpg': make_jpeg(file_size), 'tif': make_tiff(file_size)}
+    directories = _directories(depth, fanout)
+    for directory in directories:
+        os.makedirs(os.path.join(root_path, directory), exist_ok=True)
+
+    filenames = []
+    for n in range(files):
+        extension = formats[n % len(formats)]
+        filename = f'synthetic-{n:07d}.{extension}'
+        with open(os.path.join(root_path, directories[n % len(directories)], filename), 'wb') as w_file:
+            w_file.write(images[extension])
+        filenames.append(filename)
+    return filenames
+
+
+def _value(column: str, tag: str, n: int, revision: int = 0) -> str:
+    """ A plausible value for a column of a synthetic row. Only the values of XMP tags change with the revision of the
+    CSV, so the XMP packet of a file written by a revision can be updated in place by the next one """
+    tag = tag.lower()
+    m = n + revision if tag.startswith('xmp') else n
+    if 'gpslatitude' in tag:
+        return f'-34.{m % 100:02d}'
+    if 'gpslongitude' in tag:
+        return f'-58.{m % 100:02d}'
+    if tag.endswith('date') or tag.endswith('datecreated'):
+        return f'20{m % 23:02d}:0{m % 9 + 1}:1{m % 9}'
+    return f'{column} {n}' + (f' r{revision}' if revision and tag.startswith('xmp') else '')
+
+
+def generate_csv(csv_filepath: str, filenames: list[str], maps: dict, revision: int = 0) -> int:
+    """ Write a CSV with a "File Name" column and every column of the maps, one row per file (the XMP values change with
+    the revision). Return the number of mapped columns per row """
+    columns = {}  # Column -> tag, the last standard mapping a column wins
+    for tag_map in maps.values():
+        columns.update(tag_map)
+    with open(csv_filepath, 'w', encoding='utf-8', newline='') as w_file:
+        writer = csv.writer(w_file)
+        writer.writerow(['File Name'] + list(columns))
+        for n, filename in enumerate(filenames):
+            writer.writerow([filename] + [_value(column, tag, n, revision) for column, tag in columns.items()])
+    return len(columns)
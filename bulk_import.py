@@ -0,0 +1,47 @@
+"""
+Bulk import of the rows of a directory shard with a single exiftool -csv= command.
+
+The rows are converted to exiftool's import CSV: a SourceFile column with the path of each file, then one column per
+tag of the tag plan. exiftool rewrites every file of the shard in one pass. Errors name their file ("Error: ... -
+FILE"), but tag value warnings do not, so they are returned apart.
+"""
+import re
+import csv
+
+from typing import Iterable, TextIO
+
+DELETE_VALUE = '<mme:delete>'  # MissingTagValue of the import: with -f, a tag with this value is deleted
+ERROR_PATTERN = re.compile(r'^Error: (.*) - (.+)$')
+FILE_PATTERN = re.compile(r'^======== (.+)$')
+SUMMARY_PATTERN = re.compile(r'^\d+ (image files|files|directories) ')  # e.g. "5 image files updated"
+
+
+def write_csv(w_file: TextIO, tags: list[str], rows: Iterable[tuple[str, list]]) -> None:
+    """ Write the import CSV of (filepath, values in tags order) rows. Empty values delete their tag, as an empty
+    -TAG= argument does """
+    writer = csv.writer(w_file)
+    writer.writerow(['SourceFile'] + tags)
+    for filepath, values in rows:
+        writer.writerow([filepath] + [f'{value}' if value != '' else DELETE_VALUE for value in values])
+
+
+def parse_output(stdout: str, stderr: str, filepaths: list[str]) -> tuple[dict, dict, list[str]]:
+    """ Return the success message (e.g. "Rewriting FILE...") and the errors of every file of an import (run with
+    -v), and the warnings/errors that name no file """
+    successes, errors, warnings = {}, {}, []
+    filepath = None
+    for line in stdout.split('\n'):
+        match = FILE_PATTERN.match(line)
+        if match:
+            filepath = match.group(1)
+        elif filepath and line.startswith(('Rewriting', 'Nothing changed')):
+            successes[filepath] = line.strip()
+
+    filepaths = set(filepaths)
+    for line in stderr.split('\n'):
+        match = ERROR_PATTERN.match(line.strip())
+        if match and match.group(2) in filepaths:
+            errors.setdefault(match.group(2), []).append(f'Error: {match.group(1)}')
+        elif line.strip() and not SUMMARY_PATTERN.match(line.strip()):
+            warnings.append(line.strip())
+    return successes, errors, warnings
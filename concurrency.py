@@ -0,0 +1,91 @@
+"""
+Adaptive concurrency of the --workers engine, for the --adaptive mode.
+
+The right number of files written at once depends on the storage: a local SSD keeps getting faster up to many
+concurrent exiftool writes, a network share slows down for everyone past a few. AdaptiveConcurrency limits the files
+in flight, and tunes the limit from what it observes, with AIMD (additive increase, multiplicative decrease):
+- the rows are measured as they complete: how long each took, and the size of its file (large and small files are
+  compared by their seconds per byte),
+- every window (at least MIN_WINDOW_FILES files, twice the level, and MIN_WINDOW_SECONDS), the level goes up by one,
+  unless the storage is congested: the seconds per byte of the window are over LATENCY_TOLERANCE times the best seen
+  so far, or the bytes written per second fell under THROUGHPUT_DROP times the last window's. Then the level is cut to
+  DECREASE times itself (at least by one),
+- the level stays within [min_level, max_level].
+The best seconds per byte slowly ages (BASELINE_DRIFT per window), so a run that moves to slower files is not held
+down by the fast files of its start.
+"""
+import time
+import threading
+
+from typing import Optional
+
+
+class AdaptiveConcurrency:
+    """ AIMD limit of the files in flight, tuned from their latency and the throughput """
+    LATENCY_TOLERANCE = 2.0  # Congested when the seconds per byte grow over this times the best seen
+    THROUGHPUT_DROP = 0.9  # Congested when the bytes per second fall under this times the last window's
+    DECREASE = 0.5  # Multiplicative decrease of the level, on congestion
+    BASELINE_DRIFT = 1.05  # Ageing of the best seconds per byte, per window
+    MIN_WINDOW_FILES = 4
+    MIN_WINDOW_SECONDS = 0.5
+
+    def __init__(self, min_level: int, max_level: int, level: Optional[int] = None):
+        self.min_level: int = max(min_level, 1)
+        self.max_level: int = max(max_level, self.min_level)
+        self.level: int = min(max(level or self.min_level, self.min_level), self.max_level)  # Files in flight at most
+        self.in_flight: int = 0
+        self.increases: int = 0
+        self.decreases: int = 0
+        self._condition = threading.Condition()
+        self._baseline: Optional[float] = None  # Best seconds per byte of a window (aged)
+        self._last_throughput: Optional[float] = None  # Bytes per second of the last window
+        self._reset_window()
+
+    def __str__(self) -> str:
+        return f'{self.level} ({self.min_level}-{self.max_level})'
+
+    def _reset_window(self) -> None:
+        self._window_start = time.monotonic()
+        self._window_files = 0
+        self._window_seconds = 0.0
+        self._window_bytes = 0
+
+    def acquire(self) -> None:
+        """ Wait until a file can be put in flight """
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < self.level)
+            self.in_flight += 1
+
+    def release(self, seconds: float, size: int) -> None:
+        """ A file is done, after seconds, with size bytes (0 if it has no file, it is not measured) """
+        with self._condition:
+            self.in_flight -= 1
+            if size > 0:
+                self._window_files += 1
+                self._window_seconds += seconds
+                self._window_bytes += size
+                elapsed = time.monotonic() - self._window_start
+                if self._window_files >= max(AdaptiveConcurrency.MIN_WINDOW_FILES, 2 * self.level) and \
+                        elapsed >= AdaptiveConcurrency.MIN_WINDOW_SECONDS:
+                    self._adjust(elapsed)
+            self._condition.notify_all()
+
+    def _adjust(self, elapsed: float) -> None:
+        """ Raise or lower the level from the latency and the throughput of the window """
+        cost = self._window_seconds / self._window_bytes
+        throughput = self._window_bytes / elapsed
+        if self._baseline is None:
+            self._baseline = cost
+        slower = cost > self._baseline * AdaptiveConcurrency.LATENCY_TOLERANCE
+        dropped = self._last_throughput is not None and \
+            throughput < self._last_throughput * AdaptiveConcurrency.THROUGHPUT_DROP
+        congested = slower or dropped
+        if congested and self.level > self.min_level:
+            self.level = max(self.min_level, min(self.level - 1, int(self.level * AdaptiveConcurrency.DECREASE)))
+            self.decreases += 1
+        elif not congested and self.level < self.max_level:
+            self.level += 1
+            self.increases += 1
+        self._baseline = min(cost, self._baseline * AdaptiveConcurrency.BASELINE_DRIFT)
+        self._last_throughput = throughput
+        self._reset_window()
@@ -0,0 +1,303 @@
+"""
+Persistent ExifTool engine, shared by mme.py and gmme.py.
+
+Instead of starting a new exiftool (and Perl interpreter) for every delete/write command, exiftool is started once
+with "-stay_open True -@ -" and commands are piped through its standard input. Every command is terminated with a
+numbered "-execute", and its output is read back up to the matching "{ready}" marker on stdout and stderr. The commands
+are written, and stdout and stderr read, at the same time (on threads, as pipes can not be selected on Windows), so a
+large batch or a long stderr can not fill a pipe that is not being read.
+
+One process is kept per (executable, -config) pair, so the vrae.config and isadg.config files are loaded only once.
+AsyncExifTool and AsyncExifToolPool are the asyncio versions, for the --async engine.
+"""
+import os
+import re
+import asyncio
+import itertools
+import threading
+import contextlib
+import subprocess
+
+from typing import Optional
+
+
+class ExifTool:
+    """ A single exiftool process running in -stay_open mode """
+
+    def __init__(self, executable: str = 'exiftool', config: Optional[str] = None):
+        self.executable: str = executable
+        self.config: Optional[str] = config
+        self._process: Optional[subprocess.Popen] = None
+        self._execute_ids = itertools.count(1)
+        self._unread: dict[int, bytes] = {}  # File descriptor -> output read past the last marker (batches)
+
+    @property
+    def running(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def start(self) -> None:
+        """ Start the exiftool process, loading the -config file (if any) once """
+        if self.running:
+            return
+        command = [self.executable]
+        if self.config:
+            command += ['-config', self.config]  # -config must be the first option
+        command += ['-stay_open', 'True', '-@', '-']
+        self._unread.clear()
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                         stderr=subprocess.PIPE)
+
+    def close(self) -> None:
+        """ Ask exiftool to exit, and wait for it """
+        if not self.running:
+            self._process = None
+            return
+        try:
+            self._process.stdin.write(b'-stay_open\nFalse\n')
+            self._process.stdin.flush()
+            self._process.communicate(timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            self._process.kill()
+            self._process.communicate()
+        self._process = None
+
+    def execute(self, args: list[str]) -> tuple[str, str]:
+        """ Run one exiftool command, return its (stdout, stderr) """
+        return self.execute_batch([args])[0]
+
+    def execute_batch(self, commands: list[list[str]]) -> list[tuple[str, str]]:
+        """ Send several exiftool commands at once, return one (stdout, stderr) per command, in order. The commands are
+        written on a thread and stderr is read on another one while stdout is read here: if any of them fails, the
+        process is killed, so the others end too """
+        self.start()
+        process = self._process
+        execute_ids = [next(self._execute_ids) for _ in commands]
+        payload = b''.join(self._encode_command(args, execute_id) for args, execute_id in zip(commands, execute_ids))
+        errors: dict[str, Exception] = {}  # Stream -> exception that ended its thread, in the order they ended
+
+        def write() -> None:
+            try:
+                process.stdin.write(payload)
+                process.stdin.flush()
+            except Exception as e:
+                errors['stdin'] = e
+                process.kill()
+
+        def read(stream, outputs: list[str], name: str) -> None:
+            try:
+                for execute_id in execute_ids:
+                    outputs.append(self._read_until_ready(stream, execute_id))
+            except Exception as e:
+                errors[name] = e
+                process.kill()
+
+        stdouts, stderrs = [], []
+        threads = [threading.Thread(target=write, daemon=True),
+                   threading.Thread(target=read, args=(process.stderr, stderrs, 'stderr'), daemon=True)]
+        for thread in threads:
+            thread.start()
+        read(process.stdout, stdouts, 'stdout')
+        for thread in threads:
+            thread.join()
+        if errors:
+            process.kill()
+            process.wait()
+            for stream in (process.stdin, process.stdout, process.stderr):
+                with contextlib.suppress(OSError):
+                    stream.close()
+            self._process = None
+            self._unread.clear()
+            # An exited (or killed) process ends every stream: the stderr read has the output of exiftool
+            first = next(iter(errors.values()))
+            raise errors['stderr'] if 'stderr' in errors and isinstance(first, (OSError, RuntimeError)) else first
+        return list(zip(stdouts, stderrs))
+
+    @staticmethod
+    def _encode_command(args: list[str], execute_id: int) -> bytes:
+        """ Build the argument file lines for a command. Arguments are sent as C strings ("#[CSTR]") so values may
+        contain newlines, or start with white space or "#" """
+        lines = [f'#[CSTR]{ExifTool._escape_argument(arg)}' for arg in args]
+        lines += ['-echo4', f'{{ready{execute_id}}}', f'-execute{execute_id}']
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+    @staticmethod
+    def _escape_argument(arg: str) -> str:
+        """ Escape an argument as a C string for the exiftool argument file """
+        return arg.replace('\\', '\\\\').replace('\n', '\\n').replace('\r', '\\r')
+
+    def _read_until_ready(self, stream, execute_id: int) -> str:
+        """ Read a stream until the "{readyN}" marker of a command, return the output before the marker. In a batch,
+        a read can go past the marker into the output of the next commands: it is kept for their reads. """
+        marker_bytes = b'{ready%d}' % execute_id
+        marker = re.compile(re.escape(marker_bytes) + rb'\r?\n')
+        buffer = self._unread.pop(stream.fileno(), b'')
+        match = marker.search(buffer)
+        while not match:
+            chunk = os.read(stream.fileno(), 65536)
+            if not chunk:  # The stderr read reports what exiftool printed before it exited
+                stderr = buffer if stream is self._process.stderr else b''
+                raise RuntimeError(f'exiftool exited unexpectedly: {stderr.decode("utf-8", "replace")}')
+            buffer += chunk
+            match = marker.search(buffer, max(len(buffer) - len(chunk) - len(marker_bytes) - 2, 0))
+        if match.end() < len(buffer):
+            self._unread[stream.fileno()] = buffer[match.end():]
+        return buffer[:match.start()].decode('utf-8').replace('\r\n', '\n')
+
+
+class AsyncExifTool(ExifTool):
+    """ A single exiftool process running in -stay_open mode, driven with asyncio """
+
+    @property
+    def running(self) -> bool:
+        return self._process is not None and self._process.returncode is None
+
+    async def start(self) -> None:
+        """ Start the exiftool process, loading the -config file (if any) once """
+        if self.running:
+            return
+        command = ['-config', self.config] if self.config else []  # -config must be the first option
+        self._unread.clear()
+        self._process = await asyncio.create_subprocess_exec(self.executable, *command, '-stay_open', 'True', '-@',
+                                                             '-', stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                                             stderr=subprocess.PIPE)
+
+    async def close(self) -> None:
+        """ Ask exiftool to exit, and wait for it """
+        if not self.running:
+            self._process = None
+            return
+        try:
+            self._process.stdin.write(b'-stay_open\nFalse\n')
+            await self._process.stdin.drain()
+            await asyncio.wait_for(self._process.communicate(), timeout=10)
+        except (OSError, asyncio.TimeoutError):
+            self._process.kill()
+            await self._process.communicate()
+        self._process = None
+
+    async def execute(self, args: list[str]) -> tuple[str, str]:
+        """ Run one exiftool command, return its (stdout, stderr) """
+        return (await self.execute_batch([args]))[0]
+
+    async def execute_batch(self, commands: list[list[str]]) -> list[tuple[str, str]]:
+        """ Send several exiftool commands at once, return one (stdout, stderr) per command, in order. If a stream
+        fails, the process is killed and waited for, and the error raised (as ExifTool.execute_batch does) """
+        await self.start()
+        process = self._process
+        execute_ids = [next(self._execute_ids) for _ in commands]
+        process.stdin.write(b''.join(self._encode_command(args, execute_id)
+                                     for args, execute_id in zip(commands, execute_ids)))
+        # The commands are drained while the output is read, so a large batch can not fill stdout before it is read
+        drain = asyncio.ensure_future(process.stdin.drain())
+
+        results, errors = [], {}  # Stream -> exception that ended its read, stderr first
+        try:
+            for execute_id in execute_ids:
+                # Both streams are read at once, so a long stderr can not fill its pipe while stdout is awaited
+                stdout, stderr = await asyncio.gather(self._read_until_ready(process.stdout, execute_id),
+                                                      self._read_until_ready(process.stderr, execute_id),
+                                                      return_exceptions=True)
+                errors.update((name, output) for name, output in (('stderr', stderr), ('stdout', stdout))
+                              if isinstance(output, BaseException))
+                if errors:
+                    break
+                results.append((stdout, stderr))
+            if not errors:
+                await drain
+        except OSError as e:
+            errors['stdin'] = e
+        finally:
+            drain.cancel()
+        if errors:
+            if process.returncode is None:
+                process.kill()
+            await process.wait()
+            self._process = None
+            self._unread.clear()
+            # An exited (or killed) process ends every stream: the stderr read has the output of exiftool
+            error = next(iter(errors.values()))
+            raise errors['stderr'] if 'stderr' in errors and isinstance(error, (OSError, RuntimeError)) else error
+        return results
+
+    async def _read_until_ready(self, stream: asyncio.StreamReader, execute_id: int) -> str:
+        """ Read a stream until the "{readyN}" marker of a command, return the output before the marker, keeping
+        what was read past it for the next commands of a batch """
+        marker_bytes = b'{ready%d}' % execute_id
+        marker = re.compile(re.escape(marker_bytes) + rb'\r?\n')
+        buffer = self._unread.pop(id(stream), b'')
+        match = marker.search(buffer)
+        while not match:
+            chunk = await stream.read(65536)
+            if not chunk:  # The stderr read reports what exiftool printed before it exited
+                stderr = buffer if stream is self._process.stderr else b''
+                raise RuntimeError(f'exiftool exited unexpectedly: {stderr.decode("utf-8", "replace")}')
+            buffer += chunk
+            match = marker.search(buffer, max(len(buffer) - len(chunk) - len(marker_bytes) - 2, 0))
+        if match.end() < len(buffer):
+            self._unread[id(stream)] = buffer[match.end():]
+        return buffer[:match.start()].decode('utf-8').replace('\r\n', '\n')
+
+
+class ExifToolPool:
+    """ Lazily started ExifTool processes, one per (executable, -config) pair """
+    EXIFTOOL_CLASS = ExifTool
+
+    def __init__(self):
+        self._processes: dict[tuple[str, Optional[str]], ExifTool] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def run(self, command: list[str], args: list[str]) -> tuple[str, str]:
+        """ Run a command prefix (e.g. MME.WRITE_VRAE_TAGS) with extra arguments, return its (stdout, stderr) """
+        return self.run_batch(command, [args])[0]
+
+    def run_batch(self, command: list[str], args_list: list[list[str]]) -> list[tuple[str, str]]:
+        """ Run a command prefix once per argument list, batched on the same exiftool process """
+        exiftool, options = self._get_exiftool(command)
+        return exiftool.execute_batch([options + args for args in args_list])
+
+    def close(self) -> None:
+        """ Stop every exiftool process """
+        for exiftool in self._processes.values():
+            exiftool.close()
+        self._processes.clear()
+
+    def _get_exiftool(self, command: list[str]) -> tuple[ExifTool, list[str]]:
+        """ Split a command prefix into its executable, -config file and remaining options """
+        executable, options, config = command[0], command[1:], None
+        if options[:1] == ['-config']:
+            config, options = options[1], options[2:]
+        key = (executable, config)
+        if key not in self._processes:
+            self._processes[key] = self.EXIFTOOL_CLASS(executable, config)
+        return self._processes[key], options
+
+
+class AsyncExifToolPool(ExifToolPool):
+    """ Lazily started AsyncExifTool processes, one per (executable, -config) pair """
+    EXIFTOOL_CLASS = AsyncExifTool
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def run(self, command: list[str], args: list[str]) -> tuple[str, str]:
+        """ Run a command prefix (e.g. MME.WRITE_VRAE_TAGS) with extra arguments, return its (stdout, stderr) """
+        return (await self.run_batch(command, [args]))[0]
+
+    async def run_batch(self, command: list[str], args_list: list[list[str]]) -> list[tuple[str, str]]:
+        """ Run a command prefix once per argument list, batched on the same exiftool process """
+        exiftool, options = self._get_exiftool(command)
+        return await exiftool.execute_batch([options + args for args in args_list])
+
+    async def close(self) -> None:
+        """ Stop every exiftool process """
+        for exiftool in self._processes.values():
+            await exiftool.close()
+        self._processes.clear()
@@ -0,0 +1,136 @@
+"""
+Extraction of the VRAE/ISADG/DC metadata embedded in the files of an images root back to a CSV, for audits and round
+trips (python mme.py extract IMAGES_ROOT_PATH OUTPUT_CSV).
+
+The files are listed with the file index, up to max_depth as mme.py finds them, and read with "exiftool -j -G1" (with
+both configs loaded), BATCH_FILES files of a directory per command, on parallel workers with their own exiftool
+processes. Their tags are mapped back to CSV columns by inverting data/maps.json, and the rows are written as the
+batches complete, in directory order, with a bounded number of batches in flight: memory does not grow with the number
+of files. The CSV has the layout of the CSVs mme.py reads ("File Name", then the mapped columns, or the header of a
+given CSV), so an extracted CSV can be compared with the CSV that was embedded.
+"""
+import os
+import csv
+import json
+import threading
+import collections
+
+from typing import Callable, Iterator, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+from exiftool_engine import ExifToolPool
+from file_index import FileIndex
+from metadata_diff import as_text, read_arguments, tag_matches
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.tif', '.tiff', '.png', '.dng', '.psd', '.jp2', '.webp', '.heic')
+BATCH_FILES = 200  # Files of a directory read by one exiftool command
+# GPS coordinates are read as decimal degrees, signed from their GPS*Ref tag ("South", "West"), as the CSVs write them
+COORDINATE_ARGUMENTS = ['-c', '%.6f', '-gpslatituderef', '-gpslongituderef']
+NEGATIVE_REFS = ('s', 'w')
+
+
+def columns(maps: dict, header: Optional[list[str]] = None) -> list[str]:
+    """ Columns of the extracted CSV: the header of a CSV, or "File Name" and every mapped column, in maps order """
+    if header:
+        return header if 'File Name' in header else ['File Name'] + header
+    return ['File Name'] + list(dict.fromkeys(column for tag_map in maps.values() for column in tag_map))
+
+
+def column_tags(maps: dict, csv_columns: list[str]) -> dict[str, list[str]]:
+    """ Mapped column -> its tags (a column can be mapped by several standards), inverting the maps """
+    tags = {}
+    for tag_map in maps.values():
+        for column, tag in tag_map.items():
+            if column in csv_columns:
+                tags.setdefault(column, []).append(tag)
+    return tags
+
+
+def _value(entry: dict, key: str) -> str:
+    """ Text of a tag read by exiftool, GPS coordinates signed from their reference """
+    value = as_text(entry[key])
+    if key.lower().endswith(('gpslatitude', 'gpslongitude')):
+        ref = as_text(entry.get(f'{key}Ref', '')).strip().lower()
+        if ref.startswith(NEGATIVE_REFS) and not value.startswith('-'):
+            return f'-{value}'
+    return value
+
+
+def extracted_row(filepath: str, entry: dict, tags: dict[str, list[str]]) -> dict[str, str]:
+    """ CSV row of the tags of a file, read by exiftool -j -G1 ({group:name: value}) """
+    row = {'File Name': os.path.basename(filepath)}
+    for column, column_tag_list in tags.items():
+        row[column] = next((_value(entry, key) for tag in column_tag_list for key in entry
+                            if tag_matches(tag, key)), '')
+    return row
+
+
+def batches(file_index: FileIndex) -> Iterator[list[str]]:
+    """ Filepaths of the images of the index, BATCH_FILES of a directory at a time, in directory order """
+    for relative_path in sorted(file_index.directories):
+        filenames = [filename for filename in file_index.directories[relative_path][1]
+                     if filename.lower().endswith(IMAGE_EXTENSIONS)]
+        directory = file_index.full_path(relative_path)
+        for start in range(0, len(filenames), BATCH_FILES):
+            yield [os.path.join(directory, filename) for filename in filenames[start:start + BATCH_FILES]]
+
+
+def extract(file_index: FileIndex, output_filepath: str, maps: dict, command: list[str], workers: int = 1,
+            header: Optional[list[str]] = None,
+            on_batch: Optional[Callable[[int, list[str]], None]] = None) -> tuple[int, list[str]]:
+    """ Write the mapped tags of every image of the index to a CSV, reading workers batches in parallel with the
+    exiftool command prefix (executable and -config). on_batch is called with the rows written so far and the files
+    of a batch that could not be read. Return the number of rows written, and the files that could not be read """
+    csv_columns = columns(maps, header)
+    tags = column_tags(maps, csv_columns)
+    arguments = read_arguments(maps) + COORDINATE_ARGUMENTS
+    local = threading.local()
+    exiftools: list[ExifToolPool] = []
+    lock = threading.Lock()
+
+    def read(filepaths: list[str]) -> list[tuple[str, Optional[dict]]]:
+        exiftool = getattr(local, 'exiftool', None)
+        if exiftool is None:
+            exiftool = local.exiftool = ExifToolPool()
+            with lock:
+                exiftools.append(exiftool)
+        stdout, _ = exiftool.run(command, arguments + filepaths)
+        try:
+            entries = json.loads(stdout) if stdout.strip() else []
+        except json.JSONDecodeError:
+            entries = []  # Every file of the batch is reported as unreadable
+        read_entries = {entry.pop('SourceFile'): entry for entry in entries if 'ExifTool:Error' not in entry}
+        return [(filepath, read_entries.get(filepath)) for filepath in filepaths]
+
+    rows, unreadable = 0, []
+    try:
+        with open(output_filepath, 'w', encoding='utf-8', newline='') as w_file, \
+                ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            writer = csv.DictWriter(w_file, fieldnames=csv_columns, restval='', extrasaction='ignore')
+            writer.writeheader()
+
+            def write(results: list[tuple[str, Optional[dict]]]) -> None:
+                nonlocal rows
+                batch_unreadable = []
+                for filepath, entry in results:
+                    if entry is None:
+                        batch_unreadable.append(filepath)
+                        continue
+                    writer.writerow(extracted_row(filepath, entry, tags))
+                    rows += 1
+                unreadable.extend(batch_unreadable)
+                if on_batch:
+                    on_batch(rows, batch_unreadable)
+
+            # Batches are submitted in order, and written in the same order, keeping a bounded number in flight
+            pending = collections.deque()
+            for batch in batches(file_index):
+                pending.append(executor.submit(read, batch))
+                if len(pending) >= max(workers, 1) * 2:
+                    write(pending.popleft().result())
+            while pending:
+                write(pending.popleft().result())
+    finally:
+        for exiftool in exiftools:
+            exiftool.close()
+    return rows, unreadable
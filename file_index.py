@@ -0,0 +1,150 @@
+"""
+Filename -> filepath index of an images root, shared by mme.py and gmme.py.
+
+The images root is walked once (up to max_depth sub-folders) instead of once per CSV row. The index can be saved to
+a JSON file together with the mtime of every scanned directory: a later run loads it, and only lists again the
+directories whose mtime changed (adding, removing or renaming a file or sub-folder changes the mtime of its
+directory), instead of walking the whole tree.
+
+By default the index is cached across runs in CACHE_PATH (in the home directory, next to the GMME logs), one file
+per images root and max depth, so mme.py and gmme.py share it: a run on a large network share only checks the mtime
+of its directories, instead of listing every one of them again.
+
+Depth follows the "--max-depth" option: files directly in the root and in its first level of sub-folders are at
+depth 1, files in sub-sub-folders at depth 2, and so on.
+"""
+import os
+import json
+import hashlib
+
+from typing import Optional
+from pathlib import Path
+
+
+class FileIndex:
+    """ Index of the files under an images root path """
+    VERSION = 1  # Bump when the saved index format changes
+    CACHE_PATH = os.path.join(str(Path.home()), 'Museum-Metadata-Embedder_logs', 'file_index_cache')
+
+    def __init__(self, images_root_path: str, max_depth: int = 3):
+        self.images_root_path: str = images_root_path
+        self.max_depth: int = max_depth
+        self.directories: dict[str, tuple[int, list[str]]] = {}  # Relative directory path -> (mtime ns, filenames)
+        self.files: dict[str, list[str]] = {}  # Filename -> relative directory paths, shallowest first
+
+    @staticmethod
+    def _depth(relative_path: str) -> int:
+        """ Depth of a directory, relative to the images root (the root and its sub-folders are at depth 1) """
+        return len(relative_path.split(os.sep)) if relative_path else 1
+
+    def full_path(self, relative_path: str) -> str:
+        """ Path of a directory of the index, from its path relative to the images root ('' for the root) """
+        return os.path.join(self.images_root_path, relative_path) if relative_path else self.images_root_path
+
+    def scan(self) -> None:
+        """ Walk the images root once and index every file, up to max_depth """
+        self.directories.clear()
+        self._scan_directory('')
+        self._index_files()
+
+    def refresh(self) -> int:
+        """ List again the directories whose mtime changed since they were indexed, return how many changed """
+        changed = 0
+        for relative_path in sorted(self.directories):  # Parents before their sub-folders
+            if relative_path not in self.directories:
+                continue  # Sub-folder of a removed directory
+            try:
+                mtime = os.stat(self.full_path(relative_path)).st_mtime_ns
+            except OSError:
+                self._remove_directory(relative_path)
+                changed += 1
+                continue
+            if mtime != self.directories[relative_path][0]:
+                self._list_directory(relative_path)
+                changed += 1
+        if changed:
+            self._index_files()
+        return changed
+
+    def find(self, filename: str) -> Optional[str]:
+        """ Return the filepath for a filename, if it exists """
+        directories = self.files.get(filename)
+        return os.path.join(self.full_path(directories[0]), filename) if directories else None
+
+    @property
+    def duplicates(self) -> dict[str, list[str]]:
+        """ Filenames found in more than one directory, with all their filepaths (the one used first) """
+        return {filename: [os.path.join(self.full_path(d), filename) for d in directories]
+                for filename, directories in self.files.items() if len(directories) > 1}
+
+    @staticmethod
+    def cache_filepath(images_root_path: str, max_depth: int) -> str:
+        """ Path of the cached index of an images root and max_depth, in CACHE_PATH """
+        key = hashlib.sha1(f'{os.path.abspath(images_root_path)}\0{max_depth}'.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(FileIndex.CACHE_PATH, f'{key}.json')
+
+    def save(self, index_filepath: str) -> None:
+        """ Save the index, keyed by the images root, max_depth and the mtime of every scanned directory. The file is
+        replaced at once, so a run loading it (e.g. GMME and MME on the same root) never reads half of it """
+        os.makedirs(os.path.dirname(os.path.abspath(index_filepath)), exist_ok=True)
+        temporary_filepath = f'{index_filepath}.{os.getpid()}.tmp'
+        with open(temporary_filepath, 'w', encoding='utf-8') as w_file:
+            json.dump({'version': FileIndex.VERSION,
+                       'images_root_path': os.path.abspath(self.images_root_path),
+                       'max_depth': self.max_depth,
+                       'directories': self.directories}, w_file, separators=(',', ':'))
+        os.replace(temporary_filepath, index_filepath)
+
+    def load(self, index_filepath: str) -> bool:
+        """ Load a saved index of the same images root and max_depth, return False if there is none. Call refresh()
+        afterwards to pick up the changes made since it was saved. """
+        try:
+            with open(index_filepath, 'r', encoding='utf-8') as r_file:
+                saved = json.load(r_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+
+        if saved.get('version') != FileIndex.VERSION or saved.get('max_depth') != self.max_depth or \
+                saved.get('images_root_path') != os.path.abspath(self.images_root_path):
+            return False
+        self.directories = {relative_path: (mtime, filenames)
+                            for relative_path, (mtime, filenames) in saved['directories'].items()}
+        self._index_files()
+        return True
+
+    def _scan_directory(self, relative_path: str) -> None:
+        """ Walk a directory and its sub-folders, up to max_depth """
+        for root, dirs, files in os.walk(self.full_path(relative_path), followlinks=True):
+            root_relative_path = os.path.relpath(root, self.images_root_path)
+            root_relative_path = '' if root_relative_path == os.curdir else root_relative_path
+            # Walk in a stable order, so duplicates resolve the same way on every run, and not deeper than max_depth
+            dirs[:] = sorted(d for d in dirs if self._depth(os.path.join(root_relative_path, d)) <= self.max_depth)
+            self.directories[root_relative_path] = (os.stat(root).st_mtime_ns, sorted(files))
+
+    def _list_directory(self, relative_path: str) -> None:
+        """ List the files of a known directory again, and walk its new sub-folders """
+        full_path = self.full_path(relative_path)
+        mtime = os.stat(full_path).st_mtime_ns
+        files = []
+        with os.scandir(full_path) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    files.append(entry.name)
+                    continue
+                sub_relative_path = os.path.join(relative_path, entry.name)
+                if sub_relative_path not in self.directories and self._depth(sub_relative_path) <= self.max_depth:
+                    self._scan_directory(sub_relative_path)
+        self.directories[relative_path] = (mtime, sorted(files))
+
+    def _remove_directory(self, relative_path: str) -> None:
+        """ Forget a directory that no longer exists, and its sub-folders """
+        prefix = relative_path + os.sep
+        for known_path in [p for p in self.directories if p == relative_path or p.startswith(prefix)]:
+            del self.directories[known_path]
+
+    def _index_files(self) -> None:
+        """ Build the filename index from the directory listings """
+        self.files = {}
+        for relative_path in sorted(self.directories, key=lambda p: (self._depth(p), p)):
+            for filename in self.directories[relative_path][1]:
+                self.files.setdefault(filename, []).append(relative_path)
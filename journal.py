@@ -0,0 +1,113 @@
+"""
+SQLite journal of the files written by MME, for incremental and resumable runs.
+
+Every successfully written file gets one entry: a hash of the mapped values of its CSV row (and of the maps), and the
+size and mtime of the file right after it was written. A row can be skipped when its file still has the same size
+and mtime, and the hash of its row did not change:
+- incremental runs skip it whatever run wrote it,
+- resumed runs only skip the files written by the interrupted run of the same CSV.
+"""
+import os
+import json
+import uuid
+import sqlite3
+import hashlib
+import datetime
+import threading
+
+from typing import Optional
+
+
+class Journal:
+    """ Per-file journal, safe to use from several worker threads """
+    COMMIT_EVERY = 100  # Rows recorded between commits, at most this many rows are written again after a crash
+
+    def __init__(self, journal_filepath: str, maps: dict):
+        self.journal_filepath: str = journal_filepath
+        self.maps: dict = maps
+        self._maps_hash: str = hashlib.sha256(json.dumps(maps, sort_keys=True).encode('utf-8')).hexdigest()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._connection = sqlite3.connect(journal_filepath, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, csv_filepath TEXT, '
+                                 'started_at TEXT, finished_at TEXT)')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS files (filepath TEXT PRIMARY KEY, row_hash TEXT, '
+                                 'size INTEGER, mtime_ns INTEGER, run_id TEXT, written_at TEXT)')
+        self._connection.commit()
+
+    def row_hash(self, row: dict) -> str:
+        """ Hash of the maps and of the values of the mapped columns of a row """
+        values = [[key, row[key]] for tag_map in self.maps.values() for key in tag_map.keys() if key in row.keys()]
+        return hashlib.sha256(json.dumps([self._maps_hash, values]).encode('utf-8')).hexdigest()
+
+    def start_run(self, csv_filepath: str, resume: bool = False) -> tuple[str, bool]:
+        """ Start a run, or with resume, continue the last unfinished run of the same CSV. Return the run id, and
+        whether an unfinished run was resumed """
+        csv_filepath = os.path.abspath(csv_filepath)
+        with self._lock:
+            if resume:
+                unfinished = self._connection.execute('SELECT run_id FROM runs WHERE csv_filepath = ? AND finished_at '
+                                                      'IS NULL ORDER BY started_at DESC LIMIT 1',
+                                                      (csv_filepath,)).fetchone()
+                if unfinished:
+                    return unfinished[0], True
+            run_id = uuid.uuid4().hex
+            self._connection.execute('INSERT INTO runs (run_id, csv_filepath, started_at) VALUES (?, ?, ?)',
+                                     (run_id, csv_filepath, datetime.datetime.now().isoformat()))
+            self._connection.commit()
+            return run_id, False
+
+    def finish_run(self, run_id: str) -> None:
+        """ Mark a run as finished, it will not be resumed """
+        with self._lock:
+            self._connection.execute('UPDATE runs SET finished_at = ? WHERE run_id = ?',
+                                     (datetime.datetime.now().isoformat(), run_id))
+            self._connection.commit()
+            self._pending = 0
+
+    def is_current(self, filepath: str, row_hash: str, run_id: Optional[str] = None) -> bool:
+        """ True if the file was written with the same row values (by run_id, if given) and did not change since """
+        with self._lock:
+            entry = self._connection.execute('SELECT row_hash, size, mtime_ns, run_id FROM files WHERE filepath = ?',
+                                             (os.path.abspath(filepath),)).fetchone()
+        if not entry or entry[0] != row_hash or (run_id and entry[3] != run_id):
+            return False
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return False
+        return (stat.st_size, stat.st_mtime_ns) == (entry[1], entry[2])
+
+    def record(self, filepath: str, row_hash: str, run_id: str) -> None:
+        """ Record a file that was just written without errors """
+        stat = os.stat(filepath)
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO files (filepath, row_hash, size, mtime_ns, run_id, '
+                                     'written_at) VALUES (?, ?, ?, ?, ?, ?)',
+                                     (os.path.abspath(filepath), row_hash, stat.st_size, stat.st_mtime_ns, run_id,
+                                      datetime.datetime.now().isoformat()))
+            self._pending += 1
+            if self._pending >= Journal.COMMIT_EVERY:
+                self._connection.commit()
+                self._pending = 0
+
+    def merge(self, journal_filepath: str) -> int:
+        """ Add the runs and files of another journal (e.g. of a shard), its files replace the entries of the same
+        files. Return the number of files added """
+        with self._lock:
+            self._connection.commit()
+            self._connection.execute('ATTACH DATABASE ? AS other', (journal_filepath,))
+            try:
+                self._connection.execute('INSERT OR IGNORE INTO runs SELECT * FROM other.runs')
+                files = self._connection.execute('INSERT OR REPLACE INTO files SELECT * FROM other.files').rowcount
+                self._connection.commit()
+                return files
+            finally:
+                self._connection.execute('DETACH DATABASE other')
+
+    def close(self) -> None:
+        """ Commit the pending entries and close the journal """
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
@@ -0,0 +1,125 @@
+"""
+Streaming log files for the MME error and success logs.
+
+Entries are written to disk as they arrive (with buffered flushing) instead of being kept in memory until the end of
+the run, so long runs use constant memory and an interrupted run keeps its logs. LogWriter behaves like the lists it
+replaces (append, extend and len), and is not thread-safe: worker threads log to their own lists, which are merged
+from the main thread.
+
+Two formats are available:
+- text: one message per line, as the logs have always been written,
+- jsonl: one JSON object per line, with the time, the log name, the message and the fields found in it (key, row,
+  filepath, row_key, tag, bytes_written).
+
+With max_bytes, a log is rotated into numbered parts: error_log_x.txt, error_log_x.1.txt, error_log_x.2.txt...
+"""
+import os
+import re
+import json
+import time
+import datetime
+
+from typing import Callable, Iterable, Optional
+
+FIELD_PATTERNS = {
+    'key': re.compile(r'On ([A-Z][A-Z ]*[A-Z]):'),
+    'row': re.compile(r'Row:? "(\d+)'),
+    'filepath': re.compile(r'filepath: "([^"]*)"'),
+    'row_key': re.compile(r'(?:Row key|MISSING KEY): (.+?)(?:,| - )'),
+    'tag': re.compile(r'tag: "([^"]*)"'),
+    'bytes_written': re.compile(r'BYTES WRITTEN: "(\d+)"'),
+}
+
+
+class LogWriter:
+    """ Append-only log file, written as the entries arrive """
+    FORMATS = ('text', 'jsonl')
+
+    def __init__(self, filepath: str, log_format: str = 'text', flush_every: int = 100, flush_interval: float = 1.0,
+                 max_bytes: int = 0, listener: Optional[Callable[[str, str], None]] = None):
+        if log_format not in LogWriter.FORMATS:
+            raise ValueError(f'Unknown log format: {log_format}')
+        self.filepath: str = filepath
+        self.log_format: str = log_format
+        self.name: str = re.match(r'[a-z]+_[a-z]+', os.path.basename(filepath)).group()  # e.g. "error_log"
+        self.flush_every: int = flush_every  # Entries between flushes
+        self.flush_interval: float = flush_interval  # Seconds between flushes
+        self.max_bytes: int = max_bytes  # Rotate to a new part when a part grows over this size, 0 to never rotate
+        self.listener: Optional[Callable[[str, str], None]] = listener  # Called with (log name, message) per entry
+        self._count = 0
+        self._part = 0
+        self._part_bytes = 0
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+        self._file = open(self._part_filepath(), 'w', encoding='utf-8')
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _part_filepath(self) -> str:
+        if not self._part:
+            return self.filepath
+        root, extension = os.path.splitext(self.filepath)
+        return f'{root}.{self._part}{extension}'
+
+    def append(self, message: str) -> None:
+        """ Write a log entry """
+        if self.log_format == 'jsonl':
+            line = json.dumps(self._record(message), ensure_ascii=False) + '\n'
+        else:
+            line = message if not self._part_bytes else '\n' + message  # No trailing line break, as '\n'.join()
+
+        size = len(line.encode('utf-8'))
+        if self.max_bytes and self._part_bytes and self._part_bytes + size > self.max_bytes:
+            self._rotate()
+            if self.log_format == 'text':
+                line, size = message, size - 1  # First line of the new part
+        self._file.write(line)
+        self._part_bytes += size
+        self._count += 1
+
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+        if self.listener:
+            self.listener(self.name, message)
+
+    def extend(self, messages: Iterable[str]) -> None:
+        """ Write several log entries """
+        for message in messages:
+            self.append(message)
+
+    def flush(self) -> None:
+        """ Flush the buffered entries to disk """
+        self._file.flush()
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+
+    def close(self) -> None:
+        """ Flush and close the log file, closing twice does nothing """
+        if not self._file.closed:
+            self._file.close()
+
+    def _rotate(self) -> None:
+        """ Close the current part and start the next one """
+        self._file.close()
+        self._part += 1
+        self._part_bytes = 0
+        self._file = open(self._part_filepath(), 'w', encoding='utf-8')
+
+    def _record(self, message: str) -> dict:
+        """ Structured JSON record of a message """
+        record = {'time': datetime.datetime.now().isoformat(timespec='milliseconds'), 'log': self.name}
+        record.update(message_fields(message))
+        record['message'] = message
+        return record
+
+
+def message_fields(message: str) -> dict:
+    """ Fields found in a log message: key, row, filepath, row_key, tag, bytes_written """
+    fields = {}
+    for field, pattern in FIELD_PATTERNS.items():
+        match = pattern.search(message)
+        if match:
+            fields[field] = int(match.group(1)) if field in ('row', 'bytes_written') else match.group(1)
+    return fields
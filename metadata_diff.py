@@ -0,0 +1,128 @@
+"""
+Compare the current metadata of a file with the tags a CSV row would write, for the --diff mode.
+
+The current tags are read with "exiftool -j -G1" (family 1 group names, e.g. "XMP-vrae:WorkTitle"), and compared with
+the state a full run leaves behind: the xmp-vrae, xmp-isadg and xmp-dc groups cleared, then every mapped column of the
+row written (an empty value deletes its tag). Only the tags that differ are reported, and only they are written,
+except in the cleared groups: a cleared group with any change is cleared and written again as on a full run, as some
+properties of the configs are read back under another name (e.g. "work.title " is read as Worktitle) and would be
+duplicated instead of replaced.
+
+Values are compared as text, and exiftool formatting is tolerated for values made only of numbers: "2022-7-6" is the
+same as "2022:07:06", and "-34.60" is the same as 34 deg 36' 0.00" (the sign is kept in GPS*Ref tags, not in the value).
+"""
+import re
+import json
+
+from typing import Optional
+
+CLEARED_GROUPS = ('xmp-vrae', 'xmp-isadg', 'xmp-dc')  # Groups deleted before writing, on a full run
+DMS_PATTERN = re.compile(r'(\d+(?:\.\d+)?) deg (\d+(?:\.\d+)?)\' (\d+(?:\.\d+)?)"(?: ?[NSEW])?')
+NUMBER_PATTERN = re.compile(r'\d+(?:\.\d+)?')
+NOT_NUMERIC_PATTERN = re.compile(r'[^\d\s.:+\-/TZ]')
+TOLERANCE = 1e-5  # Rounding of the seconds in degrees, minutes and seconds values
+
+
+def read_arguments(maps: dict) -> list[str]:
+    """ exiftool arguments to read every mapped tag, and every tag of the cleared groups """
+    tags = dict.fromkeys(f'-{tag}' for tag_map in maps.values() for tag in tag_map.values())
+    return ['-j', '-G1'] + [f'-{group}:all' for group in CLEARED_GROUPS] + list(tags)
+
+
+def same_tag(tag: str, other_tag: str) -> bool:
+    """ True if two mapped tags can name the same tag (e.g. "xmp:Creator" and "xmp-dc:creator") """
+    tag_group, _, tag_name = tag.lower().rpartition(':')
+    other_group, _, other_name = other_tag.lower().rpartition(':')
+    if tag_name != other_name:
+        return False
+    return not tag_group or not other_group or tag_group == other_group or \
+        tag_group.startswith(f'{other_group}-') or other_group.startswith(f'{tag_group}-')
+
+
+def tag_matches(tag: str, key: str) -> bool:
+    """ True if a mapped tag (e.g. "xmp:Creator") names a tag read by exiftool (e.g. "XMP-dc:Creator") """
+    tag_group, _, tag_name = tag.lower().rpartition(':')
+    key_group, _, key_name = key.lower().rpartition(':')
+    if tag_name != key_name:
+        return False
+    return not tag_group or tag_group == key_group or key_group.startswith(f'{tag_group}-')
+
+
+def as_text(value) -> str:
+    """ Text of a value read by exiftool -j """
+    if isinstance(value, list) and len(value) == 1:
+        value = value[0]
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def _numbers(value: str) -> Optional[list[float]]:
+    """ The numbers of a value made only of numbers and separators, None if it has text """
+    dms = DMS_PATTERN.fullmatch(value)
+    if dms:
+        degrees, minutes, seconds = (float(number) for number in dms.groups())
+        return [degrees + minutes / 60 + seconds / 3600]
+    if NOT_NUMERIC_PATTERN.search(value):
+        return None
+    return [float(number) for number in NUMBER_PATTERN.findall(value)] or None
+
+
+def same_value(current, new: str) -> bool:
+    """ True if writing the new value would leave the current value as it is """
+    current, new = as_text(current).strip(), new.strip()
+    if current == new:
+        return True
+    current_numbers, new_numbers = _numbers(current), _numbers(new)
+    if current_numbers is None or new_numbers is None or len(current_numbers) != len(new_numbers):
+        return False
+    return all(abs(a - b) <= TOLERANCE for a, b in zip(current_numbers, new_numbers))
+
+
+def _current_key(tag: str, current: dict) -> Optional[str]:
+    """ The key of the current tag named by a mapped tag """
+    return next((key for key in current.keys() if tag_matches(tag, key)), None)
+
+
+def _group(tag: str, current: dict) -> str:
+    """ Family 1 group of a mapped tag, from the current tag it names (or from the mapped tag itself) """
+    return (_current_key(tag, current) or tag).lower().rpartition(':')[0]
+
+
+def diff_tags(desired: dict[str, tuple[str, str, str]], current: dict) -> list[tuple[str, Optional[str],
+                                                                                       Optional[str], str, str]]:
+    """ Compare the tags a row would write, {tag: (write key, row key, value)}, with the current tags of its file,
+    {group:name: value}. Return the changes as (tag, write key, row key, current value, new value) tuples, the new
+    value is empty to delete a tag. Tags left in the cleared groups are deleted, with no write key nor row key. """
+    changes = []
+    matched = set()
+    for tag, (write_key, row_key, value) in desired.items():
+        key = _current_key(tag, current)
+        if key:
+            matched.add(key)
+        if not value.strip():
+            if key:
+                changes.append((tag, write_key, row_key, as_text(current[key]), ''))
+        elif not key or not same_value(current[key], value):
+            changes.append((tag, write_key, row_key, as_text(current[key]) if key else '', value))
+
+    for key, value in current.items():
+        if key not in matched and key.lower().partition(':')[0] in CLEARED_GROUPS:
+            changes.append((key, None, None, as_text(value), ''))
+    return changes
+
+
+def write_arguments(desired: dict[str, tuple[str, str, str]], current: dict, changes: list[tuple]) -> list[str]:
+    """ exiftool arguments to apply the changes: the cleared groups with changes are cleared, and all their tags
+    written again, the other changed tags are written alone """
+    changed_groups = dict.fromkeys(_group(tag, current) for tag, *_ in changes
+                                   if _group(tag, current) in CLEARED_GROUPS)
+    changed_tags = {tag for tag, *_ in changes}
+    arguments = [f'-{group}:all=' for group in changed_groups]
+    for tag, (_, _, value) in desired.items():
+        if _group(tag, current) in changed_groups:
+            if value.strip():
+                arguments.append(f'-{tag}={value}')
+        elif tag in changed_tags:
+            arguments.append(f'-{tag}={value}')
+    return arguments
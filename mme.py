@@ -8,15 +8,8 @@ standards: VRAE/ISADG/DC
 
 Usage:
     python MME.py CSV_PATH IMAGES_ROOT_PATH
-
-A JSON map is used to map Screen Name - Tag Name, for each of the standards. The file must be within the data/
-directory, in a JSON file called: maps.json. The structure is as follows:
-
-Use exiftool to write exif data on jpgs according to an input CSV and a set of mapping rules according to naming
-standards: VRAE/ISADG/DC
-
-Usage:
-    python MME.py CSV_PATH IMAGES_ROOT_PATH
+    python MME.py extract IMAGES_ROOT_PATH OUTPUT_CSV  (the embedded tags back to a CSV)
+    python MME.py serve  (a local server keeping exiftool and the file index warm, for --server and GMME)
 
 A JSON map is used to map Screen Name - Tag Name, for each of the standards. The file must be within the data/
 directory, in a JSON file called: maps.json. The structure is as follows:
@@ -41,22 +34,67 @@ directory, in a JSON file called: maps.json. The structure is as follows:
 - Rows in the CSV must have a column called "File Name"
 - vrae.config and isadg.config must be in exiftool_configs/ directory inside the data/ directory.
 
+As a library, a run yields a RowResult per row (with quiet, nothing is printed; fatal errors raise MMEError). Its
+options are grouped in a Settings (see settings.py), built from the flat options of the command line:
+
+    from mme import MME, Settings
+    for result in MME(CSV_PATH, IMAGES_ROOT_PATH, Settings.from_options(quiet=True)).results():
+        print(result.row, result.status, result.tags, result.errors, result.seconds)
+
 """
 import os
+import re
 import sys
 import csv
+import glob
 import time
+import copy
+import itertools
 import json
+import queue
+import pstats
+import cProfile
+import contextlib
 import datetime
+import asyncio
+import platform
 import argparse
-import subprocess
+import tempfile
+import threading
+import collections
 
-from typing import Optional
+from typing import Generator, Iterator, Optional, Union
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import colorama  # type: ignore
 
+from concurrency import AdaptiveConcurrency
+from exiftool_engine import AsyncExifToolPool, ExifToolPool
+from file_index import FileIndex
+from journal import Journal
+from log_writer import LogWriter
+from metrics import PhaseTimings
+from row_results import RowResult, RowResults
+from settings import Settings
+from tag_plan import TagPlan
+import metadata_diff
+import bulk_import
+import preflight
+import scheduler
+import sharding
+import xmp_inplace
+import extract
+import watch
+
 SCRIPT_PATH = os.path.dirname(os.path.abspath(__file__))
-colorama.init()
+DEFAULT_JOURNAL = f'{SCRIPT_PATH}/mme_journal.sqlite'  # Journal of --resume and --incremental, without --journal
+# Inside the Windows pyinstaller binary of the GUI, exiftool.exe is bundled with the data
+EXIFTOOL = f'{sys._MEIPASS}/exiftool.exe' if platform.system() == 'Windows' and hasattr(sys, '_MEIPASS') \
+    else 'exiftool'
+
+# Steps of a row that run exiftool commands: they yield (command prefix, argument lists) and are sent back the
+# (stdout, stderr) of every argument list, by the blocking engine or by the asyncio engine
+ExifToolCommands = Generator[tuple[list[str], list[list[str]]], list[tuple[str, str]], Optional[bool]]
 
 
 def _get_current_time() -> str:
@@ -71,54 +109,197 @@ def _get_current_time_for_filename() -> str:
     return _get_current_time().replace(':', '-')
 
 
+def _print_info(msg: str) -> None:
+    """ Print information message. """
+    print(f'{colorama.Fore.CYAN}[*] {msg}{colorama.Fore.RESET}')
+
+
+def _print_error(msg: str, fatal: bool = True) -> None:
+    """ Print error message, in red if fatal. """
+    print(f'{colorama.Fore.RED if fatal else colorama.Fore.YELLOW}[!] {msg}{colorama.Fore.RESET}')
+
+
+class MMEError(Exception):
+    """ Fatal error of a run: raised instead of exiting, so a run can be embedded in another program """
+
+
 class MME:
     """ Main class """
-    DELETE_VRAE_TAGS = ['exiftool', '-v', '-xmp-vrae:all=']
-    DELETE_ISADG_TAGS = ['exiftool', '-v', '-xmp-isadg:all=']
-    DELETE_DC_TAGS = ['exiftool', '-v', '-xmp-dc:all=']
+    DELETE_VRAE_TAGS = [EXIFTOOL, '-v', '-xmp-vrae:all=']
+    DELETE_ISADG_TAGS = [EXIFTOOL, '-v', '-xmp-isadg:all=']
+    DELETE_DC_TAGS = [EXIFTOOL, '-v', '-xmp-dc:all=']
+
+    WRITE_VRAE_TAGS = [EXIFTOOL, '-config', f'{SCRIPT_PATH}/data/exiftool_configs/vrae.config']
+    WRITE_ISADG_TAGS = [EXIFTOOL, '-config', f'{SCRIPT_PATH}/data/exiftool_configs/isadg.config']
+    WRITE_DC_TAGS = [EXIFTOOL]
+
+    DELETE_MAP = {'DELETE VRAE TAGS': DELETE_VRAE_TAGS,
+                  'DELETE ISADG TAGS': DELETE_ISADG_TAGS,
+                  'DELETE DC TAGS': DELETE_DC_TAGS}
+    WRITE_MAP = {'WRITE VRAE TAGS': ('vrae', WRITE_VRAE_TAGS),  # Write key -> (standard in maps.json, command)
+                 'WRITE ISADG TAGS': ('isadg', WRITE_ISADG_TAGS),
+                 'WRITE DC TAGS': ('dc', WRITE_DC_TAGS)}
+
+    # Single pass: clear the three groups and write every tag in one command, with both configs loaded (mme.config)
+    SINGLE_PASS_KEY = 'DELETE AND WRITE ALL TAGS'
+    SINGLE_PASS_TAGS = [EXIFTOOL, '-config', f'{SCRIPT_PATH}/data/exiftool_configs/mme.config',
+                        '-xmp-vrae:all=', '-xmp-isadg:all=', '-xmp-dc:all=']
+
+    # Grouped rows: write the tags shared by consecutive rows (e.g. the image variants of a work) with a single command
+    # for all their files (clearing the three groups first), then the other tags of each file
+    GROUP_KEY = 'DELETE AND WRITE SHARED TAGS'
+    GROUP_FILE_KEY = 'WRITE FILE TAGS'
+    GROUP_FILE_TAGS = [EXIFTOOL, '-config', f'{SCRIPT_PATH}/data/exiftool_configs/mme.config']
+    GROUP_BATCH_ROWS = 200  # Rows grouped together
+    GROUP_MAX_FILES = 50  # Files written by a shared command
+
+    SKIP_KEY = 'SKIP UNCHANGED'
+
+    # Diff: read the current tags of a batch of rows (one exiftool call per directory), and write only the changed tags
+    DIFF_KEY = 'WRITE CHANGED TAGS'
+    DIFF_UNCHANGED_KEY = 'DIFF UNCHANGED'
+    DIFF_DELETE_KEY = 'DELETE UNMAPPED TAGS'
+    DIFF_READ_KEY = 'READ CURRENT TAGS'
+    DIFF_TAGS = [EXIFTOOL, '-config', f'{SCRIPT_PATH}/data/exiftool_configs/mme.config']
+    DIFF_BATCH_ROWS = 200  # Rows whose current tags are read together
+
+    # In place: when the changes of a row are all XMP, build the new XMP packet from a copy of the current one, and
+    # write it over the current packet if it fits (no file copy), instead of rewriting the file. As every write, it runs
+    # on the writer processes, never on the one reading the current tags (MME.read_exiftool)
+    IN_PLACE_KEY = 'UPDATE XMP IN PLACE'
+    IN_PLACE_TAGS = DIFF_TAGS + ['-overwrite_original']
 
-    WRITE_VRAE_TAGS = ['exiftool', '-config', f'{SCRIPT_PATH}/data/exiftool_configs/vrae.config']
-    WRITE_ISADG_TAGS = ['exiftool', '-config', f'{SCRIPT_PATH}/data/exiftool_configs/isadg.config']
-    WRITE_DC_TAGS = ['exiftool']
+    # Bulk: clear the three groups and import the tags of a directory shard of rows with one exiftool -csv= command
+    BULK_KEY = 'BULK CSV IMPORT'
+    BULK_TAGS = [EXIFTOOL, '-config', f'{SCRIPT_PATH}/data/exiftool_configs/mme.config', '-v', '-f', '-api',
+                 f'MissingTagValue={bulk_import.DELETE_VALUE}', '-xmp-vrae:all=', '-xmp-isadg:all=', '-xmp-dc:all=']
+    BULK_BATCH_ROWS = 1000  # Rows split into directory shards together
 
-    def __init__(self, csv_filepath: str, images_root_path: str, row_progress_notify: int = 100,
-                 notify_on_broken_keys: bool = False, max_depth: int = 3):
+    ASYNC_READ_ROWS = 100  # Rows read from the CSV at a time by the --async engine, on a thread
+    SCHEDULE_ROWS = 1000  # Rows read ahead and reordered together by the --schedule mode
+
+    RESULTS_QUEUE = 100  # Row results waiting to be read by results(), before the run is held back
+
+    CHECK_KEY = 'CHECK'
+    CHECK_CONFIGS = [f'{SCRIPT_PATH}/data/exiftool_configs/vrae.config',
+                     f'{SCRIPT_PATH}/data/exiftool_configs/isadg.config']
+
+    def __init__(self, csv_filepath: str, images_root_path: str, settings: Optional[Settings] = None,
+                 exiftool: Optional[ExifToolPool] = None, read_exiftool: Optional[ExifToolPool] = None,
+                 worker_exiftools: Optional[list[ExifToolPool]] = None, file_index: Optional[FileIndex] = None,
+                 maps: Optional[dict] = None):
+        settings = settings or Settings()
+        engine, selection, output = settings.engine, settings.input, settings.output
+        self.settings: Settings = settings
         self.csv_filepath: str = csv_filepath
         self.images_root_path: str = images_root_path
-        self.row_progress_notify: int = row_progress_notify  # Every how many rows to notify progress
-        self.exif_tool_error_log: list = []
-        self.exif_tool_success_log: list = []
-        self.notify_on_broken_keys: bool = notify_on_broken_keys
-        self.max_depth = max_depth
+        self.row_progress_notify: int = output.row_progress_notify  # Every how many rows to notify progress
+        self.quiet: bool = output.quiet  # Print nothing to the console (the logs and results() report everything)
+        self.log_path: str = output.log_path or SCRIPT_PATH  # Directory of the logs
+        self.exif_tool_error_log: Union[list, LogWriter] = []  # Streamed to the log files once the run starts
+        self.exif_tool_success_log: Union[list, LogWriter] = []
+        self.log_format: str = output.log_format  # "text" or "jsonl"
+        self.log_max_bytes: int = output.log_max_bytes  # Rotate the log files over this size, 0 to never rotate
+        # Write only the tags that differ from the current tags
+        self.diff: bool = engine.diff or engine.dry_run or engine.in_place
+        self.in_place: bool = engine.in_place  # Update the XMP packet of the files in place, when only XMP tags change
+        self.dry_run: bool = engine.dry_run  # Only report the tags that would change, without writing them
+        self.diff_report: Union[list, LogWriter, None] = None  # Tags changed (or to change) by the diff mode
+        self.notify_on_broken_keys: bool = output.notify_on_broken_keys
+        self.max_depth = selection.max_depth
+        self.single_pass: bool = engine.single_pass  # Rewrite each file once, instead of once per delete/tag
+        self.bulk: bool = engine.bulk  # Write the files of each directory with one exiftool -csv= import
+        self.group_rows: bool = engine.group_rows  # Write the tags shared by consecutive rows once for all their files
+        self.async_engine: bool = engine.async_engine  # Process the rows with the asyncio pipeline, workers as taggers
+        self.check: bool = engine.check  # Only check the rows against the maps, the files and the tag types
+        self.schedule: bool = engine.schedule  # Process the rows by directory, the large files on a lane of their own
+        self.large_file_bytes: int = engine.large_file_mb * 1024 * 1024  # Files over this size go to the large lane
+        self.large_workers: int = engine.large_workers  # Large files processed in parallel
+        # Rows in flight tuned between min_workers and workers from the write latency and throughput, if adaptive
+        self.concurrency: Optional[AdaptiveConcurrency] = \
+            AdaptiveConcurrency(engine.min_workers, engine.workers) if engine.adaptive else None
+        # Long-lived exiftool processes, one per -config. Given ones are resident: started and closed by their owner
+        self.exiftool = exiftool or ExifToolPool()
+        self._resident_exiftool: bool = exiftool is not None
+        # exiftool processes reading the current tags (diff mode), never used to write: a file written by a process
+        # that read tags (-j) before can get some properties twice (e.g. vrae:work.title)
+        self.read_exiftool = read_exiftool or ExifToolPool()
+        self._resident_read_exiftool: bool = read_exiftool is not None
+        self.workers: int = engine.workers  # Rows processed in parallel, each worker thread drives its own exiftool
+        self._worker_local = threading.local()
+        self._worker_lock = threading.Lock()
+        self._worker_exiftools: list[ExifToolPool] = []  # Started by the workers of this run, closed at its end
+        # Resident exiftool processes of the workers, taken in order: the ones started past them are added to the list
+        self._resident_worker_exiftools: Optional[list[ExifToolPool]] = worker_exiftools
+        self._resident_workers: int = 0
+        # A given file index is resident (e.g. kept by mme_server.py): it is only refreshed, not loaded nor scanned
+        self.file_index = file_index or FileIndex(images_root_path, selection.max_depth)
+        self._resident_index: bool = file_index is not None
+        # Where to save/load the file index: the shared cache of the images root by default
+        self.index_filepath: Optional[str] = selection.index_filepath or \
+            (FileIndex.cache_filepath(images_root_path, selection.max_depth) if selection.index_cache else None)
+        self.shard: Optional[tuple[int, int]] = selection.shard  # (K, N): only process the rows of shard K of N
+        # Only process these CSV rows (the header is row 1), e.g. for watch.py
+        self.rows: Optional[set[int]] = selection.rows
+        journal_filepath = selection.journal_filepath
+        if self.shard and journal_filepath:
+            journal_filepath = sharding.shard_filepath(journal_filepath, *self.shard)  # Every shard has its own journal
+        self.journal_filepath: Optional[str] = journal_filepath  # Journal of the written files, if set
+        self.resume: bool = selection.resume  # Skip the files already written by the interrupted run of the same CSV
+        self.incremental: bool = selection.incremental  # Skip the files already written by any run, same values
+        self.journal: Optional[Journal] = None
+        self.run_id: Optional[str] = None
+        self.metrics = PhaseTimings()  # Duration histograms of every phase, and of every row
+        # Where to save the metrics (with histograms), if set
+        self.metrics_filepath: Optional[str] = output.metrics_filepath
+        self.profile_filepath: Optional[str] = output.profile_filepath  # Where to save a cProfile dump, if set
+        self._worker_profiles: list[cProfile.Profile] = []
+        self._start_time: float = time.time()
+        self._row_results: Optional[RowResults] = None  # Gathers the results of the rows, for results()
 
-        # Read maps and CSV
-        self.maps = self._read_maps()
-        self.rows = self._read_csv()
+        # Read maps, and count the CSV rows (they are read lazily, one at a time, by run)
+        self.maps = maps if maps is not None else self._read_maps()
+        self.row_count: int = self._count_csv_rows()
+        if self.rows is not None:
+            self.row_count = min(self.row_count, len(self.rows))
+        self.tag_plan: Optional[TagPlan] = None  # Compiled from the CSV header, when the rows are read
 
         # Validate images root path
         self._validate_image_path()
+        if self.bulk and self.diff:
+            self._error_msg('--bulk can not be combined with --diff, --dry-run or --in-place')
+        if self.bulk and self.async_engine:
+            self._error_msg('--bulk can not be combined with --async')
+        if self.group_rows and (self.bulk or self.diff or self.async_engine):
+            self._error_msg('--group-rows can not be combined with --bulk, --diff, --dry-run, --in-place or --async')
+        if self.schedule and (self.bulk or self.group_rows or self.async_engine):
+            self._error_msg('--schedule can not be combined with --bulk, --group-rows or --async')
+        if self.concurrency and (self.bulk or self.group_rows or self.async_engine or self.schedule):
+            self._error_msg('--adaptive can not be combined with --bulk, --group-rows, --async or --schedule')
+        if self.concurrency and self.workers <= self.concurrency.min_level:
+            self._error_msg('--adaptive needs more --workers (the most rows in flight) than --min-workers')
 
-    @staticmethod
-    def _info_msg(msg: str) -> None:
-        """ Print information message. """
-        print(f'{colorama.Fore.CYAN}[*] {msg}{colorama.Fore.RESET}')
+    def _info_msg(self, msg: str) -> None:
+        """ Print information message, unless quiet. """
+        if not self.quiet:
+            _print_info(msg)
 
-    @staticmethod
-    def _error_msg(msg: str, fatal: bool = True) -> None:
-        """ Print error message, if fatal is True call sys.exit. """
-        print(f'{colorama.Fore.RED if fatal else colorama.Fore.YELLOW}[!] {msg}{colorama.Fore.RESET}')
+    def _error_msg(self, msg: str, fatal: bool = True) -> None:
+        """ Print error message, unless quiet. If fatal is True raise MMEError. """
+        if not self.quiet:
+            _print_error(msg, fatal)
         if fatal:
-            sys.exit(0)
+            raise MMEError(msg)
 
-    @staticmethod
-    def _status_msg(msg) -> None:
+    def _status_msg(self, msg) -> None:
         """ Print a status message using carriage return in order to provide a working animation """
-        print(f'{colorama.Fore.GREEN}[...]{msg}{" " * 80}{colorama.Fore.RESET}', end='\r')
+        if not self.quiet:
+            print(f'{colorama.Fore.GREEN}[...]{msg}{" " * 80}{colorama.Fore.RESET}', end='\r')
 
-    @staticmethod
-    def _end_status() -> None:
+    def _end_status(self) -> None:
         """ End the status line """
-        print('')
+        if not self.quiet:
+            print('')
 
     def _read_maps(self) -> dict:  # type: ignore
         """ Read the standard maps file """
@@ -129,95 +310,829 @@ class MME:
         except FileNotFoundError as e:
             self._error_msg(f'_read_maps failed to found the file: {str(e)}')
 
-    def _read_csv(self) -> list[dict]:  # type: ignore
-        """ Read the CSV and create a list of dictionary from it """
+    def _count_csv_rows(self) -> int:  # type: ignore
+        """ Count the CSV rows for the progress notifications, counting lines instead of parsing them (a quoted value
+        spanning several lines makes it an over-estimate) """
         try:
-            with open(self.csv_filepath, 'r', encoding='utf-8') as r_file:
-                csv_reader = csv.DictReader(r_file)
-                return [d for d in csv_reader]
+            with open(self.csv_filepath, 'rb') as r_file:
+                lines, last_chunk = 0, b''
+                for chunk in iter(lambda: r_file.read(1024 * 1024), b''):
+                    lines += chunk.count(b'\n')
+                    last_chunk = chunk
+                if last_chunk and not last_chunk.endswith(b'\n'):
+                    lines += 1  # Last line without a line break
+                return max(lines - 1, 0)  # Without the header
         except FileNotFoundError as e:
             self._error_msg(f'_read_csv failed to found the file: {str(e)}')
 
-    def _save_logs(self) -> None:
-        """ Save the error and success logs for the sessions """
+    def _read_csv(self) -> Iterator[dict]:
+        """ Read the CSV lazily, yielding a dictionary per row, once the tag plan of its header is compiled """
+        with open(self.csv_filepath, 'r', encoding='utf-8', newline='') as r_file:
+            csv_reader = csv.DictReader(r_file)
+            self._compile_tag_plan(csv_reader.fieldnames or [])
+            yield from csv_reader
+
+    def _read_rows(self) -> Iterator[tuple[int, dict]]:
+        """ Read the (index, row) of every row of the CSV, with a shard only the rows of the shard, with rows only those
+        rows (the CSV is read up to the last of them) """
+        rows = enumerate(self._read_csv())
+        if self.rows is not None:
+            last_row = max(self.rows, default=1)
+            rows = ((index, row) for index, row in itertools.takewhile(lambda entry: entry[0] + 2 <= last_row, rows)
+                    if index + 2 in self.rows)
+        if not self.shard:
+            return rows
+        shard, shards = self.shard
+        return ((index, row) for index, row in rows if sharding.shard_of(row.get('File Name') or '', shards) == shard)
+
+    def _compile_tag_plan(self, columns: list[str]) -> None:
+        """ Resolve the mapped columns of the CSV header and their exiftool arguments, once per run, and report the
+        missing columns of every standard """
+        self.tag_plan = TagPlan(columns, {write_key: self.maps[standard]
+                                          for write_key, (standard, _) in MME.WRITE_MAP.items()})
+        if not (self.notify_on_broken_keys or self.check):
+            return
+        for write_key, keys in self.tag_plan.missing.items():
+            for key in keys:
+                self.exif_tool_error_log.append(f'MISSING KEY: {key} - On {write_key}: Not in the CSV header')
+            if keys:
+                self._error_msg(f'MISSING KEYS: {", ".join(keys)} - On {write_key}: Not in the CSV header',
+                                fatal=False)
+
+    def _open_logs(self) -> None:
+        """ Open the error and success logs for the session, entries are written to them as they are logged """
         output_name = self.csv_filepath.split('/')[-1].replace('.csv', '')
-        output_name = f'{SCRIPT_PATH}/%s_{output_name}-{_get_current_time_for_filename()}.txt'
-        with open(output_name % 'error_log', 'w', encoding='utf-8') as w_file:
-            w_file.write('\n'.join(self.exif_tool_error_log))
-        with open(output_name % 'success_log', 'w', encoding='utf-8') as w_file:
-            w_file.write('\n'.join(self.exif_tool_success_log))
+        extension = 'jsonl' if self.log_format == 'jsonl' else 'txt'
+        output_name = f'{self.log_path}/%s_{output_name}-{_get_current_time_for_filename()}.{extension}'
+        if self.shard:
+            output_name = sharding.shard_filepath(output_name, *self.shard)
+        listener = self._row_results.add if self._row_results else None
+        self.exif_tool_error_log = LogWriter(output_name % 'error_log', log_format=self.log_format,
+                                             max_bytes=self.log_max_bytes, listener=listener)
+        self.exif_tool_success_log = LogWriter(output_name % 'success_log', log_format=self.log_format,
+                                               max_bytes=self.log_max_bytes, listener=listener)
+        if self.diff:
+            self.diff_report = LogWriter(output_name % 'diff_report', log_format=self.log_format,
+                                         max_bytes=self.log_max_bytes, listener=listener)
+
+    def _save_logs(self) -> None:
+        """ Flush and close the error and success logs (and the diff report) for the session """
+        for log in (self.exif_tool_error_log, self.exif_tool_success_log, self.diff_report):
+            if isinstance(log, LogWriter):
+                log.close()
 
     def _validate_image_path(self):
-        """ Check that the image_path exists/is not empty """
-        if not list(os.walk(self.images_root_path)):
-            self._error_msg(f'_validate_image_path found no files/directory at: f{self.images_root_path} (Does the '
+        """ Check that the image_path exists (without walking it, the file index does) """
+        if not os.path.isdir(self.images_root_path):
+            self._error_msg(f'_validate_image_path found no files/directory at: {self.images_root_path} (Does the '
                             f'path exist?')
 
-    def _find_file_path(self, filename: str) -> Optional[str]:  # type: ignore
-        """ Return the filepath for a filename, if it exists """
-        for root, dirs, files in os.walk(self.images_root_path, followlinks=True):
-            if len(root.replace(self.images_root_path, '').split('/')) > self.max_depth:
-                return None
+    def _build_file_index(self) -> None:
+        """ Index the files under the images root once (or load the saved index), and log duplicated filenames """
+        if self._resident_index and self.file_index.directories:
+            changed = self.file_index.refresh()
+            self._info_msg(f'Refreshed the resident file index: {len(self.file_index.files)} files, {changed} changed '
+                           f'directories listed again')
+        elif self.index_filepath and self.file_index.load(self.index_filepath):
+            changed = self.file_index.refresh()
+            self._info_msg(f'Loaded the file index from "{self.index_filepath}": {len(self.file_index.files)} files, '
+                           f'{changed} changed directories listed again')
+        else:
+            self._info_msg(f'Indexing files in "{self.images_root_path}" (max depth: {self.max_depth})...')
+            self.file_index.scan()
+            self._info_msg(f'Indexed {len(self.file_index.files)} files in {len(self.file_index.directories)} '
+                           f'directories')
+
+        duplicates = self.file_index.duplicates
+        for filename, filepaths in duplicates.items():
+            found_in = ', '.join(f'"{filepath}"' for filepath in filepaths)
+            self.exif_tool_error_log.append(f'DUPLICATE FILE NAME: "{filename}" found in: {found_in}. '
+                                            f'Using: "{filepaths[0]}"')
+        if duplicates:
+            self._error_msg(f'{len(duplicates)} file names were found in more than one directory, the shallowest '
+                            f'file is used (see the error log)', fatal=False)
+
+    @contextlib.contextmanager
+    def _timed(self, phase: str, csv_index: Optional[int] = None) -> Iterator[None]:
+        """ Record the time spent in the block to the metrics of a phase: index, lookup, read, log, row, or the
+        (lowercase) key of a delete/write command. With csv_index, also to the result of the row """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record_time(phase, time.perf_counter() - start, csv_index)
+
+    def _record_time(self, phase: str, seconds: float, csv_index: Optional[int] = None) -> None:
+        """ Record a duration to the metrics of a phase, and with csv_index to the result of the row """
+        self.metrics.record(phase, seconds)
+        if self._row_results and csv_index is not None:
+            self._row_results.row_seconds[csv_index] = seconds
 
-            if filename in files:
-                return os.path.join(root, filename)
+    def _metrics_line(self) -> str:
+        """ Rows per second, row latency percentiles and the slowest phase so far, for the progress output """
+        summary = self.metrics.summary()
+        row = summary.get('row', {'count': 0, 'p50': 0, 'p95': 0, 'p99': 0})
+        line = f'Metrics: {row["count"] / max(time.time() - self._start_time, 1e-9):.2f} rows/s, row p50/p95/p99: ' \
+               f'{row["p50"] * 1000:.0f}/{row["p95"] * 1000:.0f}/{row["p99"] * 1000:.0f} ms'
+        phases = {phase: phase_summary for phase, phase_summary in summary.items() if phase != 'row'}
+        if phases:
+            slowest = max(phases, key=lambda phase: phases[phase]['total'])
+            line += f', slowest phase: {slowest} ({phases[slowest]["total"]:.1f}s, p95: ' \
+                    f'{phases[slowest]["p95"] * 1000:.0f} ms)'
+        return line
+
+    def _print_metrics(self) -> None:
+        """ Print the count, total time and latency percentiles of every phase """
+        self._info_msg('Timings (count, total, p50/p95/p99/max):')
+        for phase, summary in sorted(self.metrics.summary().items(), key=lambda item: -item[1]['total']):
+            self._info_msg(f'    {phase}: {summary["count"]}, {summary["total"]:.2f}s, '
+                           f'{"/".join(f"{summary[key] * 1000:.1f}" for key in ("p50", "p95", "p99", "max"))} ms')
+
+    def _find_file_path(self, filename: str) -> Optional[str]:
+        """ Return the filepath for a filename, if it exists """
+        return self.file_index.find(filename)
 
     def run(self):
-        """ Main entry-point for the application """
-        start_time = time.time()
-        self._info_msg(f'Starting script with CSV path: "{self.csv_filepath}", {len(self.rows)} rows, and '
+        """ Main entry-point for the application (profiled with cProfile, if profile_filepath is set) """
+        if not self.profile_filepath:
+            return self._run()
+        profile = cProfile.Profile()
+        try:
+            profile.runcall(self._run)
+        finally:
+            self._save_profile(profile)
+
+    def results(self) -> Iterator[RowResult]:
+        """ Run, and yield the result of every row in CSV row order (as the logs: with bulk and group_rows, the rows
+        whose file is not found come first in their batch), as the rows are processed. The run happens on a thread,
+        held back while RESULTS_QUEUE results wait to be read. Closing the iterator early stops the run (the logs and
+        journal are closed as after an error), and an error of the run (MMEError if fatal) is raised by it """
+        results = queue.Queue(maxsize=MME.RESULTS_QUEUE)
+        stopped = threading.Event()
+        done = object()
+
+        def put(item) -> None:
+            while True:
+                if stopped.is_set():
+                    raise MMEError('Run stopped by the reader of its results')
+                try:
+                    return results.put(item, timeout=0.1)
+                except queue.Full:
+                    continue  # Check whether the reader stopped
+
+        def run() -> None:
+            try:
+                self.run()
+                item = done
+            except BaseException as e:  # Raised by the reader, after the results before it
+                item = e
+            with contextlib.suppress(MMEError):  # The reader stopped
+                put(item)
+
+        self._row_results = RowResults(put, {}, {})
+        thread = threading.Thread(target=run, name='mme-run', daemon=True)
+        thread.start()
+        try:
+            while (item := results.get()) is not done:
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stopped.set()
+            thread.join()
+            self._row_results = None
+
+    def _save_profile(self, profile: cProfile.Profile) -> None:
+        """ Save the profile of the main thread, merged with the profiles of the workers, as a pstats dump """
+        stats = pstats.Stats(profile)
+        for worker_profile in self._worker_profiles:
+            stats.add(worker_profile)
+        stats.dump_stats(self.profile_filepath)
+        self._info_msg(f'Profile written to: "{self.profile_filepath}" (python -m pstats "{self.profile_filepath}")')
+
+    def _run(self):
+        """ Process every row, and write the logs """
+        start_time = self._start_time = time.time()
+        self._info_msg(f'Starting script with CSV path: "{self.csv_filepath}", {self.row_count} rows, and '
                        f'root image path: "{self.images_root_path}" at {_get_current_time()}')
+        if self.shard:
+            self._info_msg(f'Processing the rows of shard {self.shard[0]} of {self.shard[1]}')
         self._info_msg(f'This might take a while...')
+        self._open_logs()
+
+        try:
+            with self._timed('index'):
+                self._build_file_index()
+            if self.check:
+                self._check_rows()
+            else:
+                self._start_journal()
+                self._process_rows()
+                if self.journal:
+                    self.journal.finish_run(self.run_id)
+            if self._row_results:
+                self._row_results.flush()  # The last row
+        finally:
+            self._close_exiftool()
+            if self.journal:
+                self.journal.close()  # An interrupted run can be resumed, up to the last committed rows
+            # 4 - Close error/success logs, an interrupted run keeps every entry logged so far
+            with self._timed('log'):
+                self._save_logs()
+
+        # Writing files changes the mtime of their directories: list them again before saving the index
+        if self.index_filepath:
+            with self._timed('index'):
+                self.file_index.refresh()
+                self.file_index.save(self.index_filepath)
+
+        self._end_status()
+        self._info_msg(f'Logs written to: "{self.exif_tool_error_log.filepath}" and '
+                       f'"{self.exif_tool_success_log.filepath}"')
+        if self.diff_report is not None:
+            self._info_msg(f'{"Tags to change" if self.dry_run else "Changed tags"} ({len(self.diff_report)}) '
+                           f'reported in: "{self.diff_report.filepath}"')
+        self._info_msg(f'Finished processing {self.row_count} with {len(self.exif_tool_error_log)} errors '
+                       f'and {len(self.exif_tool_success_log)} successes at {_get_current_time()}')
+        end_time = time.time()
+        self._print_metrics()
+        if self.metrics_filepath:
+            self.metrics.save(self.metrics_filepath, csv_filepath=self.csv_filepath, rows=self.row_count,
+                              workers=self.workers, seconds=round(end_time - start_time, 3))
+            self._info_msg(f'Metrics written to: "{self.metrics_filepath}"')
+        self._info_msg(f'Script took: {str(datetime.timedelta(seconds=(end_time - start_time)))}')
+
+    def _start_journal(self) -> None:
+        """ Open the journal, and start a new run (or resume the interrupted run of the same CSV) """
+        if not self.journal_filepath:
+            if self.resume or self.incremental:
+                self._error_msg('--resume and --incremental need a journal file')
+            return
+        self.journal = Journal(self.journal_filepath, self.maps)
+        self.run_id, resumed = self.journal.start_run(self.csv_filepath, resume=self.resume)
+        if resumed:
+            self._info_msg(f'Resuming the interrupted run of "{self.csv_filepath}" from the journal: '
+                           f'"{self.journal_filepath}"')
+        elif self.resume:
+            self._error_msg(f'No interrupted run of "{self.csv_filepath}" in the journal, starting a new run',
+                            fatal=False)
+
+    def _process_rows(self) -> None:
+        """ Delete and write the tags of every row, read lazily from the CSV, on self.workers threads """
+        rows_read = 0
+        rows = self._read_rows()
+        rows = self._read_current_tags(rows) if self.diff else ((index, row, None) for index, row in rows)
+        if self.bulk:
+            rows_read = self._process_bulk(rows)
+        elif self.group_rows:
+            rows_read = self._process_groups(rows)
+        elif self.schedule:
+            rows_read = self._process_scheduled(rows)
+        elif self.concurrency:
+            rows_read = self._process_adaptive(rows)
+        elif self.async_engine:
+            rows_read = asyncio.run(self._process_rows_async(rows))
+        elif self.workers <= 1:
+            for index, row, current_tags in rows:
+                rows_read += 1
+                self._notify_progress(index)
+                self._process_row(index, row, current_tags)
+        else:
+            # Rows are submitted in order, and their logs merged in the same order, keeping a bounded number in flight
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                pending = collections.deque()
+                for index, row, current_tags in rows:
+                    rows_read += 1
+                    pending.append((index, executor.submit(self._process_row_in_worker, index, row, current_tags)))
+                    if len(pending) >= self.workers * 2:
+                        self._merge_worker_logs(*pending.popleft())
+                while pending:
+                    self._merge_worker_logs(*pending.popleft())
+        self.row_count = rows_read  # The line count is an estimate, report the rows actually read
+
+    def _process_scheduled(self, rows: Iterator[tuple[int, dict, Optional[dict]]]) -> int:
+        """ Process the rows SCHEDULE_ROWS at a time, in the order of scheduler.schedule: by directory, the files over
+        large_file_bytes on a lane of large_workers threads, the others on self.workers threads. A window is submitted
+        before the logs of the previous one are merged, in CSV row order, and return the number of rows read """
+        rows_read = 0
+        with ThreadPoolExecutor(max_workers=max(self.workers, 1)) as executor, \
+                ThreadPoolExecutor(max_workers=max(self.large_workers, 1)) as large_executor:
+            previous, previous_filepaths = None, set()  # (window, CSV index -> (task future, position in the task))
+            while True:
+                window = list(itertools.islice(rows, MME.SCHEDULE_ROWS))
+                if not window:
+                    break
+                rows_read += len(window)
+                with self._timed('schedule'):
+                    small, large = scheduler.schedule(window, self._find_file_path, self.large_file_bytes)
+                filepaths = {filepath for lane in (small, large) for filepath, _ in lane if filepath}
+                if previous and filepaths & previous_filepaths:
+                    self._merge_scheduled(*previous)  # A file in both windows: its rows must run in CSV order
+                    previous = None
+                tasks = {}
+                for lane_executor, lane in ((large_executor, large), (executor, small)):  # Large files start first
+                    for _, entries in lane:
+                        future = lane_executor.submit(self._process_task_in_worker, entries)
+                        tasks.update((index, (future, position)) for position, (index, _, _) in enumerate(entries))
+                if previous:
+                    self._merge_scheduled(*previous)
+                previous, previous_filepaths = (window, tasks), filepaths
+            if previous:
+                self._merge_scheduled(*previous)
+        return rows_read
+
+    def _process_adaptive(self, rows: Iterator[tuple[int, dict, Optional[dict]]]) -> int:
+        """ Process the rows on up to self.workers threads, with as many rows in flight as self.concurrency allows,
+        merging their logs in CSV row order, and return the number of rows read """
+        rows_read = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency.max_level) as executor:
+            pending = collections.deque()
+            for index, row, current_tags in rows:
+                rows_read += 1
+                while len(pending) >= self.concurrency.max_level * 2 or (pending and pending[0][1].done()):
+                    self._merge_worker_logs(*pending.popleft())
+                self.concurrency.acquire()
+                pending.append((index, executor.submit(self._process_row_measured, index, row, current_tags)))
+            while pending:
+                self._merge_worker_logs(*pending.popleft())
+        return rows_read
+
+    def _process_row_measured(self, index: int, row: dict,
+                              current_tags: Optional[dict]) -> tuple[list[str], list[str], Optional[list[str]]]:
+        """ Process a row on a worker, and report its time and the size of its file to self.concurrency """
+        start = time.perf_counter()
+        try:
+            return self._process_row_in_worker(index, row, current_tags)
+        finally:
+            filepath = self._find_file_path(row['File Name']) if row.get('File Name') else None
+            self.concurrency.release(time.perf_counter() - start, scheduler.file_size(filepath))
+
+    def _process_task_in_worker(self, entries: list[tuple[int, dict, Optional[dict]]]) -> list[tuple]:
+        """ Process the rows of a file in CSV order on a worker, and return the log entries of every row """
+        return [self._run_in_worker(MME._process_row, index, row, current_tags)
+                for index, row, current_tags in entries]
+
+    def _merge_scheduled(self, window: list[tuple[int, dict, Optional[dict]]],
+                         tasks: dict[int, tuple[Future, int]]) -> None:
+        """ Wait for the rows of a scheduled window, and add their log entries to the session logs in CSV row order """
+        for index, _, _ in window:
+            future, position = tasks[index]
+            self._notify_progress(index)
+            self._merge_logs(*future.result()[position])
+
+    def _check_rows(self) -> None:
+        """ Check every row, read lazily from the CSV, without running exiftool: its file exists (and no other row
+        writes it), and the values of the tags with a checked type are valid. The maps are checked against the tags
+        defined by the configs first """
+        tag_maps = {write_key: self.maps[standard] for write_key, (standard, _) in MME.WRITE_MAP.items()}
+        config_tags = {}
+        for config_filepath in MME.CHECK_CONFIGS:
+            try:
+                config_tags.update(preflight.read_config_tags(config_filepath))
+            except (OSError, ValueError) as e:
+                self._error_msg(f'_check_rows failed to read the tags of "{config_filepath}": {str(e)}', fatal=False)
+        for write_key, key, tag in preflight.undefined_tags(tag_maps, config_tags):
+            self.exif_tool_error_log.append(f'On {write_key}: Row key: {key}, ERROR: "Tag {tag} is not defined '
+                                            f'by the exiftool configs"')
+            self._error_msg(f'On {write_key}: Row key: {key}, ERROR: "Tag {tag} is not defined by the exiftool '
+                            f'configs"', fatal=False)
+
+        rows_read = 0
+        checks = None
+        written_by = {}  # Filepath -> CSV row index of the first row writing it
+        for index, row in self._read_rows():
+            rows_read += 1
+            self._notify_progress(index)
+            if checks is None:  # The header is read with the first row
+                checks = preflight.value_checks(tag_maps, set(row), config_tags)
+            csv_index = index + 2
+            with self._timed('row', csv_index):
+                errors = []
+                filename = self.__get_file_name(csv_index, row)
+                filepath = self.__get_file_path(csv_index, filename) if filename else None
+                if filepath in written_by:
+                    errors.append((MME.CHECK_KEY, None, f'Also written by row {written_by[filepath]}, the last row '
+                                                        f'wins'))
+                elif filepath:
+                    written_by[filepath] = csv_index
+                for write_key, key, tag, check in checks:
+                    error = check(row[key]) if row[key] else None  # Empty values delete the tag
+                    if error:
+                        errors.append((write_key, key, f'{error} in {tag} (value: {row[key]})'))
+
+                for write_key, key, error in errors:
+                    row_key = f' Row key: {key},' if key else ''
+                    self.exif_tool_error_log.append(f'On {write_key}: Row: "{csv_index}", filepath: '
+                                                    f'"{filepath or filename}",{row_key} ERROR: "{error}"')
+                    self._error_msg(f'On {write_key}: Row: "{csv_index}", filepath: "{filepath or filename}",'
+                                    f'{row_key} ERROR: "{error}"', fatal=False)
+                if filepath and not errors:
+                    self.exif_tool_success_log.append(f'On {MME.CHECK_KEY}: Row: "{csv_index}", filepath: '
+                                                      f'"{filepath}"')
+        self.row_count = rows_read  # The line count is an estimate, report the rows actually read
+
+    def _notify_progress(self, index: int) -> None:
+        """ Print the progress every row_progress_notify rows """
+        if index % self.row_progress_notify == 0:
+            if index != 0:
+                self._end_status()
+            concurrency = f', Concurrency: {self.concurrency}' if self.concurrency else ''
+            self._info_msg(f'Progress: {index}/{self.row_count}. Errors: {len(self.exif_tool_error_log)}, '
+                           f'Successes: {len(self.exif_tool_success_log)}{concurrency}')
+            if index != 0:
+                self._info_msg(self._metrics_line())
+
+    def _process_row_in_worker(self, index: int, row: dict,
+                               current_tags: Optional[dict]) -> tuple[list[str], list[str], Optional[list[str]]]:
+        """ Process a row on a worker, and return the (error, success, diff report) log entries of the row """
+        return self._run_in_worker(MME._process_row, index, row, current_tags)
+
+    def _run_in_worker(self, method, *args) -> tuple[list[str], list[str], Optional[list[str]]]:
+        """ Run a method on a copy of this MME, with empty logs and the exiftool processes of the current thread, and
+        return its (error, success, diff report) log entries """
+        worker = self._worker_copy()
+        worker.exiftool = self._get_worker_exiftool()
+        if self.profile_filepath:
+            self._get_worker_profile().runcall(method, worker, *args)
+        else:
+            method(worker, *args)
+        return worker.exif_tool_error_log, worker.exif_tool_success_log, worker.diff_report
+
+    def _worker_copy(self) -> 'MME':
+        """ A copy of this MME with empty logs, to process rows apart and merge their logs in CSV order """
+        worker = copy.copy(self)
+        worker.exif_tool_error_log, worker.exif_tool_success_log = [], []
+        worker.diff_report = [] if self.diff else None
+        return worker
+
+    def _merge_worker_logs(self, index: int, future: Future) -> None:
+        """ Wait for a row processed by a worker, and add its log entries to the session logs """
+        self._notify_progress(index)
+        self._merge_logs(*future.result())
+
+    def _merge_logs(self, errors: list[str], successes: list[str], diff_report: Optional[list[str]]) -> None:
+        """ Add the log entries of a worker to the session logs """
+        self.exif_tool_error_log.extend(errors)
+        self.exif_tool_success_log.extend(successes)
+        if diff_report:
+            self.diff_report.extend(diff_report)
+
+    async def _process_rows_async(self, rows: Iterator[tuple[int, dict, Optional[dict]]]) -> int:
+        """ Delete and write the tags of every row with an asyncio pipeline, and return the number of rows read:
+        - a reader, reading the CSV (and in diff mode the current tags) ASYNC_READ_ROWS rows at a time on a thread,
+        - a resolver, finding the file of every row and checking the journal,
+        - self.workers taggers, each running the commands of a row on its own exiftool processes,
+        - a log sink, merging the logs of the rows in CSV order.
+        The queues between the stages are bounded, and so are the rows in flight (released by the sink), so a slow row
+        or a slow stage holds the reader back instead of growing the memory """
+        taggers = max(self.workers, 1)
+        in_flight = asyncio.Semaphore(taggers * 4)
+        resolve_queue, tag_queue, log_queue = (asyncio.Queue(maxsize=taggers * 2) for _ in range(3))
+        order = collections.deque()  # Indexes of the rows in flight, in CSV order (a shard or rows= skips some)
+        rows_read = 0
+
+        async def read() -> None:
+            nonlocal rows_read
+            while batch := await asyncio.to_thread(lambda: list(itertools.islice(rows, MME.ASYNC_READ_ROWS))):
+                for index, row, current_tags in batch:
+                    await in_flight.acquire()
+                    order.append(index)
+                    await resolve_queue.put((index, row, current_tags))
+                rows_read += len(batch)
+            await resolve_queue.put(None)
+
+        async def resolve() -> None:
+            while (item := await resolve_queue.get()) is not None:
+                index, row, current_tags = item
+                worker, start = self._worker_copy(), time.perf_counter()
+                resolved = worker.__resolve_row(index, row)
+                if resolved:
+                    await tag_queue.put((index, row, current_tags, worker, resolved, start))
+                else:
+                    self._record_time('row', time.perf_counter() - start, index + 2)
+                    await log_queue.put((index, worker))
+            for _ in range(taggers):
+                await tag_queue.put(None)
+
+        async def tag() -> None:
+            async with AsyncExifToolPool() as exiftool:
+                while (item := await tag_queue.get()) is not None:
+                    index, row, current_tags, worker, resolved, start = item
+                    await self._run_commands_async(worker.__tag_row(index, row, *resolved, current_tags), exiftool)
+                    self._record_time('row', time.perf_counter() - start, index + 2)
+                    await log_queue.put((index, worker))
+
+        async def sink() -> None:
+            done = {}
+            while (item := await log_queue.get()) is not None:
+                done[item[0]] = item[1]
+                while order and order[0] in done:
+                    index = order.popleft()
+                    worker = done.pop(index)
+                    self._notify_progress(index)
+                    self._merge_logs(worker.exif_tool_error_log, worker.exif_tool_success_log, worker.diff_report)
+                    in_flight.release()
+
+        stages = [asyncio.create_task(read()), asyncio.create_task(resolve())] + \
+                 [asyncio.create_task(tag()) for _ in range(taggers)]
+        log_sink = asyncio.create_task(sink())
+        try:
+            await asyncio.gather(*stages)
+            await log_queue.put(None)
+            await log_sink
+        finally:
+            for task in stages + [log_sink]:
+                task.cancel()  # After an error in a stage, stop the others (closing their exiftool processes)
+            await asyncio.gather(*stages, log_sink, return_exceptions=True)
+        return rows_read
+
+    @staticmethod
+    async def _run_commands_async(commands: ExifToolCommands, exiftool: AsyncExifToolPool):
+        """ Run the exiftool commands requested by a row (see __tag_row) on an asyncio exiftool pool, return the
+        row's result """
+        try:
+            command = next(commands)
+            while True:
+                command = commands.send(await exiftool.run_batch(*command))
+        except StopIteration as stop:
+            return stop.value
+
+    def _process_bulk(self, rows: Iterator[tuple[int, dict, None]]) -> int:
+        """ Write the rows BULK_BATCH_ROWS at a time, with one exiftool -csv= import per directory shard of a batch
+        (the shards of a batch run on the workers), and return the number of rows read """
+        rows_read = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                batch = list(itertools.islice(rows, MME.BULK_BATCH_ROWS))
+                if not batch:
+                    return rows_read
+                rows_read += len(batch)
+                shards = self._bulk_shards(batch)
+                if self.workers <= 1:
+                    for shard in shards:
+                        self._process_bulk_shard(shard)
+                else:
+                    futures = [executor.submit(self._run_in_worker, MME._process_bulk_shard, shard)
+                               for shard in shards]
+                    for future in futures:
+                        self._merge_logs(*future.result())
+
+    def _bulk_shards(self, batch: list[tuple[int, dict, None]]) -> list[list[tuple[int, dict, str, Optional[str]]]]:
+        """ Find the files of a batch of rows, and split them into shards of (CSV row index, row, filepath, row hash)
+        per directory. A file of several rows goes into the next shard of its directory, so its rows are applied in
+        order """
+        shards = {}  # Directory -> shards
+        for index, row, _ in batch:
+            self._notify_progress(index)
+            resolved = self.__resolve_row(index, row)
+            if not resolved:
+                continue  # Next row
+            csv_index, _, filepath, row_hash = resolved
+
+            directory_shards = shards.setdefault(os.path.dirname(filepath), [])
+            shard = next((shard for shard in directory_shards if filepath not in {entry[2] for entry in shard}), None)
+            if shard is None:
+                shard = []
+                directory_shards.append(shard)
+            shard.append((csv_index, row, filepath, row_hash))
+        return [shard for directory_shards in shards.values() for shard in directory_shards]
+
+    def _process_bulk_shard(self, shard: list[tuple[int, dict, str, Optional[str]]]) -> None:
+        """ Delete and write the tags of the files of a directory shard with one exiftool -csv= import. exiftool does
+        not name the file of a tag value warning: the files of a shard with warnings are written again one at a time
+        (as with --single-pass), so every warning is reported under its row and row key """
+        self._status_msg(f'{shard[0][0] - 2}/{self.row_count} - {MME.BULK_KEY} of {len(shard)} files in '
+                         f'{os.path.dirname(shard[0][2])}')
+        with self._timed(MME.BULK_KEY.lower()):
+            successes, errors, warnings = self.__bulk_command(shard)
 
-        for index, row in enumerate(self.rows):
-            if index % self.row_progress_notify == 0:
-                if index != 0:
+        for csv_index, row, filepath, row_hash in shard:
+            if filepath in errors:
+                for error in errors[filepath]:
+                    self.exif_tool_error_log.append(f'On {MME.BULK_KEY}: Row: "{csv_index}", filepath: "{filepath}", '
+                                                    f'ERROR: "{error}"')
                     self._end_status()
-                self._info_msg(f'Progress: {index}/{len(self.rows)}. Errors: {len(self.exif_tool_error_log)}, '
-                               f'Successes: {len(self.exif_tool_success_log)}')
+                    self._error_msg(f'On {MME.BULK_KEY}: Row: "{csv_index}", filepath: "{filepath}", ERROR: '
+                                    f'"{error}"', fatal=False)
+                continue  # Next row
+            if warnings:
+                with self._timed(MME.SINGLE_PASS_KEY.lower()):
+                    written = self._run_commands(self.__single_pass_command(csv_index, row, filepath))
+            else:
+                success = MME._prettify_success_message(successes.get(filepath, ''))
+                self.exif_tool_success_log.append(f'On {MME.BULK_KEY}: Row: "{csv_index}", filepath: "{filepath}", '
+                                                  f'SUCCESS: "{success}"')
+                for write_key in MME.WRITE_MAP.keys():
+                    self.exif_tool_success_log.append(f'On {write_key}: Row: "{csv_index}", filepath: "{filepath}"')
+                written = True
+
+            # Journal the file, if it was written without errors
+            if self.journal and written:
+                self.journal.record(filepath, row_hash, self.run_id)
 
-            csv_index = index + 2  # CSV Row index, for proper debugging
+    def _process_groups(self, rows: Iterator[tuple[int, dict, None]]) -> int:
+        """ Write the rows GROUP_BATCH_ROWS at a time, grouping consecutive rows that share most of their tag values
+        (the groups of a batch run on the workers), and return the number of rows read """
+        rows_read = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                batch = list(itertools.islice(rows, MME.GROUP_BATCH_ROWS))
+                if not batch:
+                    return rows_read
+                rows_read += len(batch)
+                groups = self._row_groups(batch)
+                if self.workers <= 1:
+                    for group in groups:
+                        self._process_group(group)
+                else:
+                    futures = [executor.submit(self._run_in_worker, MME._process_group, group) for group in groups]
+                    for future in futures:
+                        self._merge_logs(*future.result())
 
-            # 1 - Check the row has a "File Name"
-            filename = self.__get_file_name(csv_index, row)
-            if not filename:
+    def _row_groups(self, batch: list[tuple[int, dict, None]]) -> list[list[tuple[int, dict, str, Optional[str]]]]:
+        """ Split the rows of a batch into groups of consecutive rows sharing the values of at least half of the tags
+        (units) of the tag plan, each file once per group, in CSV order """
+        groups, shared = [], set()
+        for index, row, _ in batch:
+            self._notify_progress(index)
+            resolved = self.__resolve_row(index, row)
+            if not resolved:
                 continue  # Next row
+            csv_index, _, filepath, row_hash = resolved
+
+            group = groups[-1] if groups else []
+            if group and len(group) < MME.GROUP_MAX_FILES and filepath not in {entry[2] for entry in group}:
+                group_shared = self.tag_plan.shared_units([group[0][1], row], shared)
+                if len(group_shared) * 2 >= len(self.tag_plan.units):
+                    group.append((csv_index, row, filepath, row_hash))
+                    shared = group_shared
+                    continue  # Next row
+            groups.append([(csv_index, row, filepath, row_hash)])
+            shared = set(range(len(self.tag_plan.units)))
+        return groups
+
+    def _process_group(self, group: list[tuple[int, dict, str, Optional[str]]]) -> None:
+        """ Delete and write the tags of a group of rows: a single row is written as with --single-pass """
+        if len(group) == 1:
+            csv_index, row, filepath, row_hash = group[0]
+            self._status_msg(f'{csv_index - 2}/{self.row_count} - {MME.SINGLE_PASS_KEY} on '
+                             f'{os.path.basename(filepath)}')
+            with self._timed(MME.SINGLE_PASS_KEY.lower()):
+                written = [self._run_commands(self.__single_pass_command(csv_index, row, filepath))]
+        else:
+            self._status_msg(f'{group[0][0] - 2}/{self.row_count} - {MME.GROUP_KEY} of {len(group)} files')
+            with self._timed(MME.GROUP_KEY.lower()):
+                written = self._run_commands(self.__group_command(group))
+
+        # Journal the files written without errors
+        for (_, _, filepath, row_hash), file_written in zip(group, written):
+            if self.journal and file_written:
+                self.journal.record(filepath, row_hash, self.run_id)
+
+    def _read_current_tags(self, rows: Iterator[tuple[int, dict]]) -> Iterator[tuple[int, dict, Optional[dict]]]:
+        """ Add the current tags of its file to every row, read DIFF_BATCH_ROWS rows at a time, with one exiftool
+        call per directory of the batch, on self.read_exiftool (the writes run on other processes) """
+        read_arguments = metadata_diff.read_arguments(self.maps)
+        while True:
+            batch = list(itertools.islice(rows, MME.DIFF_BATCH_ROWS))
+            if not batch:
+                return
+            directories = {}  # Directory -> filepaths of the batch
+            for _, row in batch:
+                filepath = self._find_file_path(row['File Name']) if row.get('File Name') else None
+                if filepath:
+                    directories.setdefault(os.path.dirname(filepath), {})[filepath] = None
+            current_tags = {}
+            for filepaths in directories.values():
+                self._status_msg(f'{batch[0][0]}/{self.row_count} - {MME.DIFF_READ_KEY} of {len(filepaths)} files')
+                with self._timed('read'):
+                    stdout, _ = self.read_exiftool.run(MME.DIFF_TAGS, read_arguments + list(filepaths))
+                try:
+                    entries = json.loads(stdout) if stdout.strip() else []
+                except json.JSONDecodeError:
+                    entries = []  # Every file of the directory is reported as unreadable
+                current_tags.update((entry.pop('SourceFile'), entry) for entry in entries)
+            for index, row in batch:
+                filepath = self._find_file_path(row['File Name']) if row.get('File Name') else None
+                yield index, row, current_tags.get(filepath)
+
+    def _get_worker_exiftool(self) -> ExifToolPool:
+        """ Return the exiftool processes of the current worker thread, started on first use """
+        exiftool = getattr(self._worker_local, 'exiftool', None)
+        if exiftool is None:
+            with self._worker_lock:
+                if self._resident_worker_exiftools is None:
+                    exiftool = ExifToolPool()
+                    self._worker_exiftools.append(exiftool)
+                else:
+                    if self._resident_workers == len(self._resident_worker_exiftools):
+                        self._resident_worker_exiftools.append(ExifToolPool())
+                    exiftool = self._resident_worker_exiftools[self._resident_workers]
+                    self._resident_workers += 1
+            self._worker_local.exiftool = exiftool
+        return exiftool
+
+    def _get_worker_profile(self) -> cProfile.Profile:
+        """ Return the profiler of the current worker thread (cProfile only sees the thread it runs in) """
+        profile = getattr(self._worker_local, 'profile', None)
+        if profile is None:
+            profile = self._worker_local.profile = cProfile.Profile()
+            with self._worker_lock:
+                self._worker_profiles.append(profile)
+        return profile
+
+    def _close_exiftool(self) -> None:
+        """ Stop the exiftool processes of the main thread and of every worker, except the resident ones """
+        if not self._resident_exiftool:
+            self.exiftool.close()
+        if not self._resident_read_exiftool:
+            self.read_exiftool.close()
+        for exiftool in self._worker_exiftools:
+            exiftool.close()
+        self._worker_exiftools.clear()
+
+    def _process_row(self, index: int, row: dict, current_tags: Optional[dict] = None) -> None:
+        """ Delete and write the tags of a row (in diff mode, only the tags that differ from current_tags), timed """
+        with self._timed('row', index + 2):
+            resolved = self.__resolve_row(index, row)
+            if resolved:
+                self._run_commands(self.__tag_row(index, row, *resolved, current_tags))
+
+    def _run_commands(self, commands: ExifToolCommands):
+        """ Run the exiftool commands requested by a row (see __tag_row) on self.exiftool, return the row's result """
+        try:
+            command = next(commands)
+            while True:
+                command = commands.send(self.exiftool.run_batch(*command))
+        except StopIteration as stop:
+            return stop.value
+
+    def __resolve_row(self, index: int, row: dict) -> Optional[tuple[int, str, str, Optional[str]]]:
+        """ Find the file of a row, return its (CSV row index, filename, filepath, row hash), or None (logged) if the
+        row has no file, or the journal shows it was written already """
+        csv_index = index + 2  # CSV Row index, for proper debugging
+
+        # 1 - Check the row has a "File Name"
+        filename = self.__get_file_name(csv_index, row)
+        if not filename:
+            return None  # Next row
+        with self._timed('lookup'):
             filepath = self.__get_file_path(csv_index, filename)
-            if not filepath:
-                continue  # Next row
+        if not filepath:
+            return None  # Next row
 
-            # 2 - Delete tags
-            delete_map = {'DELETE VRAE TAGS': MME.DELETE_VRAE_TAGS,
-                          'DELETE ISADG TAGS': MME.DELETE_ISADG_TAGS,
-                          'DELETE DC TAGS': MME.DELETE_DC_TAGS}
+        # Skip the file if the journal shows it was written with the same values, and did not change since
+        row_hash = self.journal.row_hash(row) if self.journal else None
+        if (self.resume or self.incremental) and \
+                self.journal.is_current(filepath, row_hash, run_id=None if self.incremental else self.run_id):
+            self.exif_tool_success_log.append(f'On {MME.SKIP_KEY}: Row: "{csv_index}", filepath: "{filepath}"')
+            return None  # Next row
+        if self._row_results:
+            self._row_results.row_tags[csv_index] = {tag: write_key for tag, (write_key, _, value)
+                                                     in self.tag_plan.desired(row).items() if value}
+        return csv_index, filename, filepath, row_hash
+
+    def __tag_row(self, index: int, row: dict, csv_index: int, filename: str, filepath: str, row_hash: Optional[str],
+                  current_tags: Optional[dict]) -> ExifToolCommands:
+        """ Delete and write the tags of a row. The exiftool commands are yielded as (command prefix, argument lists)
+        and their (stdout, stderr) results sent back, so the same steps run on the blocking and the asyncio engines """
+        # 2 & 3 - Write only the changed tags, or delete and write tags in a single file rewrite
+        if self.diff:
+            self._status_msg(f'{index}/{self.row_count} - {MME.DIFF_KEY} on {filename}')
+            with self._timed(MME.DIFF_KEY.lower()):
+                written = yield from self.__diff_command(csv_index, row, filepath, current_tags)
+        elif self.single_pass:
+            self._status_msg(f'{index}/{self.row_count} - {MME.SINGLE_PASS_KEY} on {filename}')
+            with self._timed(MME.SINGLE_PASS_KEY.lower()):
+                written = yield from self.__single_pass_command(csv_index, row, filepath)
+        else:
+            written = True
 
-            for delete_key in delete_map.keys():
-                self._status_msg(f'{index}/{len(self.rows)} - {delete_key} on {filename}')
-                if not self.__delete_command(csv_index, filepath, delete_key, delete_map[delete_key]):
+            # 2 - Delete tags
+            for delete_key, delete_command in MME.DELETE_MAP.items():
+                self._status_msg(f'{index}/{self.row_count} - {delete_key} on {filename}')
+                with self._timed(delete_key.lower()):
+                    deleted = yield from self.__delete_command(csv_index, filepath, delete_key, delete_command)
+                if not deleted:
+                    written = False
                     continue  # Next row
 
             # 3 - Write tags
-            write_map = {'WRITE VRAE TAGS': [self.maps['vrae'], MME.WRITE_VRAE_TAGS],
-                         'WRITE ISADG TAGS': [self.maps['isadg'], MME.WRITE_ISADG_TAGS],
-                         'WRITE DC TAGS': [self.maps['dc'], MME.WRITE_DC_TAGS]}
-
-            for write_key in write_map.keys():
-                tag_map, write_command = write_map[write_key]
-                self._status_msg(f'{index}/{len(self.rows)} - {write_key} on {filename}')
+            for write_key, (_, write_command) in MME.WRITE_MAP.items():
+                self._status_msg(f'{index}/{self.row_count} - {write_key} on {filename}')
 
                 # Mark row as successfully written if there were no errors
-                if self.__write_command(csv_index, row, filepath, write_key, tag_map, write_command):
+                with self._timed(write_key.lower()):
+                    tags_written = yield from self.__write_command(csv_index, row, filepath, write_key,
+                                                                   write_command)
+                if tags_written:
                     self.exif_tool_success_log.append(f'On {write_key}: Row: "{csv_index}", filepath: "{filepath}"')
+                else:
+                    written = False
 
-        # 4 - Write error/success logs
-        self._end_status()
-        self._info_msg(f'Writing logs...')
-        self._save_logs()
-
-        self._info_msg(f'Finished processing {len(self.rows)} with {len(self.exif_tool_error_log)} errors '
-                       f'and {len(self.exif_tool_success_log)} successes at {_get_current_time()}')
-        end_time = time.time()
-        self._info_msg(f'Script took: {str(datetime.timedelta(seconds=(end_time - start_time)))}')
+        # Journal the file, if it was written without errors
+        if self.journal and written:
+            self.journal.record(filepath, row_hash, self.run_id)
 
     def __get_file_name(self, row_index: int, row: dict) -> Optional[str]:
         """ Get row's filename, or log an error if the "File Name" column is empty. """
@@ -240,9 +1155,10 @@ class MME:
         else:
             return filepath
 
-    def __delete_command(self, row_index: int, filepath: str, delete_key: str, delete_command: list[str]) -> bool:
-        """ Run tag DELETE commands """
-        success, error = self.__delete_command_wrapper(delete_command, filepath)
+    def __delete_command(self, row_index: int, filepath: str, delete_key: str,
+                         delete_command: list[str]) -> ExifToolCommands:
+        """ Run tag DELETE commands, return True if there were no errors """
+        success, error = yield from self.__delete_command_wrapper(delete_command, filepath)
         if error:
             self.exif_tool_error_log.append(f'On {delete_key}: Row: "{row_index}", filepath: "{filepath}", '
                                             f'ERROR: "{error}"')
@@ -260,42 +1176,238 @@ class MME:
                             f'Row: "{row_index}", filepath: "{filepath}".')  # Fatal error
             return False
 
-    def __write_command(self, row_index: int, row: dict, filepath: str, write_key: str, tag_map: dict,
-                        write_command: list) -> bool:
-        """ Run tag WRITE commands  """
-        for key in tag_map.keys():
-            if key in row.keys():
-                key_value_pair = f'-{tag_map[key]}={row[key]}'
-                success, error = self.__write_command_wrapper(write_command, key_value_pair, filepath)
-                if error:
-                    self.exif_tool_error_log.append(f'On {write_key}: Row: "{row_index}", filepath: "{filepath}",'
-                                                    f' Row key: {key}, ERROR: "{error}"')
-                    self._end_status()
-                    self._error_msg(f'On {write_key}: Row: "{row_index}", filepath: "{filepath}", Row key: {key},'
-                                    f' ERROR: "{error}"', fatal=False)
-                    return False
-            else:
-                if self.notify_on_broken_keys:
-                    self.exif_tool_error_log.append(f'MISSING KEY: {key} - On {write_key}: Row: "{row_index}, '
-                                                    f'filepath: "{filepath}"')
-                    self._end_status()
-                    self._error_msg(f'MISSING KEY: {key} - On {write_key}: Row: "{row_index}, filepath: "{filepath}"',
-                                    fatal=False)
+    def __write_command(self, row_index: int, row: dict, filepath: str, write_key: str,
+                        write_command: list) -> ExifToolCommands:
+        """ Run tag WRITE commands, return True if there were no errors """
+        # Send every tag of the standard in one batch, results come back in the same order as the keys
+        key_value_pairs = self.tag_plan.arguments(write_key, row)
+        results = yield from self.__write_command_wrapper(write_command, key_value_pairs, filepath)
+        for (key, _), (success, error) in zip(self.tag_plan.tags[write_key], results):
+            if error:
+                self.exif_tool_error_log.append(f'On {write_key}: Row: "{row_index}", filepath: "{filepath}",'
+                                                f' Row key: {key}, ERROR: "{error}"')
+                self._end_status()
+                self._error_msg(f'On {write_key}: Row: "{row_index}", filepath: "{filepath}", Row key: {key},'
+                                f' ERROR: "{error}"', fatal=False)
+                return False
         return True
 
+    def __single_pass_command(self, row_index: int, row: dict, filepath: str) -> ExifToolCommands:
+        """ Run the DELETE commands and the WRITE commands of every standard as a single exiftool command. Errors are
+        reported per tag, from the exiftool warnings that name the tag. """
+        key_value_pairs = self.tag_plan.all_arguments(row)
+        success, errors = yield from self.__single_pass_command_wrapper(MME.SINGLE_PASS_TAGS, key_value_pairs,
+                                                                        filepath)
+        failed_write_keys = self.__log_tag_errors(row_index, filepath, errors, self.tag_plan.tag_keys,
+                                                  MME.SINGLE_PASS_KEY)
+
+        if MME.SINGLE_PASS_KEY in failed_write_keys:
+            return False  # The command itself failed (e.g. file not writable)
+        elif not success:
+            self._end_status()
+            self._error_msg(f'FATAL ERROR: Invalid return (no error nor success): On {MME.SINGLE_PASS_KEY}: '
+                            f'Row: "{row_index}", filepath: "{filepath}".')  # Fatal error
+            return False
+
+        self.exif_tool_success_log.append(f'On {MME.SINGLE_PASS_KEY}: Row: "{row_index}", filepath: "{filepath}", '
+                                          f'SUCCESS: "{success}"')
+        for write_key in MME.WRITE_MAP.keys():
+            if write_key not in failed_write_keys:
+                self.exif_tool_success_log.append(f'On {write_key}: Row: "{row_index}", filepath: "{filepath}"')
+        return not failed_write_keys
+
+    def __diff_command(self, row_index: int, row: dict, filepath: str,
+                       current_tags: Optional[dict]) -> ExifToolCommands:
+        """ Write only the tags of the row that differ from the current tags of the file, in a single exiftool command,
+        and report every change to the diff report. With dry_run, only report them. """
+        if current_tags is None:
+            self.exif_tool_error_log.append(f'On {MME.DIFF_READ_KEY}: Row: "{row_index}", filepath: "{filepath}", '
+                                            f'ERROR: "The current tags could not be read"')
+            self._end_status()
+            self._error_msg(f'On {MME.DIFF_READ_KEY}: Row: "{row_index}", filepath: "{filepath}", ERROR: "The current '
+                            f'tags could not be read"', fatal=False)
+            return False
+
+        desired = self.tag_plan.desired(row)  # Tag -> (write key, row key, value), as a full run leaves it
+        changes = metadata_diff.diff_tags(desired, current_tags)
+        if not changes:
+            self.exif_tool_success_log.append(f'On {MME.DIFF_UNCHANGED_KEY}: Row: "{row_index}", filepath: '
+                                              f'"{filepath}"')
+            return True
+
+        for tag, write_key, key, current, new in changes:
+            row_key = f' Row key: {key},' if key else ''
+            self.diff_report.append(f'On {write_key or MME.DIFF_DELETE_KEY}: Row: "{row_index}", filepath: '
+                                    f'"{filepath}",{row_key} tag: "{tag}", current: "{current}", new: "{new}"')
+        if self.dry_run:
+            self.exif_tool_success_log.append(f'On {MME.DIFF_KEY}: Row: "{row_index}", filepath: "{filepath}", '
+                                              f'DRY RUN: "{len(changes)} tags to change"')
+            return False  # Nothing written, nothing to journal
+
+        key_value_pairs = metadata_diff.write_arguments(desired, current_tags, changes)
+        if self.in_place and xmp_inplace.xmp_only(key_value_pairs):
+            bytes_written = yield from self.__in_place_command(filepath, key_value_pairs)
+            if bytes_written is not None:
+                self.exif_tool_success_log.append(f'On {MME.IN_PLACE_KEY}: Row: "{row_index}", filepath: '
+                                                  f'"{filepath}", SUCCESS: "{len(changes)} tags changed", '
+                                                  f'BYTES WRITTEN: "{bytes_written}"')
+                return True
+            # Otherwise (no packet to update, the new one does not fit, or warnings), rewrite the file
+
+        success, errors = yield from self.__single_pass_command_wrapper(MME.DIFF_TAGS, key_value_pairs, filepath)
+        failed_write_keys = self.__log_tag_errors(row_index, filepath, errors, self.tag_plan.desired_tag_keys,
+                                                  MME.DIFF_KEY)
+
+        if MME.DIFF_KEY in failed_write_keys:
+            return False  # The command itself failed (e.g. file not writable)
+        elif not success:
+            self._end_status()
+            self._error_msg(f'FATAL ERROR: Invalid return (no error nor success): On {MME.DIFF_KEY}: '
+                            f'Row: "{row_index}", filepath: "{filepath}".')  # Fatal error
+            return False
+
+        bytes_written = f', BYTES WRITTEN: "{os.path.getsize(filepath)}"' if self.in_place else ''
+        self.exif_tool_success_log.append(f'On {MME.DIFF_KEY}: Row: "{row_index}", filepath: "{filepath}", '
+                                          f'SUCCESS: "{success}"{bytes_written}')
+        return not failed_write_keys
+
+    def __in_place_command(self, filepath: str, key_value_pairs: list[str]) -> ExifToolCommands:
+        """ Write XMP tags by updating the XMP packet of the file in place: exiftool writes them to a copy of the
+        current packet, which is padded to its length and written over it. Return the bytes written, or None if the
+        file must be rewritten instead (no packet, the new packet does not fit, or exiftool warned) """
+        packet = xmp_inplace.read_packet(filepath)
+        if packet is None:
+            return None
+        offset, current_packet = packet
+        with tempfile.TemporaryDirectory(prefix='mme-xmp-') as temp_path:
+            xmp_filepath = os.path.join(temp_path, 'packet.xmp')
+            with open(xmp_filepath, 'wb') as w_file:
+                w_file.write(current_packet)
+            (_, stderr), = yield MME.IN_PLACE_TAGS, [key_value_pairs + [xmp_filepath]]
+            if stderr.strip() or not os.path.exists(xmp_filepath):
+                return None  # The warnings are logged by the file rewrite
+            with open(xmp_filepath, 'rb') as r_file:
+                new_packet = xmp_inplace.fit_packet(current_packet, r_file.read())
+        if new_packet is None or not xmp_inplace.write_packet(filepath, offset, current_packet, new_packet):
+            return None
+        return len(new_packet)
+
+    def __group_command(self, group: list[tuple[int, dict, str, Optional[str]]]) -> ExifToolCommands:
+        """ Clear the groups and write the shared tags of a group of rows with one command for all their files, then
+        the other tags of each file (batched). Warnings that name no file (e.g. invalid values) are reported for every
+        file of the shared command. Return, for every row, True if there were no errors """
+        rows = [row for _, row, _, _ in group]
+        filepaths = [filepath for _, _, filepath, _ in group]
+        shared_arguments, file_arguments = self.tag_plan.split_arguments(rows, self.tag_plan.shared_units(rows))
+        (stdout, stderr), = yield MME.SINGLE_PASS_TAGS, [shared_arguments + filepaths]
+        shared_success = MME._prettify_success_message(stdout.replace('\n', '|'))
+        shared_errors = {filepath: [] for filepath in filepaths}
+        for line in [line for line in stderr.split('\n') if line.strip()]:
+            named = [filepath for filepath in filepaths if line.endswith(f' - {filepath}')]
+            for filepath in named or filepaths:
+                shared_errors[filepath].append(line)
+
+        # Write the other tags of every file, unless the shared command failed on it (an error naming no tag)
+        pending = [position for position, filepath in enumerate(filepaths) if file_arguments[position] and
+                   all(self._match_warning_tag(error, self.tag_plan.tag_keys) for error in shared_errors[filepath])]
+        results = (yield MME.GROUP_FILE_TAGS, [file_arguments[position] + [filepaths[position]]
+                                               for position in pending]) if pending else []
+        file_results = dict(zip(pending, results))
+
+        # Log every row in CSV order
+        written = []
+        for position, (csv_index, _, filepath, _) in enumerate(group):
+            failed_write_keys = self.__log_tag_errors(csv_index, filepath, shared_errors[filepath],
+                                                      self.tag_plan.tag_keys, MME.GROUP_KEY)
+            if MME.GROUP_KEY in failed_write_keys:
+                written.append(False)
+                continue  # Next row
+            self.exif_tool_success_log.append(f'On {MME.GROUP_KEY}: Row: "{csv_index}", filepath: "{filepath}", '
+                                              f'SUCCESS: "{shared_success}"')
+            if position in file_results:
+                stdout, stderr = file_results[position]
+                failed_write_keys |= self.__log_tag_errors(csv_index, filepath,
+                                                           [line for line in stderr.split('\n') if line.strip()],
+                                                           self.tag_plan.tag_keys, MME.GROUP_FILE_KEY)
+                if MME.GROUP_FILE_KEY not in failed_write_keys:
+                    file_success = MME._prettify_success_message(stdout.replace('\n', '|'))
+                    self.exif_tool_success_log.append(f'On {MME.GROUP_FILE_KEY}: Row: "{csv_index}", filepath: '
+                                                      f'"{filepath}", SUCCESS: "{file_success}"')
+            for write_key in MME.WRITE_MAP.keys():
+                if write_key not in failed_write_keys:
+                    self.exif_tool_success_log.append(f'On {write_key}: Row: "{csv_index}", filepath: "{filepath}"')
+            written.append(not failed_write_keys)
+        return written
+
+    def __log_tag_errors(self, row_index: int, filepath: str, errors: list[str], tag_keys: dict,
+                         command_key: str) -> set[str]:
+        """ Log the errors/warnings of a command writing several tags, under the write key and row key of the tag
+        they name (or under command_key), and return the write keys that failed """
+        failed_write_keys = set()
+        for error in errors:
+            write_key, key = self._match_warning_tag(error, tag_keys) or (command_key, None)
+            failed_write_keys.add(write_key)
+            row_key = f' Row key: {key},' if key else ''
+            self.exif_tool_error_log.append(f'On {write_key}: Row: "{row_index}", filepath: "{filepath}",{row_key}'
+                                            f' ERROR: "{error}"')
+            self._end_status()
+            self._error_msg(f'On {write_key}: Row: "{row_index}", filepath: "{filepath}",{row_key} ERROR: "{error}"',
+                            fatal=False)
+        return failed_write_keys
+
     @staticmethod
-    def __delete_command_wrapper(delete_command: list[str], filepath: str) -> tuple[str, str]:
-        """ Wrap a call to exiftool to delete tags """
-        x = subprocess.run(delete_command + [filepath], capture_output=True)
-        return MME._prettify_success_message(x.stdout.decode("utf-8").replace('\n', '|')), \
-               x.stderr.decode("utf-8").replace('\n', '|')
+    def _match_warning_tag(warning: str, tag_keys: dict) -> Optional[tuple[str, str]]:
+        """ Find the (write key, row key) of the tag named in an exiftool warning, e.g. "Warning: Invalid date/time
+        (...) in XMP-dc:Date (PrintConvInv)" """
+        warning = warning.lower()
+        # Exact "group:name" first, then the bare tag name (exiftool may print another group name, e.g. GPS:)
+        for tag, keys in tag_keys.items():
+            if ':' in tag and re.search(rf'(?<![\w-]){re.escape(tag)}(?!\w)', warning):
+                return keys
+        for tag, keys in tag_keys.items():
+            if re.search(rf"[:']{re.escape(tag.split(':')[-1])}(?!\w)", warning):
+                return keys
+        return None
+
+    def __bulk_command(self, shard: list[tuple[int, dict, str, Optional[str]]]) -> tuple[dict, dict, list[str]]:
+        """ Import the rows of a shard with exiftool -csv=, from a temporary CSV, return the success message and errors
+        of every file, and the warnings that name no file """
+        tags = list(self.tag_plan.desired_keys)
+        keys = [key for _, key in self.tag_plan.desired_keys.values()]
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', newline='', suffix='.csv', prefix='mme-bulk-',
+                                         delete=False) as w_file:
+            bulk_import.write_csv(w_file, tags, [(filepath, [row[key] for key in keys])
+                                                 for _, row, filepath, _ in shard])
+        filepaths = [filepath for _, _, filepath, _ in shard]
+        try:
+            stdout, stderr = self.exiftool.run(MME.BULK_TAGS, [f'-csv={w_file.name}'] + filepaths)
+        finally:
+            os.remove(w_file.name)
+        return bulk_import.parse_output(stdout, stderr, filepaths)
+
+    @staticmethod
+    def __single_pass_command_wrapper(command: list[str], key_value_pairs: list[str],
+                                      filepath: str) -> ExifToolCommands:
+        """ Wrap a call to exiftool to delete and write all tags (or the changed tags), return the success message and
+        every error/warning line """
+        (stdout, stderr), = yield command, [key_value_pairs + [filepath]]
+        return MME._prettify_success_message(stdout.replace('\n', '|')), \
+               [line for line in stderr.split('\n') if line.strip()]
+
+    @staticmethod
+    def __delete_command_wrapper(delete_command: list[str], filepath: str) -> ExifToolCommands:
+        """ Wrap a call to exiftool to delete tags, return its success message and errors """
+        (stdout, stderr), = yield delete_command, [[filepath]]
+        return MME._prettify_success_message(stdout.replace('\n', '|')), stderr.replace('\n', '|')
 
     @staticmethod
-    def __write_command_wrapper(write_command: list[str], key_value_pair: str, filepath: str) -> tuple[str, str]:
-        """ Wrap a call to exiftool to write tags """
-        x = subprocess.run(write_command + [key_value_pair, filepath], capture_output=True)
-        return MME._prettify_success_message(x.stdout.decode("utf-8").replace('\n', '|')), \
-               x.stderr.decode("utf-8").replace('\n', '|')
+    def __write_command_wrapper(write_command: list[str], key_value_pairs: list[str],
+                                filepath: str) -> ExifToolCommands:
+        """ Wrap a batch of calls to exiftool to write tags, one call per key-value pair, return their success
+        messages and errors """
+        results = yield write_command, [[key_value_pair, filepath] for key_value_pair in key_value_pairs]
+        return [(MME._prettify_success_message(stdout.replace('\n', '|')), stderr.replace('\n', '|'))
+                for stdout, stderr in results]
 
     @staticmethod
     def _prettify_success_message(msg: str) -> str:
@@ -314,8 +1426,332 @@ parser.add_argument('--notify-broken-keys', '-n', type=bool, default=False,
                     help='Notify on broken/missing keys in the CSV. False by default.')
 parser.add_argument('--max-depth', '-m', type=int, default=3, help='Max depth of sub-folders to look into when looking '
                                                                    'for JPGS. 3 by default')
+parser.add_argument('--index-file', '-i', type=str, default=None,
+                    help='Save the index of the files found under JPGS_PATH to this file, and reuse it on the next '
+                         'runs, listing again only the directories that changed. By default the index is cached in '
+                         f'{FileIndex.CACHE_PATH}, shared with GMME.')
+parser.add_argument('--no-index-cache', dest='index_cache', action='store_false',
+                    help='Walk the whole JPGS_PATH tree, without loading or saving the cached file index.')
+parser.add_argument('--workers', '-w', type=int, default=1,
+                    help='How many rows to process in parallel, each worker runs its own exiftool processes. Logs '
+                         'are still written in CSV row order. 1 by default')
+parser.add_argument('--journal', '-j', type=str, default=None,
+                    help='SQLite journal of the written files, used by --resume and --incremental. No journal by '
+                         'default, mme_journal.sqlite next to mme.py with --resume or --incremental')
+parser.add_argument('--resume', action='store_true',
+                    help='Continue the interrupted run of the same CSV, skipping the files it already wrote.')
+parser.add_argument('--incremental', action='store_true',
+                    help='Skip the files already written with the same values by any previous run, if they did not '
+                         'change since.')
+parser.add_argument('--single-pass', '-s', action='store_true',
+                    help='Delete and write the VRAE/ISADG/DC tags with a single exiftool command, so every file is '
+                         'rewritten once. Errors are reported per tag from exiftool warnings. False by default.')
+parser.add_argument('--log-format', choices=LogWriter.FORMATS, default='text',
+                    help='Format of the error/success logs: "text", one message per line, or "jsonl", one JSON '
+                         'object per line with the row, key and filepath of each entry. text by default')
+parser.add_argument('--log-max-bytes', type=int, default=0,
+                    help='Rotate the error/success logs into numbered parts (.1, .2...) over this size. Never rotated '
+                         'by default')
+
+parser.add_argument('--diff', action='store_true',
+                    help='Read the current tags of the files first, and write only the tags that changed (files with '
+                         'no changes are not written). The changes are reported in a diff_report file. False by '
+                         'default.')
+parser.add_argument('--dry-run', action='store_true',
+                    help='Like --diff, but only report the tags that would change, without writing any file.')
+parser.add_argument('--in-place', action='store_true',
+                    help='Like --diff, but when only XMP tags change and the new XMP packet fits in the padding of '
+                         'the current one (JPEG and TIFF), update the packet in place instead of rewriting the file. '
+                         'No _original copy is kept for those files. The bytes written are logged for every file. '
+                         'False by default.')
+parser.add_argument('--metrics', type=str, default=None,
+                    help='Save the timings of every phase (count, total, p50/p95/p99 latencies and histograms) to this '
+                         'JSON file. Not saved by default.')
+parser.add_argument('--bulk', action='store_true',
+                    help='Write the files of each directory with a single exiftool -csv= import, instead of one '
+                         'command per file. Rows of a directory are imported together, 1000 rows at a time. False by '
+                         'default.')
+parser.add_argument('--async', dest='async_engine', action='store_true',
+                    help='Process the rows with the asyncio engine: CSV reading, file lookups, exiftool commands (on '
+                         '--workers exiftool stages) and log writing overlap, with bounded queues between them. The '
+                         'sequential engine is the reference. False by default.')
+parser.add_argument('--group-rows', action='store_true',
+                    help='Write the tags shared by consecutive rows (e.g. the image variants of a work) with a single '
+                         'exiftool command for all their files, then the other tags of each file. False by default.')
+parser.add_argument('--schedule', action='store_true',
+                    help='Process the rows by directory instead of in CSV order (1000 rows at a time), for disk and '
+                         'NAS locality, with the files over --large-file-mb on a lane of their own. Logs are still '
+                         'written in CSV row order. False by default.')
+parser.add_argument('--large-file-mb', type=int, default=256,
+                    help='With --schedule, files over this size (in MB) go to the large files lane. 256 by default')
+parser.add_argument('--large-workers', type=int, default=1,
+                    help='With --schedule, how many large files to process in parallel, besides the --workers for '
+                         'the other files. 1 by default')
+parser.add_argument('--adaptive', action='store_true',
+                    help='Tune the number of rows in flight while running, between --min-workers and --workers, from '
+                         'the write latency and throughput (AIMD): raised while the files keep being written as fast, '
+                         'halved when the storage slows down. The level is shown in the progress output. False by '
+                         'default.')
+parser.add_argument('--min-workers', type=int, default=1,
+                    help='With --adaptive, the fewest rows in flight. 1 by default')
+parser.add_argument('--check', action='store_true',
+                    help='Only check the CSV, without running exiftool: the maps against the tags of the exiftool '
+                         'configs, the CSV header against the maps, the file of every row, and the values exiftool '
+                         'would reject (e.g. dates and GPS coordinates). Problems are written to the error log. False '
+                         'by default.')
+parser.add_argument('--shard', type=sharding.parse_shard, default=None, metavar='K/N',
+                    help='Only process the rows of shard K of N (the rows are split by a hash of their "File Name", '
+                         'so no two shards write the same file). Every shard writes its own logs and journal, merge '
+                         'them with sharding.py. Not sharded by default.')
+parser.add_argument('--coordinate', type=int, default=0, metavar='N',
+                    help='Run the N shards of the CSV as local processes (with the other options), and merge their '
+                         'logs and journals once they finish.')
+parser.add_argument('--profile', type=str, default=None,
+                    help='Profile the run with cProfile (the workers included), and save the pstats dump to this '
+                         'file. Not profiled by default.')
+parser.add_argument('--watch', action='store_true',
+                    help='After the run, watch JPGS_PATH (with inotify, or by polling) and the CSV, and run the rows '
+                         'of the new or changed files, and the rows appended or edited, as they arrive, with '
+                         'exiftool and the file index kept warm. Stop it with Ctrl+C. False by default.')
+parser.add_argument('--debounce', type=float, default=2.0,
+                    help='With --watch, seconds without changes before the changed rows are run together. 2 by '
+                         'default')
+parser.add_argument('--watch-polling', action='store_true',
+                    help='With --watch, poll the directories every second instead of using inotify (e.g. on network '
+                         'shares, where inotify sees no remote changes). inotify by default, on Linux.')
+parser.add_argument('--server', nargs='?', const='', default=None, metavar='URL',
+                    help='Submit the run to the MME server started with "mme.py serve" (at URL, or at the '
+                         'MME_SERVER environment variable, or at http://127.0.0.1:8765), which keeps exiftool and '
+                         'the file index warm, instead of running it here.')
+
+extract_parser = argparse.ArgumentParser(prog="MME extract", description="Read the VRAE/ISADG/DC tags of every image "
+                                                                         "under a root path back to a CSV, with the "
+                                                                         "columns of maps.json")
+extract_parser.add_argument('JPGS_PATH', nargs=1, type=str, help='root path for the JPG files.')
+extract_parser.add_argument('OUTPUT_CSV', nargs=1, type=str, help='path of the CSV file to write.')
+extract_parser.add_argument('--max-depth', '-m', type=int, default=3,
+                            help='Max depth of sub-folders to look into when looking for JPGS. 3 by default')
+extract_parser.add_argument('--workers', '-w', type=int, default=1,
+                            help='How many batches of files to read in parallel, each worker runs its own exiftool '
+                                 'process. Rows are still written in directory order. 1 by default')
+extract_parser.add_argument('--header', type=str, default=None, metavar='CSV_PATH',
+                            help='Write the columns of the header of this CSV (e.g. the CSV that was embedded), in '
+                                 'its order, instead of every column of maps.json.')
+extract_parser.add_argument('--no-index-cache', dest='index_cache', action='store_false',
+                            help='Walk the whole JPGS_PATH tree, without loading or saving the cached file index.')
+
+serve_parser = argparse.ArgumentParser(prog="MME serve", description="Run the MME server: a local service that "
+                                                                     "runs the jobs submitted by mme.py --server and "
+                                                                     "gmme.py, keeping exiftool and the file indexes "
+                                                                     "warm between jobs")
+serve_parser.add_argument('--port', '-p', type=int, default=8765,
+                          help='Port to listen to, on localhost only. 8765 by default')
+
+
+def _journal_filepath(parsed_args: argparse.Namespace) -> Optional[str]:
+    """ The journal of the run: the --journal one, or the default one with --resume or --incremental, else None """
+    if parsed_args.journal or not (parsed_args.resume or parsed_args.incremental):
+        return parsed_args.journal
+    return DEFAULT_JOURNAL
+
+
+def _options(parsed_args: argparse.Namespace) -> dict:
+    """ Settings.from_options options of the command line (but the file index ones) """
+    return dict(row_progress_notify=parsed_args.row_progress_notify,
+                notify_on_broken_keys=parsed_args.notify_broken_keys, max_depth=parsed_args.max_depth,
+                single_pass=parsed_args.single_pass, workers=parsed_args.workers,
+                journal_filepath=_journal_filepath(parsed_args), resume=parsed_args.resume,
+                incremental=parsed_args.incremental, log_format=parsed_args.log_format, log_max_bytes=parsed_args.log_max_bytes, diff=parsed_args.diff,
+                dry_run=parsed_args.dry_run, profile_filepath=parsed_args.profile,
+                metrics_filepath=parsed_args.metrics, bulk=parsed_args.bulk, async_engine=parsed_args.async_engine,
+                check=parsed_args.check, shard=parsed_args.shard, group_rows=parsed_args.group_rows,
+                in_place=parsed_args.in_place, schedule=parsed_args.schedule, large_file_mb=parsed_args.large_file_mb,
+                large_workers=parsed_args.large_workers, adaptive=parsed_args.adaptive,
+                min_workers=parsed_args.min_workers)
+
+
+def _watch(parsed_args: argparse.Namespace) -> None:
+    """ Run the CSV, then watch the images root and the CSV and run the rows of the changes, until interrupted """
+    if parsed_args.check or parsed_args.server is not None:
+        _print_error('--watch can not be combined with --check or --server')
+        raise MMEError('--watch can not be combined with --check or --server')
+    csv_filepath, images_root_path = parsed_args.CSV_PATH[0], parsed_args.JPGS_PATH[0]
+    options = _options(parsed_args)
+    exiftool, read_exiftool, worker_exiftools = ExifToolPool(), ExifToolPool(), []  # Kept warm between the batches
+    try:
+        engine = MME(csv_filepath, images_root_path,
+                     Settings.from_options(index_filepath=parsed_args.index_file, index_cache=parsed_args.index_cache,
+                                           **options),
+                     exiftool=exiftool, read_exiftool=read_exiftool, worker_exiftools=worker_exiftools)
+        engine.run()
+        options['resume'] = False  # The batches are new runs
+
+        def run_rows(rows: set[int]) -> Iterator[RowResult]:
+            try:
+                yield from MME(csv_filepath, images_root_path,
+                               Settings.from_options(index_cache=False, rows=rows, **options), exiftool=exiftool,
+                               read_exiftool=read_exiftool, worker_exiftools=worker_exiftools,
+                               file_index=engine.file_index, maps=engine.maps).results()
+            except MMEError:
+                pass  # Already printed, the next changes are still watched
+
+        def on_changes(rows: set[int]) -> None:
+            _print_info(f'Running the {len(rows)} rows of the changes: {", ".join(map(str, sorted(rows)[:10]))}'
+                        f'{"..." if len(rows) > 10 else ""}')
+
+        _print_info(f'Watching "{images_root_path}" and "{csv_filepath}" for changes (stop it with Ctrl+C)...')
+        try:
+            watch.watch(csv_filepath, engine.file_index, run_rows, debounce=parsed_args.debounce,
+                        polling=parsed_args.watch_polling, on_changes=on_changes)
+        except KeyboardInterrupt:
+            _print_info('Stopped watching')
+    finally:
+        exiftool.close()
+        read_exiftool.close()
+        for worker_exiftool in worker_exiftools:
+            worker_exiftool.close()
+
+
+def _serve(parsed_args: argparse.Namespace) -> None:
+    """ Run the MME server until it is shut down (POST /shutdown) or interrupted """
+    import mme_server  # It imports mme
+    try:
+        server = mme_server.MMEServer(parsed_args.port)
+    except OSError as e:
+        _print_error(f'_serve failed to listen on port {parsed_args.port}, with exception: {str(e)}')
+        raise MMEError(str(e))
+    _print_info(f'MME server listening on {server.url} (stop it with Ctrl+C)')
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass  # The running job stops after its current row, and the file indexes are saved
+    _print_info('MME server stopped')
+
+
+def _submit(parsed_args: argparse.Namespace) -> None:
+    """ Run the job on the MME server, printing its errors and progress as its rows are processed """
+    import mme_server  # It imports mme
+    client = mme_server.MMEClient(parsed_args.server)
+    try:
+        job = client.submit(parsed_args.CSV_PATH[0], parsed_args.JPGS_PATH[0], **_options(parsed_args))
+    except MMEError as e:
+        _print_error(f'_submit failed to submit the job to {client.url}: {str(e)}')
+        raise
+    _print_info(f'Job {job.id} submitted to {client.url}, with CSV path: "{job.csv}", {job.row_count} rows, and '
+                f'root image path: "{job.images}" at {_get_current_time()}')
+    done = 0
+    try:
+        for result in job:
+            done += 1
+            for message in result.errors:
+                _print_error(message, fatal=False)
+            if done % parsed_args.row_progress_notify == 0:
+                _print_info(f'Progress: {done}/{job.row_count}. Errors: {job.errors}, Successes: {job.successes}')
+    except MMEError as e:
+        _print_error(f'Job {job.id} failed: {str(e)}')
+        raise
+    _print_info(f'Logs written to: "{job.error_log}" and "{job.success_log}"')
+    _print_info(f'Finished processing {job.row_count} with {job.errors} errors and {job.successes} successes at '
+                f'{_get_current_time()}')
+
+
+def _extract(parsed_args: argparse.Namespace) -> None:
+    """ Extract the tags of every image under JPGS_PATH to OUTPUT_CSV """
+    start_time = time.time()
+    images_root_path, output_filepath = parsed_args.JPGS_PATH[0], parsed_args.OUTPUT_CSV[0]
+    if not os.path.isdir(images_root_path):
+        _print_error(f'_extract found no files/directory at: {images_root_path} (Does the path exist?')
+        raise MMEError(images_root_path)
+    try:
+        maps = json.load(open(f'{SCRIPT_PATH}/data/maps.json', 'r', encoding='utf-8'))
+        header = None
+        if parsed_args.header:
+            with open(parsed_args.header, 'r', encoding='utf-8') as r_file:
+                header = next(csv.reader(r_file), None)
+    except (OSError, json.JSONDecodeError) as e:
+        _print_error(f'_extract failed to read its input, with exception: {str(e)}')
+        raise MMEError(str(e))
+
+    file_index = FileIndex(images_root_path, parsed_args.max_depth)
+    index_filepath = FileIndex.cache_filepath(images_root_path, parsed_args.max_depth) \
+        if parsed_args.index_cache else None
+    if index_filepath and file_index.load(index_filepath):
+        file_index.refresh()
+    else:
+        _print_info(f'Indexing files in "{images_root_path}" (max depth: {parsed_args.max_depth})...')
+        file_index.scan()
+        if index_filepath:
+            file_index.save(index_filepath)
+
+    _print_info(f'Extracting the tags of the files in "{images_root_path}" to "{output_filepath}"...')
+
+    def on_batch(rows: int, unreadable: list[str]) -> None:
+        for filepath in unreadable:
+            _print_error(f'On EXTRACT: filepath: "{filepath}", ERROR: "exiftool could not read the file"',
+                         fatal=False)
+        _print_info(f'{rows} rows written')
+
+    rows, unreadable = extract.extract(file_index, output_filepath, maps, MME.DIFF_TAGS,
+                                       workers=parsed_args.workers, header=header, on_batch=on_batch)
+    _print_info(f'Extracted {rows} rows ({len(unreadable)} unreadable files) to "{output_filepath}" in '
+                f'{round(time.time() - start_time, 2)} seconds')
+
+
+def _coordinate(shards: int, csv_filepath: str, journal_filepath: Optional[str], argv: list[str]) -> None:
+    """ Run the shards of a CSV as local processes (with the arguments of argv), and merge their logs and journals """
+    start_time = time.time()
+    _print_info(f'Running {shards} shards of "{csv_filepath}" as local processes...')
+    sharding.run_local(os.path.abspath(__file__), argv, '--coordinate', shards)
+
+    output_name = csv_filepath.split('/')[-1].replace('.csv', '')
+    filepaths = [filepath for filepath in glob.glob(f'{glob.escape(SCRIPT_PATH)}/*_{glob.escape(output_name)}-*'
+                                                    f'.shard-*-of-{shards}.*')
+                 if os.path.getmtime(filepath) >= start_time]  # Only the logs of this run
+    if journal_filepath:
+        filepaths += [sharding.shard_filepath(journal_filepath, shard, shards) for shard in range(1, shards + 1)
+                      if os.path.exists(sharding.shard_filepath(journal_filepath, shard, shards))]
+    try:
+        merged = sharding.merge(filepaths)
+    except ValueError as e:
+        _print_error(f'_coordinate failed to merge the outputs of the shards: {str(e)}')
+        raise MMEError(str(e))
+    for merged_filepath, entries in merged.items():
+        _print_info(f'Merged the shards into: "{merged_filepath}" ({entries} entries)')
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """ Command line entry-point: run MME with the arguments of argv (sys.argv by default), return the exit code """
+    colorama.init()
+    argv = sys.argv[1:] if argv is None else argv
+    commands = {'extract': (_extract, extract_parser), 'serve': (_serve, serve_parser)}
+    if argv[:1] and argv[0] in commands:
+        command, command_parser = commands[argv[0]]
+        try:
+            command(command_parser.parse_args(argv[1:]))
+        except MMEError:
+            return 1  # Already printed
+        return 0
+    parsed_args = parser.parse_args(argv)
+    try:
+        if parsed_args.coordinate:
+            _coordinate(parsed_args.coordinate, parsed_args.CSV_PATH[0], _journal_filepath(parsed_args), argv)
+            return 0
+        if parsed_args.watch:
+            _watch(parsed_args)
+            return 0
+        if parsed_args.server is not None:
+            _submit(parsed_args)
+            return 0
+        C2E = MME(parsed_args.CSV_PATH[0], parsed_args.JPGS_PATH[0],
+                  Settings.from_options(index_filepath=parsed_args.index_file, index_cache=parsed_args.index_cache,
+                                        **_options(parsed_args)))
+        C2E.run()
+    except MMEError:
+        return 1  # Already printed
+    return 0
+
 
-parsed_args = (parser.parse_args())
-C2E = MME(parsed_args.CSV_PATH[0], parsed_args.JPGS_PATH[0], row_progress_notify=parsed_args.row_progress_notify,
-               notify_on_broken_keys=parsed_args.notify_broken_keys, max_depth=parsed_args.max_depth)
-C2E.run()
+if __name__ == '__main__':
+    # Run main from the mme module, so the MMEError raised by mme_server.py (which imports mme) is the one caught
+    import mme
+    sys.exit(mme.main())
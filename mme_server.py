@@ -0,0 +1,457 @@
+"""
+Warm MME server: a long-running local service that runs MME jobs (python mme.py serve).
+
+Every mme.py run pays for the interpreter startup, the reading of maps.json, the listing of the images root and the
+start of exiftool (and of its Perl interpreter, with the configs). The server pays for them once: it keeps the exiftool
+processes (of the main thread and of the workers), the file index of every images root and the maps resident, and runs
+the jobs submitted to it one at a time, in order, on a job thread. Before every job, the resident file index only lists
+again the directories that changed, and the maps are read again only if maps.json changed.
+
+It listens on localhost only (127.0.0.1, HTTP with JSON bodies, so it also runs on Windows), and runs the jobs with its
+own permissions: it is meant for the cataloguers of a single workstation. As any web page open in a browser can send
+requests to localhost, every request must carry the random token of the server (X-MME-Token header), written to a file
+only its user can read (in LOGS_PATH), and a Host header naming 127.0.0.1 or localhost, and POST bodies must be
+application/json. The paths a job writes (logs, journal, metrics, profile) must be in the directory of mme.py or in
+the GMME logs directory. mme.py --server and gmme.py are its thin clients (gmme.py uses it when it is running), through
+MMEClient, which reads the token:
+- POST /jobs {"csv": path, "images": path, "options": {Settings options}}: queue a job, return its summary. The
+  CSV and images root are checked when the job is submitted (400 with the error if they are not valid),
+- GET /jobs: the summaries of the jobs (queued, running, and the last FINISHED_JOBS finished ones),
+- GET /jobs/ID: the summary of a job (state, rows, errors, successes, log files, error),
+- GET /jobs/ID/results?start=N&wait=S: the summary and the results of a job (RowResult.as_dict) from row result N,
+  waiting up to S seconds for new results while the job is queued or running. A job keeps its last KEPT_RESULTS
+  results, and drops the ones before N once they are requested: the reply has the number of its first result
+  (start, past N if the results from N were dropped, they are still in the logs of the job),
+- POST /jobs/ID/cancel: cancel a job, a running job stops after its current row (its logs are written),
+- POST /shutdown: cancel the jobs, save the file indexes to their cache and stop the server.
+"""
+import os
+import hmac
+import json
+import time
+import queue
+import secrets
+import itertools
+import threading
+import contextlib
+import collections
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from pathlib import Path
+from typing import Iterator, Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from exiftool_engine import ExifToolPool
+from file_index import FileIndex
+from row_results import RowResult
+import mme
+
+DEFAULT_PORT = 8765
+DEFAULT_URL = f'http://127.0.0.1:{DEFAULT_PORT}'
+SERVER_ENVIRONMENT = 'MME_SERVER'  # URL of the server used by the clients, DEFAULT_URL if not set
+FINISHED_JOBS = 50  # Finished jobs kept, with their last results
+RESULTS_PAGE = 1000  # Results returned by a results request
+KEPT_RESULTS = 10 * RESULTS_PAGE  # Results kept by a job, not read yet
+MAX_WAIT = 30.0  # Seconds a results request can wait for new results
+TOKEN_HEADER = 'X-MME-Token'
+LOGS_PATH = os.path.join(str(Path.home()), 'Museum-Metadata-Embedder_logs')  # Of GMME, and the token files
+ALLOWED_HOSTS = ('127.0.0.1', 'localhost')  # Host headers accepted, with the port of the server
+
+# Settings.from_options options a job can set: the server sets the others (file index, quiet, rows)
+JOB_OPTIONS = ('row_progress_notify', 'notify_on_broken_keys', 'max_depth', 'single_pass', 'workers',
+               'journal_filepath', 'resume', 'incremental', 'log_format', 'log_max_bytes', 'diff', 'dry_run',
+               'profile_filepath', 'metrics_filepath', 'bulk', 'async_engine', 'check', 'shard', 'group_rows',
+               'in_place', 'log_path', 'schedule', 'large_file_mb', 'large_workers',
+               'adaptive', 'min_workers')
+# Options that are paths: the clients make them absolute, as the server does not run in their directory
+PATH_OPTIONS = ('journal_filepath', 'profile_filepath', 'metrics_filepath', 'log_path')
+PATH_ROOTS = (mme.SCRIPT_PATH, LOGS_PATH)  # Directories the path options must be in: of mme.py, and the GMME logs
+
+
+def token_filepath(port: int) -> str:
+    """ Path of the token file of the server listening on a port """
+    return os.path.join(LOGS_PATH, f'mme_server-{port}.token')
+
+
+class Job:
+    """ An MME run submitted to the server, and its results """
+    STATES = ('queued', 'running', 'done', 'failed', 'cancelled')
+
+    def __init__(self, job_id: int, engine: 'mme.MME'):
+        self.id: int = job_id
+        self.engine: mme.MME = engine
+        self.state: str = 'queued'
+        self.error: Optional[str] = None  # Error that ended the job, if it failed
+        self.results: collections.deque[dict] = collections.deque()  # RowResult.as_dict of the last rows processed
+        self.results_start: int = 0  # Number of the first result kept (the ones before were read, or dropped)
+        self.rows: int = 0  # Rows processed
+        self.submitted: float = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.cancelled = threading.Event()
+        self.changed = threading.Condition()  # Notified on every result, and when the job ends
+
+    @property
+    def active(self) -> bool:
+        return self.state in ('queued', 'running')
+
+    def summary(self) -> dict:
+        """ State of the job, as a JSON-serializable dictionary """
+        engine = self.engine
+        logs = [getattr(log, 'filepath', None) for log in (engine.exif_tool_error_log, engine.exif_tool_success_log)]
+        return {'id': self.id, 'state': self.state, 'error': self.error, 'csv': engine.csv_filepath,
+                'images': engine.images_root_path, 'row_count': engine.row_count, 'rows': self.rows,
+                'errors': len(engine.exif_tool_error_log), 'successes': len(engine.exif_tool_success_log),
+                'error_log': logs[0], 'success_log': logs[1],
+                'missing': engine.tag_plan.missing if engine.tag_plan else {},
+                'submitted': self.submitted, 'started': self.started, 'finished': self.finished}
+
+    def add(self, result: RowResult) -> None:
+        with self.changed:
+            self.results.append(result.as_dict())
+            self.rows += 1
+            if len(self.results) > KEPT_RESULTS:
+                self.results.popleft()
+                self.results_start += 1
+            self.changed.notify_all()
+
+    def page(self, start: int) -> tuple[int, list[dict]]:
+        """ Up to RESULTS_PAGE results from result start, dropping the ones before it (they were read). Return the
+        number of the first result returned (past start if the results from start were dropped) and the results """
+        with self.changed:
+            while self.results and self.results_start < start:
+                self.results.popleft()
+                self.results_start += 1
+            start = max(start, self.results_start)
+            offset = start - self.results_start
+            return start, list(itertools.islice(self.results, offset, offset + RESULTS_PAGE))
+
+    def end(self, state: str, error: Optional[str] = None) -> None:
+        with self.changed:
+            self.state, self.error, self.finished = state, error, time.time()
+            self.changed.notify_all()
+
+    def wait(self, start: int, timeout: float) -> None:
+        """ Wait until the job has results past start, or ends, for up to timeout seconds """
+        with self.changed:
+            self.changed.wait_for(lambda: self.rows > start or not self.active, timeout)
+
+
+class MMEServer:
+    """ Runs the jobs submitted over HTTP one at a time, with resident exiftool processes, file indexes and maps """
+
+    def __init__(self, port: int = DEFAULT_PORT):
+        self.exiftool = ExifToolPool()  # Of the job thread
+        self.read_exiftool = ExifToolPool()  # Reading the current tags of the diff mode, on the job thread
+        self.worker_exiftools: list[ExifToolPool] = []  # Of the worker threads, started by the jobs that need them
+        self.file_indexes: dict[tuple[str, int], FileIndex] = {}  # (images root, max depth) -> resident index
+        self._maps: Optional[dict] = None
+        self._maps_mtime: Optional[float] = None
+        self.jobs: collections.OrderedDict[int, Job] = collections.OrderedDict()
+        self._job_ids = itertools.count(1)
+        self._queue: queue.Queue[Optional[Job]] = queue.Queue()
+        self._lock = threading.Lock()
+        self.http = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self.http.daemon_threads = True
+        self.http.mme_server = self
+        self.port: int = self.http.server_address[1]
+        self.url: str = f'http://127.0.0.1:{self.port}'
+        self.token: str = secrets.token_urlsafe(32)
+        self._save_token()
+
+    def _save_token(self) -> None:
+        """ Write the token to its file, readable and writable by the user only """
+        os.makedirs(LOGS_PATH, exist_ok=True)
+        filepath = token_filepath(self.port)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(filepath)  # A file left by a server that did not stop may have other permissions
+        descriptor = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with open(descriptor, 'w', encoding='utf-8') as w_file:
+            w_file.write(self.token)
+
+    def serve(self) -> None:
+        """ Run the jobs, and serve the requests until shutdown """
+        runner = threading.Thread(target=self._run_jobs, name='mme-jobs', daemon=True)
+        runner.start()
+        try:
+            self.http.serve_forever()
+        finally:
+            with self._lock:
+                for job in self.jobs.values():
+                    job.cancelled.set()
+            self._queue.put(None)
+            runner.join()
+            self.http.server_close()
+            self.close()
+
+    def shutdown(self) -> None:
+        """ Stop serving, and cancel the jobs (from another thread than serve) """
+        self.http.shutdown()
+
+    def close(self) -> None:
+        """ Stop the resident exiftool processes, save the file indexes to their cache and remove the token file """
+        with contextlib.suppress(OSError):
+            os.remove(token_filepath(self.port))
+        self.exiftool.close()
+        self.read_exiftool.close()
+        for exiftool in self.worker_exiftools:
+            exiftool.close()
+        for (images_root_path, max_depth), file_index in self.file_indexes.items():
+            file_index.refresh()
+            file_index.save(FileIndex.cache_filepath(images_root_path, max_depth))
+
+    def maps(self) -> dict:
+        """ The maps, read again only if maps.json changed """
+        filepath = f'{mme.SCRIPT_PATH}/data/maps.json'
+        mtime = os.path.getmtime(filepath)
+        if self._maps is None or mtime != self._maps_mtime:
+            with open(filepath, 'r', encoding='utf-8') as r_file:
+                self._maps, self._maps_mtime = json.load(r_file), mtime
+        return self._maps
+
+    def file_index(self, images_root_path: str, max_depth: int) -> FileIndex:
+        """ The resident index of an images root, loaded from its cache the first time (scanned by the job if not) """
+        key = (images_root_path, max_depth)
+        if key not in self.file_indexes:
+            file_index = self.file_indexes[key] = FileIndex(images_root_path, max_depth)
+            file_index.load(FileIndex.cache_filepath(images_root_path, max_depth))
+        return self.file_indexes[key]
+
+    def submit(self, csv_filepath: str, images_root_path: str, options: dict) -> Job:
+        """ Check a job (MMEError if it is not valid) and queue it """
+        unknown = set(options) - set(JOB_OPTIONS)
+        if unknown:
+            raise mme.MMEError(f'Unknown job options: {", ".join(sorted(unknown))}')
+        for name in PATH_OPTIONS:
+            if options.get(name) and not any(_in_directory(options[name], root) for root in PATH_ROOTS):
+                raise mme.MMEError(f'The {name} option must be in "{mme.SCRIPT_PATH}" or in "{LOGS_PATH}"')
+        if options.get('shard'):
+            options['shard'] = tuple(options['shard'])
+        images_root_path = os.path.abspath(images_root_path)
+        with self._lock:  # Jobs are created one at a time, as they share the resident file indexes and maps
+            try:
+                maps = self.maps()
+            except (OSError, json.JSONDecodeError) as e:
+                raise mme.MMEError(f'The server failed to read maps.json, with exception: {str(e)}')
+            engine = mme.MME(os.path.abspath(csv_filepath), images_root_path,
+                             mme.Settings.from_options(quiet=True, index_cache=False, **options),
+                             exiftool=self.exiftool, read_exiftool=self.read_exiftool,
+                             worker_exiftools=self.worker_exiftools, maps=maps,
+                             file_index=self.file_index(images_root_path, options.get('max_depth', 3)))
+            job = Job(next(self._job_ids), engine)
+            self.jobs[job.id] = job
+            finished = [job_id for job_id, other in self.jobs.items() if not other.active]
+            for job_id in finished[:max(len(finished) - FINISHED_JOBS, 0)]:
+                del self.jobs[job_id]
+        self._queue.put(job)
+        return job
+
+    def _run_jobs(self) -> None:
+        """ Run the queued jobs in order, until shutdown """
+        while (job := self._queue.get()) is not None:
+            if job.cancelled.is_set():
+                job.end('cancelled')
+                continue
+            job.state, job.started = 'running', time.time()
+            results = job.engine.results()
+            try:
+                for result in results:
+                    job.add(result)
+                    if job.cancelled.is_set():
+                        results.close()  # Stops the run, and closes its logs
+                        break
+                job.end('cancelled' if job.cancelled.is_set() else 'done')
+            except mme.MMEError as e:
+                job.end('failed', str(e))
+            except Exception as e:
+                job.end('failed', f'{type(e).__name__}: {str(e)}')
+
+
+def _in_directory(path: str, directory: str) -> bool:
+    """ True if a path is in a directory (or is the directory), once their links are resolved """
+    path, directory = os.path.realpath(path), os.path.realpath(directory)
+    try:
+        return os.path.commonpath([path, directory]) == directory
+    except ValueError:  # On different drives
+        return False
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """ HTTP requests of the MME server """
+    server_version = 'MME'
+
+    def log_message(self, format, *args) -> None:
+        pass  # The jobs have their own logs
+
+    def _reply(self, status: int, body) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _job(self, job_id: str) -> Optional[Job]:
+        job = self.server.mme_server.jobs.get(int(job_id)) if job_id.isdigit() else None
+        if job is None:
+            self._reply(404, {'error': f'No job {job_id}'})
+        return job
+
+    def _authorized(self) -> bool:
+        """ Check the Host header and the token of a request, reply 403 if they are not valid """
+        mme_server = self.server.mme_server
+        if self.headers.get('Host', '') not in [f'{host}:{mme_server.port}' for host in ALLOWED_HOSTS]:
+            self._reply(403, {'error': 'Invalid Host header'})
+            return False
+        if not hmac.compare_digest(self.headers.get(TOKEN_HEADER, '').encode('utf-8'),
+                                   mme_server.token.encode('utf-8')):
+            self._reply(403, {'error': f'Invalid token, the token of the server is in '
+                                       f'"{token_filepath(mme_server.port)}"'})
+            return False
+        return True
+
+    def do_GET(self) -> None:
+        if not self._authorized():
+            return
+        url = urllib.parse.urlsplit(self.path)
+        parts = url.path.strip('/').split('/')
+        if parts == ['jobs']:
+            return self._reply(200, [job.summary() for job in list(self.server.mme_server.jobs.values())])
+        if parts[0] == 'jobs' and parts[2:] in ([], ['results']) and len(parts) > 1:
+            job = self._job(parts[1])
+            if job is None:
+                return
+            if len(parts) == 2:
+                return self._reply(200, job.summary())
+            query = urllib.parse.parse_qs(url.query)
+            start = int(query.get('start', ['0'])[0])
+            job.wait(start, min(float(query.get('wait', ['0'])[0]), MAX_WAIT))
+            start, results = job.page(start)
+            return self._reply(200, {'job': job.summary(), 'start': start, 'results': results})
+        self._reply(404, {'error': f'Unknown path: {url.path}'})
+
+    def do_POST(self) -> None:
+        if not self._authorized():
+            return
+        if self.headers.get_content_type() != 'application/json':
+            return self._reply(415, {'error': 'The body must be application/json'})
+        path = urllib.parse.urlsplit(self.path).path
+        parts = path.strip('/').split('/')
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except json.JSONDecodeError as e:
+            return self._reply(400, {'error': f'Invalid JSON body: {str(e)}'})
+        if parts == ['jobs']:
+            try:
+                job = self.server.mme_server.submit(body['csv'], body['images'], body.get('options', {}))
+            except KeyError as e:
+                return self._reply(400, {'error': f'Missing job field: {str(e)}'})
+            except (mme.MMEError, TypeError, ValueError) as e:
+                return self._reply(400, {'error': str(e)})
+            return self._reply(202, job.summary())
+        if len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'cancel':
+            job = self._job(parts[1])
+            if job is not None:
+                job.cancelled.set()
+                self._reply(200, job.summary())
+            return
+        if parts == ['shutdown']:
+            self._reply(200, {'state': 'shutting down'})
+            return threading.Thread(target=self.server.mme_server.shutdown, daemon=True).start()
+        self._reply(404, {'error': f'Unknown path: {path}'})
+
+
+class RemoteJob:
+    """ A job submitted to a server: iterate it for the RowResult of every row, as they are processed. Its summary
+    (row_count, errors, successes, error_log, missing...) is updated with the results. Closing the iterator early
+    cancels the job, and MMEError is raised if the job failed """
+
+    def __init__(self, client: 'MMEClient', summary: dict):
+        self.client: MMEClient = client
+        self.summary: dict = summary
+
+    def __getattr__(self, name: str):
+        try:
+            return self.__dict__['summary'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __iter__(self) -> Iterator[RowResult]:
+        start = 0
+        try:
+            while True:
+                page = self.client.request('GET', f'/jobs/{self.summary["id"]}/results?start={start}&wait={MAX_WAIT}')
+                self.summary = page['job']
+                for result in page['results']:
+                    yield RowResult.from_dict(result)
+                start = page['start'] + len(page['results'])  # Past the results dropped by the server, if any
+                if self.summary['state'] not in ('queued', 'running') and start >= self.summary['rows']:
+                    break
+        except GeneratorExit:
+            with contextlib.suppress(mme.MMEError):  # The job may have ended, or the server stopped
+                self.cancel()
+            raise
+        if self.summary['state'] == 'failed':
+            raise mme.MMEError(self.summary['error'])
+
+    def cancel(self) -> None:
+        """ Cancel the job, a running job stops after its current row """
+        self.summary = self.client.request('POST', f'/jobs/{self.summary["id"]}/cancel')
+
+
+class MMEClient:
+    """ Client of an MME server """
+
+    def __init__(self, url: Optional[str] = None):
+        self.url: str = (url or os.environ.get(SERVER_ENVIRONMENT) or DEFAULT_URL).rstrip('/')
+        self.token: Optional[str] = self._read_token()
+
+    def _read_token(self) -> Optional[str]:
+        """ The token of the server, from the token file of its port (None if there is none, the server refuses the
+        requests) """
+        try:
+            with open(token_filepath(urllib.parse.urlsplit(self.url).port or 80), 'r', encoding='utf-8') as r_file:
+                return r_file.read().strip()
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def connect(url: Optional[str] = None) -> Optional['MMEClient']:
+        """ A client of the server, None if no server is running """
+        client = MMEClient(url)
+        try:
+            client.request('GET', '/jobs', timeout=1)
+        except mme.MMEError:
+            return None
+        return client
+
+    def request(self, method: str, path: str, body: Optional[dict] = None, timeout: float = MAX_WAIT + 30) -> dict:
+        """ Send a request, return its JSON reply (MMEError if the server is not reachable, or replied an error) """
+        data = json.dumps(body).encode('utf-8') if body is not None else (b'{}' if method == 'POST' else None)
+        headers = {'Content-Type': 'application/json', TOKEN_HEADER: self.token or ''}
+        request = urllib.request.Request(f'{self.url}{path}', data=data, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise mme.MMEError(json.loads(e.read() or b'{}').get('error', str(e)))
+        except (urllib.error.URLError, OSError) as e:
+            raise mme.MMEError(f'No MME server at {self.url}: {str(e)}')
+
+    def submit(self, csv_filepath: str, images_root_path: str, **options) -> RemoteJob:
+        """ Submit a job with Settings.from_options options (see JOB_OPTIONS), MMEError if it is not valid """
+        options = {name: os.path.abspath(value) if name in PATH_OPTIONS and value else value
+                   for name, value in options.items()}
+        summary = self.request('POST', '/jobs', {'csv': os.path.abspath(csv_filepath),
+                                                 'images': os.path.abspath(images_root_path), 'options': options})
+        return RemoteJob(self, summary)
+
+    def jobs(self) -> list[dict]:
+        """ Summaries of the jobs of the server """
+        return self.request('GET', '/jobs')
+
+    def shutdown(self) -> None:
+        """ Stop the server, cancelling its jobs """
+        self.request('POST', '/shutdown')
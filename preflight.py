@@ -0,0 +1,155 @@
+"""
+Pre-flight checks of a CSV: the problems a run would only find one row (and several exiftool calls) at a time.
+
+The tags of vrae.config and isadg.config, and their types, are read from the configs themselves, so a map pointing to
+a tag the configs do not define is found before any file is written. The values of the tags with a checked type (the
+built-in tags of the maps, e.g. IPTC:DateCreated or GPSLatitude, and any non-string tag of the configs) are checked
+the way exiftool converts them, without running it.
+"""
+import re
+
+from typing import Callable, Optional
+
+# Types of the exiftool built-in tags of the maps whose values exiftool rejects (the configs only define their tags)
+TAG_TYPES = {
+    'iptc:datecreated': 'iptc-date',
+    'iptc:copyrightnotice': 'iptc-string128',
+    'gpslatitude': 'latitude',
+    'gpslongitude': 'longitude',
+}
+
+TOKEN_PATTERN = re.compile(r"""'((?:[^'\\]|\\.)*)'|"((?:[^"\\]|\\.)*)"|(=>|[{}()\[\],])|([\w.$-]+)""")
+TABLE_PATTERN = re.compile(r'%Image::ExifTool::UserDefined::\w+\s*=\s*\(')
+NUMBER_PATTERN = re.compile(r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?')
+
+
+def _pattern_check(pattern: str, error: str) -> Callable[[str], Optional[str]]:
+    """ Check that a value matches a pattern """
+    compiled = re.compile(pattern, re.IGNORECASE)
+    return lambda value: None if compiled.search(value) else error
+
+
+def _length_check(max_length: int) -> Callable[[str], Optional[str]]:
+    """ Check that a value fits a fixed-length IPTC record, exiftool truncates it with a warning """
+    return lambda value: None if len(value) <= max_length else f'Exceeds length limit of {max_length} (truncated)'
+
+
+def _degrees_check(max_degrees: int) -> Callable[[str], Optional[str]]:
+    """ Check a GPS coordinate: decimal degrees, or degrees, minutes and seconds, e.g. "34 36 0 S" """
+    def check(value: str) -> Optional[str]:
+        numbers = [float(number) for number in NUMBER_PATTERN.findall(value)[:3]]
+        if not numbers:
+            return 'Error converting value (not a coordinate)'
+        degrees = abs(numbers[0]) + sum(number / 60 ** power for power, number in enumerate(numbers[1:], 1))
+        if degrees > max_degrees:
+            return f'Out of range (more than {max_degrees} degrees)'
+        return None
+    return check
+
+
+VALUE_CHECKS: dict[str, Callable[[str], Optional[str]]] = {
+    'integer': _pattern_check(r'^\s*[+-]?\d+\s*$', 'Not an integer'),
+    'real': _pattern_check(rf'^\s*{NUMBER_PATTERN.pattern}\s*$', 'Not a number'),
+    'rational': _pattern_check(rf'^\s*{NUMBER_PATTERN.pattern}(/\d+)?\s*$', 'Not a number'),
+    'boolean': _pattern_check(r'^\s*(true|false)\s*$', 'Not True or False'),
+    'iptc-date': _pattern_check(r'\d{4}:?\d{2}:?\d{2}', 'Invalid date format (use YYYY:mm:dd)'),
+    'iptc-string128': _length_check(128),
+    'latitude': _degrees_check(90),
+    'longitude': _degrees_check(180),
+}
+
+
+def _tokenize(text: str) -> list[tuple[str, str]]:
+    """ (kind, text) tokens of the Perl hashes of a config, kind is "string", "symbol" or "word" """
+    tokens = []
+    for single_quoted, double_quoted, symbol, word in TOKEN_PATTERN.findall(text):
+        if symbol:
+            tokens.append(('symbol', symbol))
+        elif word:
+            tokens.append(('word', word))
+        else:
+            tokens.append(('string', single_quoted or double_quoted))
+    return tokens
+
+
+def _parse_value(tokens: list[tuple[str, str]], pos: int) -> tuple[object, int]:
+    """ Parse a hash, a list or a scalar, return it and the position after it """
+    kind, text = tokens[pos]
+    if (kind, text) in (('symbol', '{'), ('symbol', '(')):
+        return _parse_hash(tokens, pos + 1)
+    if (kind, text) == ('symbol', '['):
+        values, pos = [], pos + 1
+        while tokens[pos] != ('symbol', ']'):
+            value, pos = _parse_value(tokens, pos)
+            values.append(value)
+            if tokens[pos] == ('symbol', ','):
+                pos += 1
+        return values, pos + 1
+    if kind == 'symbol':
+        raise ValueError(f'Unexpected "{text}"')
+    return text, pos + 1
+
+
+def _parse_hash(tokens: list[tuple[str, str]], pos: int) -> tuple[dict, int]:
+    """ Parse the "key => value," pairs of a hash up to its closing bracket, return it and the position after it """
+    result = {}
+    while tokens[pos] not in (('symbol', '}'), ('symbol', ')')):
+        key, pos = _parse_value(tokens, pos)
+        if tokens[pos] != ('symbol', '=>'):
+            raise ValueError(f'Expected "=>" after "{key}"')
+        result[key], pos = _parse_value(tokens, pos + 1)
+        if tokens[pos] == ('symbol', ','):
+            pos += 1
+    return result, pos + 1
+
+
+def _add_tags(tags: dict[str, str], group: str, name: str, entry: dict, writable: str) -> None:
+    """ Add a tag, or the flattened tags of a structure (name + field name, e.g. IdentityReference) """
+    struct = entry.get('Struct')
+    if isinstance(struct, dict):
+        tags[f'{group}:{name}'.lower()] = 'struct'
+        for field, field_entry in struct.items():
+            if isinstance(field_entry, dict) and not field.isupper():  # Not STRUCT_NAME, NAMESPACE...
+                _add_tags(tags, group, f'{name}{field[:1].upper()}{field[1:]}', field_entry, 'string')
+    else:
+        tags[f'{group}:{name}'.lower()] = str(entry.get('Writable', writable))
+
+
+def read_config_tags(config_filepath: str) -> dict[str, str]:
+    """ Lowercase "group:name" -> type (Writable) of every tag defined by an exiftool config. Raise ValueError if
+    the config can not be parsed """
+    with open(config_filepath, 'r', encoding='utf-8') as r_file:
+        text = re.sub(r'#[^\n]*', '', r_file.read())
+
+    tags = {}
+    for match in TABLE_PATTERN.finditer(text):
+        tokens = _tokenize(text[match.end():])
+        try:
+            table, _ = _parse_hash(tokens, 0)
+        except IndexError:
+            raise ValueError('Unterminated table')
+        group = table.get('GROUPS', {}).get('1', 'XMP')
+        writable = str(table.get('WRITABLE', 'string'))
+        for key, entry in table.items():
+            if isinstance(entry, dict) and not key.isupper():  # Not GROUPS, NAMESPACE...
+                _add_tags(tags, group, str(entry.get('Name', key)), entry, writable)
+    return tags
+
+
+def undefined_tags(tag_maps: dict[str, dict], config_tags: dict[str, str]) -> list[tuple[str, str, str]]:
+    """ (write key, row key, tag) of the mapped tags of a config group that no config defines """
+    groups = {tag.split(':')[0] for tag in config_tags}
+    return [(write_key, key, tag) for write_key, tag_map in tag_maps.items() for key, tag in tag_map.items()
+            if tag.split(':')[0].lower() in groups and tag.lower() not in config_tags]
+
+
+def value_checks(tag_maps: dict[str, dict], columns: set[str],
+                 config_tags: dict[str, str]) -> list[tuple[str, str, str, Callable[[str], Optional[str]]]]:
+    """ (write key, row key, tag, check) of the mapped columns of a CSV header whose tag type is checked """
+    checks = []
+    for write_key, tag_map in tag_maps.items():
+        for key, tag in tag_map.items():
+            tag_type = config_tags.get(tag.lower()) or TAG_TYPES.get(tag.lower())
+            if key in columns and tag_type in VALUE_CHECKS:
+                checks.append((write_key, key, tag, VALUE_CHECKS[tag_type]))
+    return checks
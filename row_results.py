@@ -0,0 +1,107 @@
+"""
+Per-row results of an MME run, for the library API (MME.results).
+
+Every engine logs the rows in CSV row order, so the entries of the error log, the success log and the diff report are
+gathered row by row as they are written: a row is complete when an entry of another row arrives, or when the run ends.
+Entries of the whole run (missing keys, duplicate file names) belong to no row, they are only logged.
+"""
+from typing import Callable, Optional
+
+from log_writer import message_fields
+
+# Status of a row without errors, from the key of its success entries
+STATUS_KEYS = {
+    'SKIP UNCHANGED': 'skipped',
+    'DIFF UNCHANGED': 'unchanged',
+    'CHECK': 'checked',
+}
+
+
+class RowResult:
+    """ Result of a CSV row: its file, status, the tags written, its errors and log entries, and its time """
+    STATUSES = ('written', 'failed', 'skipped', 'unchanged', 'dry run', 'checked')
+
+    def __init__(self, row: int):
+        self.row: int = row  # CSV row index (the header is row 1)
+        self.filepath: Optional[str] = None  # None if the file of the row was not found
+        self.status: str = 'written'  # One of STATUSES, "failed" if any error was logged
+        self.tags: list[str] = []  # Tags written (in diff mode, the changed tags)
+        self.errors: list[str] = []  # Error log entries of the row
+        self.successes: list[str] = []  # Success log entries of the row
+        self.changes: list[str] = []  # Diff report entries of the row (changed, or to change with a dry run)
+        self.seconds: Optional[float] = None  # Time spent on the row, None if written with others (bulk, groups)
+
+    def __repr__(self) -> str:
+        return f'RowResult(row={self.row}, filepath={self.filepath!r}, status={self.status!r}, ' \
+               f'tags={len(self.tags)}, errors={len(self.errors)})'
+
+    def as_dict(self) -> dict:
+        """ The result as a JSON-serializable dictionary """
+        return dict(vars(self))
+
+    @staticmethod
+    def from_dict(values: dict) -> 'RowResult':
+        """ The result of a dictionary made by as_dict (e.g. sent by mme_server.py) """
+        result = RowResult(values['row'])
+        vars(result).update(values)
+        return result
+
+
+class RowResults:
+    """ Gathers the log entries of every row into a RowResult, passed to on_result in CSV row order """
+
+    def __init__(self, on_result: Callable[[RowResult], None], row_tags: dict[int, dict[str, str]],
+                 row_seconds: dict[int, float]):
+        self.on_result: Callable[[RowResult], None] = on_result
+        self.row_tags: dict[int, dict[str, str]] = row_tags  # CSV row index -> tag -> write key, of the rows written
+        self.row_seconds: dict[int, float] = row_seconds  # CSV row index -> time spent on the row
+        self._result: Optional[RowResult] = None
+        self._error_keys: set[Optional[str]] = set()
+        self._success_keys: set[Optional[str]] = set()
+        self._changed: list[tuple[str, str]] = []  # (write key, tag) of the diff report entries
+
+    def add(self, log_name: str, message: str) -> None:
+        """ Add a log entry (LogWriter listener) """
+        fields = message_fields(message)
+        row = fields.get('row')
+        if row is None:
+            return  # An entry of the whole run
+        if self._result is not None and self._result.row != row:
+            self.flush()
+        if self._result is None:
+            self._result = RowResult(row)
+        self._result.filepath = self._result.filepath or fields.get('filepath')
+
+        if log_name == 'error_log':
+            self._result.errors.append(message)
+            self._error_keys.add(fields.get('key'))
+        elif log_name == 'success_log':
+            self._result.successes.append(message)
+            self._success_keys.add(fields.get('key'))
+        else:
+            self._result.changes.append(message)
+            if 'tag' in fields:
+                self._changed.append((fields.get('key'), fields['tag']))
+
+    def flush(self) -> None:
+        """ Pass on the result of the current row, once all its entries are in """
+        result, self._result = self._result, None
+        if result is None:
+            return
+        row_tags = self.row_tags.pop(result.row, {})
+        result.seconds = self.row_seconds.pop(result.row, None)
+        if result.errors:
+            result.status = 'failed'
+        elif any('DRY RUN: "' in message for message in result.successes):
+            result.status = 'dry run'
+        else:
+            result.status = next((STATUS_KEYS[key] for key in self._success_keys if key in STATUS_KEYS), 'written')
+
+        if result.status in ('written', 'failed'):
+            if self._changed:  # Written by a single command, that logs a success unless it failed
+                result.tags = [tag for write_key, tag in self._changed
+                               if self._success_keys and write_key not in self._error_keys]
+            else:
+                result.tags = [tag for tag, write_key in row_tags.items() if write_key in self._success_keys]
+        self._error_keys, self._success_keys, self._changed = set(), set(), []
+        self.on_result(result)
@@ -0,0 +1,48 @@
+"""
+I/O-locality scheduling of the rows of a CSV, for the --schedule mode.
+
+CSV order jumps between directories, and mixes small JPEGs with multi-GB TIFFs. The scheduler reads the rows a window
+at a time, and orders their work by directory (then file name), so the files of a directory are read and rewritten
+together (disk and NAS locality). The files over a size limit go to a lane of their own, run with its own concurrency,
+so a few large files do not hold back all the small ones.
+
+The unit of work is a task: the rows of one file, in CSV order (the rows that write the same file must be applied in
+order, so they are never split between workers). A row without a file is a task of its own. The logs are still merged
+in CSV row order, by the caller.
+"""
+import os
+
+from typing import Callable, Optional
+
+# A scheduled row: (index, row, current tags), as read by MME._process_rows
+Entry = tuple[int, dict, Optional[dict]]
+
+
+def file_size(filepath: Optional[str]) -> int:
+    """ Size of a file, 0 if it has none or can not be read (it is reported when its row is processed) """
+    try:
+        return os.path.getsize(filepath) if filepath else 0
+    except OSError:
+        return 0
+
+
+def schedule(window: list[Entry], find: Callable[[str], Optional[str]],
+             large_file_bytes: int) -> tuple[list[tuple[Optional[str], list[Entry]]],
+                                             list[tuple[Optional[str], list[Entry]]]]:
+    """ Split a window of rows into the (filepath, rows) tasks of the small files and of the large files (over
+    large_file_bytes), each ordered by directory and file name. find returns the filepath of a "File Name" """
+    tasks: dict[str, list[Entry]] = {}
+    unresolved = []
+    for entry in window:
+        filename = entry[1].get('File Name')
+        filepath = find(filename) if filename else None
+        if filepath is None:
+            unresolved.append((None, [entry]))
+        else:
+            tasks.setdefault(filepath, []).append(entry)
+
+    small, large = list(unresolved), []
+    for filepath in sorted(tasks, key=lambda path: (os.path.dirname(path), os.path.basename(path))):
+        lane = large if large_file_bytes and file_size(filepath) > large_file_bytes else small
+        lane.append((filepath, tasks[filepath]))
+    return small, large
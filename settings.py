@@ -0,0 +1,85 @@
+"""
+Settings of an MME run, grouped by what they are about:
+- EngineSettings: how the rows are written (the write mode, and the parallelism),
+- InputSettings: which files and rows are processed (the file index, the shard, the journal of the skipped files),
+- OutputSettings: what is reported, and where (the console, the logs, the profile and the metrics).
+
+The resident objects shared between runs (exiftool pools, file index, maps) are not settings: they are given to MME
+on their own. Settings.from_options builds the settings from the flat options of the command line, of the server
+jobs and of GMME.
+"""
+import dataclasses
+
+from typing import Optional
+
+
+@dataclasses.dataclass
+class EngineSettings:
+    """ How the rows are written """
+    single_pass: bool = False  # Rewrite each file once, instead of once per delete/tag
+    diff: bool = False  # Write only the tags that differ from the current tags
+    dry_run: bool = False  # Only report the tags that would change, without writing them
+    in_place: bool = False  # Update the XMP packet of the files in place, when only XMP tags change
+    bulk: bool = False  # Write the files of each directory with one exiftool -csv= import
+    group_rows: bool = False  # Write the tags shared by consecutive rows once for all their files
+    async_engine: bool = False  # Process the rows with the asyncio pipeline, workers as taggers
+    check: bool = False  # Only check the rows against the maps, the files and the tag types, no exiftool
+    workers: int = 1  # Rows processed in parallel
+    schedule: bool = False  # Process the rows by directory, the large files on a lane of their own
+    large_file_mb: int = 256  # Files over this size go to the large files lane
+    large_workers: int = 1  # Large files processed in parallel
+    adaptive: bool = False  # Tune the rows in flight between min_workers and workers
+    min_workers: int = 1
+
+
+@dataclasses.dataclass
+class InputSettings:
+    """ Which files and rows are processed """
+    max_depth: int = 3  # Directory levels of the images root indexed
+    index_filepath: Optional[str] = None  # Where to save/load the file index
+    index_cache: bool = True  # Without index_filepath, use the shared cache of the images root
+    shard: Optional[tuple[int, int]] = None  # (K, N): only process the rows of shard K of N
+    rows: Optional[set[int]] = None  # Only process these CSV rows (the header is row 1)
+    journal_filepath: Optional[str] = None  # Journal of the written files, if set
+    resume: bool = False  # Skip the files already written by the interrupted run of the same CSV
+    incremental: bool = False  # Skip the files already written by any run, with the same values
+
+
+@dataclasses.dataclass
+class OutputSettings:
+    """ What is reported, and where """
+    quiet: bool = False  # Print nothing to the console (the logs and results() report everything)
+    row_progress_notify: int = 100  # Every how many rows to notify progress
+    notify_on_broken_keys: bool = False
+    log_path: Optional[str] = None  # Directory of the logs, the one of mme.py by default
+    log_format: str = 'text'  # "text" or "jsonl"
+    log_max_bytes: int = 0  # Rotate the log files over this size, 0 to never rotate
+    profile_filepath: Optional[str] = None  # Where to save a cProfile dump of the run, if set
+    metrics_filepath: Optional[str] = None  # Where to save the metrics (with histograms), if set
+
+
+@dataclasses.dataclass
+class Settings:
+    """ Settings of a run """
+    engine: EngineSettings = dataclasses.field(default_factory=EngineSettings)
+    input: InputSettings = dataclasses.field(default_factory=InputSettings)
+    output: OutputSettings = dataclasses.field(default_factory=OutputSettings)
+
+    @classmethod
+    def from_options(cls, **options) -> 'Settings':
+        """ Settings of flat options (e.g. workers=4, quiet=True), TypeError for an unknown option """
+        groups = {}
+        for field in dataclasses.fields(cls):
+            names = {group_field.name for group_field in dataclasses.fields(field.default_factory)}  # type: ignore
+            groups[field.name] = field.default_factory(**{name: value for name, value in options.items()  # type: ignore
+                                                         if name in names})
+        unknown = set(options) - set(cls.option_names())
+        if unknown:
+            raise TypeError(f'Unknown MME options: {", ".join(sorted(unknown))}')
+        return cls(**groups)
+
+    @classmethod
+    def option_names(cls) -> list[str]:
+        """ Names of the flat options, in the order of their groups """
+        return [group_field.name for field in dataclasses.fields(cls)
+                for group_field in dataclasses.fields(field.default_factory)]  # type: ignore
@@ -0,0 +1,171 @@
+"""
+Sharded runs: split the rows of a CSV between several MME processes (or hosts sharing the same storage), and merge
+their outputs.
+
+Rows are assigned to shards by a hash of their "File Name": the same file always belongs to the same shard, so no two
+shards ever write the same file, and every shard of a run reads the same CSV and skips the rows of the others. Each
+shard writes its own logs and journal, named with a ".shard-K-of-N" suffix, e.g. error_log_x.shard-2-of-4.txt and
+mme_journal.shard-2-of-4.sqlite. Merging them gives the logs of an unsharded run, in CSV row order, and one journal.
+
+Usage:
+    python sharding.py SHARD_FILE [SHARD_FILE ...]
+"""
+import os
+import re
+import sys
+import json
+import zlib
+import heapq
+import argparse
+import itertools
+import subprocess
+
+from typing import Iterator, Optional
+
+from journal import Journal
+from log_writer import FIELD_PATTERNS
+
+SHARD_PATTERN = re.compile(r'^(\d+)/(\d+)$')  # K/N
+SHARD_FILE_PATTERN = re.compile(r'^(.*)\.shard-(\d+)-of-(\d+)(\.\w+)$')
+SHARD_PART_PATTERN = re.compile(r'\.shard-\d+-of-\d+\.\d+\.\w+$')  # Rotated log part, read with its first part
+LOG_TIME_PATTERN = re.compile(r'-\d{4}-\d{1,2}-\d{1,2} \d{2}-\d{2}-\d{2}$')  # Start time in the log names
+
+
+def parse_shard(text: str) -> tuple[int, int]:
+    """ Parse a "K/N" shard, 1 <= K <= N """
+    match = SHARD_PATTERN.match(text)
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise ValueError(f'Invalid shard: {text} (expected K/N, with 1 <= K <= N)')
+    return int(match.group(1)), int(match.group(2))
+
+
+def shard_of(filename: str, shards: int) -> int:
+    """ Shard (1 to shards) of the rows of a "File Name", the same on every host and run """
+    return zlib.crc32(filename.encode('utf-8')) % shards + 1
+
+
+def shard_filepath(filepath: str, shard: int, shards: int) -> str:
+    """ Filepath of the output of a shard, e.g. mme_journal.shard-1-of-4.sqlite """
+    root, extension = os.path.splitext(filepath)
+    return f'{root}.shard-{shard}-of-{shards}{extension}'
+
+
+def shard_argv(argv: list[str], option: str, shard: int, shards: int) -> list[str]:
+    """ Command line arguments of a shard process: argv without option (and its value), with --shard K/N """
+    shard_args = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == option:
+            skip = True  # Skip its value too
+        elif not arg.startswith(f'{option}='):
+            shard_args.append(arg)
+    return shard_args + ['--shard', f'{shard}/{shards}']
+
+
+def run_local(script_filepath: str, argv: list[str], option: str, shards: int) -> list[int]:
+    """ Run every shard of a run as a local process, a stand-in for several hosts, and return their exit codes """
+    processes = [subprocess.Popen([sys.executable, script_filepath] + shard_argv(argv, option, shard, shards))
+                 for shard in range(1, shards + 1)]
+    return [process.wait() for process in processes]
+
+
+def _log_lines(filepath: str) -> Iterator[str]:
+    """ Entries of a log, and of its rotated parts (x.1.txt, x.2.txt...) """
+    root, extension = os.path.splitext(filepath)
+    part, part_filepath = 0, filepath
+    while os.path.exists(part_filepath):
+        with open(part_filepath, 'r', encoding='utf-8') as r_file:
+            for line in r_file:
+                if line.strip():
+                    yield line.rstrip('\n')
+        part += 1
+        part_filepath = f'{root}.{part}{extension}'
+
+
+def _entry_row(line: str, jsonl: bool) -> Optional[int]:
+    """ CSV row of a log entry, None for the entries of the whole run (e.g. MISSING KEY) """
+    if jsonl:
+        return json.loads(line).get('row')
+    match = FIELD_PATTERNS['row'].search(line)
+    return int(match.group(1)) if match else None
+
+
+def merge_logs(filepaths: list[str], output_filepath: str) -> int:
+    """ Merge the logs of every shard into one log in CSV row order, return its number of entries. The entries of
+    the whole run, logged by every shard, are written once, first (as an unsharded run logs them before the rows) """
+    jsonl = output_filepath.endswith('.jsonl')
+    run_entries = {}  # Message -> entry
+    for filepath in filepaths:
+        for line in _log_lines(filepath):
+            if _entry_row(line, jsonl) is None:
+                run_entries.setdefault(json.loads(line)['message'] if jsonl else line, line)
+
+    row_entries = [((_entry_row(line, jsonl), line) for line in _log_lines(filepath)) for filepath in filepaths]
+    entries = heapq.merge(*[(entry for entry in shard_entries if entry[0] is not None)
+                            for shard_entries in row_entries], key=lambda entry: entry[0])
+    count = 0
+    with open(output_filepath, 'w', encoding='utf-8') as w_file:
+        for line in itertools.chain(run_entries.values(), (line for _, line in entries)):
+            if jsonl:
+                w_file.write(f'{line}\n')
+            else:
+                w_file.write(line if not count else f'\n{line}')  # No trailing line break, as LogWriter
+            count += 1
+    return count
+
+
+def merge_journals(filepaths: list[str], output_filepath: str) -> int:
+    """ Merge the journals of every shard into one journal (added to its entries, if it exists), return the number of
+    files merged """
+    journal = Journal(output_filepath, {})  # The maps only hash rows, nothing is hashed here
+    try:
+        return sum(journal.merge(filepath) for filepath in filepaths)
+    finally:
+        journal.close()
+
+
+def merge(filepaths: list[str]) -> dict[str, int]:
+    """ Merge the logs and journals of the shards of a run (every shard of every output is needed), return the
+    number of entries of every merged output. The outputs are named as the shard 1 outputs, without the suffix """
+    groups = {}  # (Name without the start time, shards, extension) -> {shard: filepath}
+    for filepath in filepaths:
+        if SHARD_PART_PATTERN.search(filepath):
+            continue  # Read with the first part of its log
+        match = SHARD_FILE_PATTERN.match(filepath)
+        if not match:
+            raise ValueError(f'Not the output of a shard: "{filepath}"')
+        root, shard, shards, extension = match.group(1), int(match.group(2)), int(match.group(3)), match.group(4)
+        # The logs of every shard are named after the time the shard started
+        group = groups.setdefault((LOG_TIME_PATTERN.sub('', root), shards, extension), {})
+        if shard in group:
+            raise ValueError(f'Shard {shard} of {shards} found twice: "{group[shard]}" and "{filepath}"')
+        group[shard] = filepath
+
+    counts = {}
+    for (*_, shards, extension), group in groups.items():
+        missing = sorted(set(range(1, shards + 1)) - set(group))
+        if missing:
+            raise ValueError(f'Shards {", ".join(map(str, missing))} of {shards} missing, for: "{group[min(group)]}"')
+        shard_filepaths = [group[shard] for shard in range(1, shards + 1)]
+        output_filepath = SHARD_FILE_PATTERN.sub(r'\1\4', shard_filepaths[0])
+        if extension == '.sqlite':
+            counts[output_filepath] = merge_journals(shard_filepaths, output_filepath)
+        else:
+            counts[output_filepath] = merge_logs(shard_filepaths, output_filepath)
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge the logs and journals written by the shards of a run '
+                                                 '(mme.py --shard K/N) into the logs and journal of the whole run.')
+    parser.add_argument('SHARD_FILES', nargs='+', type=str,
+                        help='logs (and rotated parts) and journals of every shard, e.g. *.shard-*-of-4.*')
+    parsed_args = parser.parse_args()
+    try:
+        merged = merge(parsed_args.SHARD_FILES)
+    except ValueError as e:
+        sys.exit(str(e))
+    for merged_filepath, entries in merged.items():
+        print(f'{merged_filepath}: {entries} entries')
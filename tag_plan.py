@@ -0,0 +1,76 @@
+"""
+Tag plan of a CSV: the exiftool arguments of every standard, compiled once from the CSV header and the maps.
+
+Every row of a CSV has the same columns, so which mapped columns exist, which are missing, and the "-Tag=" prefix of
+each argument only depend on the header. They are resolved once per run, and each row only fills in its values.
+
+The arguments are also split into units, one per tag name: the arguments of a unit write the same tag, and must be
+written by the same command (the values of a list tag written by several arguments are added up within a command, and
+replaced across commands), so the arguments shared by a group of rows are split by unit.
+"""
+from typing import Iterable, Optional
+
+import metadata_diff
+
+
+class TagPlan:
+    """ Tags written for the columns of a CSV header, per write key (standard), in write order """
+
+    def __init__(self, columns: Iterable[str], tag_maps: dict[str, dict]):
+        """ tag_maps: write key -> tag map (column -> exiftool tag) """
+        columns = set(columns)
+        self.tags: dict[str, list[tuple[str, str]]] = {}  # Write key -> (column, "-tag=" prefix) of existing columns
+        self.missing: dict[str, list[str]] = {}  # Write key -> mapped columns missing from the header
+        for write_key, tag_map in tag_maps.items():
+            self.tags[write_key] = [(key, f'-{tag}=') for key, tag in tag_map.items() if key in columns]
+            self.missing[write_key] = [key for key in tag_map if key not in columns]
+
+        # Lowercase exiftool tag name -> (write key, row key) of its first write, to match warnings with their row key
+        self.tag_keys: dict[str, tuple[str, str]] = {}
+        # Tag -> (write key, row key) of its last write, as a full run leaves it, for the diff mode
+        self.desired_keys: dict[str, tuple[str, str]] = {}
+        for write_key, tag_map in tag_maps.items():
+            for key in [key for key, _ in self.tags[write_key]]:
+                self.tag_keys.setdefault(tag_map[key].lower(), (write_key, key))
+                for tag in [tag for tag in self.desired_keys if metadata_diff.same_tag(tag, tag_map[key])]:
+                    del self.desired_keys[tag]
+                self.desired_keys[tag_map[key]] = (write_key, key)
+        self.desired_tag_keys: dict[str, tuple[str, str]] = {tag.lower(): keys
+                                                              for tag, keys in self.desired_keys.items()}
+
+        # (row key, "-tag=" prefix) of the arguments writing each tag name (any group), in write order
+        units: dict[str, list[tuple[str, str]]] = {}
+        for write_key, tag_map in tag_maps.items():
+            for key, prefix in self.tags[write_key]:
+                units.setdefault(tag_map[key].lower().rpartition(':')[2], []).append((key, prefix))
+        self.units: list[list[tuple[str, str]]] = list(units.values())
+
+    def arguments(self, write_key: str, row: dict) -> list[str]:
+        """ "-tag=value" arguments of a row, for a write key """
+        return [f'{prefix}{row[key]}' for key, prefix in self.tags[write_key]]
+
+    def all_arguments(self, row: dict) -> list[str]:
+        """ "-tag=value" arguments of a row, for every write key """
+        return [f'{prefix}{row[key]}' for tags in self.tags.values() for key, prefix in tags]
+
+    def shared_units(self, rows: list[dict], units: Optional[set[int]] = None) -> set[int]:
+        """ Indexes of the units (of units, or of every unit) with the same values in every row """
+        units = range(len(self.units)) if units is None else units
+        return {unit for unit in units
+                if all(row[key] == rows[0][key] for row in rows[1:] for key, _ in self.units[unit])}
+
+    def split_arguments(self, rows: list[dict], shared: set[int]) -> tuple[list[str], list[list[str]]]:
+        """ "-tag=value" arguments of the shared units (written once for every row), and of the other units of each
+        row """
+        shared_arguments, row_arguments = [], [[] for _ in rows]
+        for unit, unit_arguments in enumerate(self.units):
+            if unit in shared:
+                shared_arguments.extend(f'{prefix}{rows[0][key]}' for key, prefix in unit_arguments)
+            else:
+                for arguments, row in zip(row_arguments, rows):
+                    arguments.extend(f'{prefix}{row[key]}' for key, prefix in unit_arguments)
+        return shared_arguments, row_arguments
+
+    def desired(self, row: dict) -> dict[str, tuple[str, str, str]]:
+        """ Tag -> (write key, row key, value) of a row, each tag once """
+        return {tag: (write_key, key, row[key]) for tag, (write_key, key) in self.desired_keys.items()}
@@ -0,0 +1,5 @@
+""" The modules of MME are run from the repository root, they are imported from it by the tests too """
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,77 @@
+""" Comparison of the current tags of a file with the tags of a CSV row, for the --diff mode """
+import metadata_diff
+
+
+def test_read_arguments():
+    maps = {'vrae': {'Title': 'XMP-vrae:WorkTitle'}, 'dc': {'Creator': 'xmp:Creator', 'Author': 'xmp:Creator'}}
+    assert metadata_diff.read_arguments(maps) == ['-j', '-G1', '-xmp-vrae:all', '-xmp-isadg:all', '-xmp-dc:all',
+                                                  '-XMP-vrae:WorkTitle', '-xmp:Creator']
+
+
+def test_tag_matches():
+    assert metadata_diff.tag_matches('xmp:Creator', 'XMP-dc:Creator')
+    assert metadata_diff.tag_matches('Creator', 'XMP-dc:Creator')
+    assert metadata_diff.tag_matches('XMP-dc:creator', 'XMP-dc:Creator')
+    assert not metadata_diff.tag_matches('xmp-dc:Creator', 'XMP:Creator')
+    assert not metadata_diff.tag_matches('xmp:Creator', 'XMP-dc:Contributor')
+    assert not metadata_diff.tag_matches('iptc:Creator', 'XMP-dc:Creator')
+
+
+def test_same_tag():
+    assert metadata_diff.same_tag('xmp:Creator', 'xmp-dc:creator')
+    assert metadata_diff.same_tag('xmp-dc:Creator', 'xmp:Creator')
+    assert not metadata_diff.same_tag('iptc:Creator', 'xmp-dc:Creator')
+
+
+def test_as_text():
+    assert metadata_diff.as_text(['one']) == 'one'
+    assert metadata_diff.as_text(['one', 'two']) == '["one", "two"]'
+    assert metadata_diff.as_text({'Title': 'Año'}) == '{"Title": "Año"}'
+    assert metadata_diff.as_text(12.5) == '12.5'
+
+
+def test_same_value():
+    assert metadata_diff.same_value(' Title ', 'Title')
+    assert metadata_diff.same_value('2022:07:06', '2022-07-06')
+    assert metadata_diff.same_value('34 deg 36\' 0.00" S', '34.6')
+    assert metadata_diff.same_value(1, '1.0')
+    assert not metadata_diff.same_value('2022:07:06', '2022-07-07')
+    assert not metadata_diff.same_value('Title', 'title')
+    assert not metadata_diff.same_value('2022:07:06 10:00', '2022-07-06')
+
+
+def test_diff_tags():
+    desired = {'XMP-vrae:WorkTitle': ('WRITE VRAE TAGS', 'Title', 'New title'),
+               'xmp:Creator': ('WRITE DC TAGS', 'Creator', 'Someone'),
+               'XMP-vrae:WorkAgent': ('WRITE VRAE TAGS', 'Agent', ''),
+               'XMP-vrae:WorkRefid': ('WRITE VRAE TAGS', 'Refid', '7'),
+               'IPTC:DateCreated': ('WRITE DC TAGS', 'Date', '2022-07-06')}
+    current = {'SourceFile': 'a.jpg', 'XMP-vrae:WorkTitle': 'Old title', 'XMP-dc:Creator': ['Someone'],
+               'XMP-vrae:WorkAgent': 'An agent', 'XMP-vrae:WorkHref': 'http://example.com',
+               'IPTC:DateCreated': '2022:07:06'}
+    assert metadata_diff.diff_tags(desired, current) == [
+        ('XMP-vrae:WorkTitle', 'WRITE VRAE TAGS', 'Title', 'Old title', 'New title'),
+        ('XMP-vrae:WorkAgent', 'WRITE VRAE TAGS', 'Agent', 'An agent', ''),
+        ('XMP-vrae:WorkRefid', 'WRITE VRAE TAGS', 'Refid', '', '7'),
+        ('XMP-vrae:WorkHref', None, None, 'http://example.com', ''),  # Left in a cleared group
+    ]
+
+
+def test_diff_tags_unchanged():
+    desired = {'XMP-vrae:WorkTitle': ('WRITE VRAE TAGS', 'Title', 'Title'),
+               'XMP-vrae:WorkAgent': ('WRITE VRAE TAGS', 'Agent', '')}
+    assert metadata_diff.diff_tags(desired, {'XMP-vrae:WorkTitle': 'Title'}) == []
+
+
+def test_write_arguments_rewrite_the_changed_cleared_groups():
+    desired = {'XMP-vrae:WorkTitle': ('WRITE VRAE TAGS', 'Title', 'New title'),
+               'XMP-vrae:WorkRefid': ('WRITE VRAE TAGS', 'Refid', '7'),
+               'XMP-vrae:WorkAgent': ('WRITE VRAE TAGS', 'Agent', ''),
+               'xmp:Creator': ('WRITE DC TAGS', 'Creator', 'Someone'),
+               'IPTC:DateCreated': ('WRITE DC TAGS', 'Date', '2022:07:07'),
+               'IPTC:Keywords': ('WRITE DC TAGS', 'Keywords', 'unchanged')}
+    current = {'XMP-vrae:WorkTitle': 'Old title', 'XMP-vrae:WorkRefid': '7', 'XMP-dc:Creator': 'Someone',
+               'IPTC:DateCreated': '2022:07:06', 'IPTC:Keywords': 'unchanged'}
+    changes = metadata_diff.diff_tags(desired, current)
+    assert metadata_diff.write_arguments(desired, current, changes) == [
+        '-xmp-vrae:all=', '-XMP-vrae:WorkTitle=New title', '-XMP-vrae:WorkRefid=7', '-IPTC:DateCreated=2022:07:07']
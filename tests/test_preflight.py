@@ -0,0 +1,127 @@
+""" Pre-flight checks: the tags of the exiftool configs, and the checks of the values of the mapped columns """
+import os
+
+import pytest
+
+import preflight
+
+CONFIGS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'exiftool_configs')
+
+CONFIG = """
+# A config with the syntax of vrae.config and isadg.config: {braces} and 'quotes' in a comment are ignored
+%Image::ExifTool::UserDefined = (
+    'Image::ExifTool::XMP::Main' => {
+        test => { SubDirectory => { TagTable => 'Image::ExifTool::UserDefined::test' } },
+    },
+);
+
+%Image::ExifTool::UserDefined::test = (
+    GROUPS => { 0 => 'XMP', 1 => 'XMP-test', 2 => 'Image' },
+    NAMESPACE => { 'test' => 'http://example.com/test/1.0/' },
+    WRITABLE => 'string', # (default to string-type tags)
+    'work.title' => { Name => 'WorkTitle' },
+    "work.count" => { Name => 'WorkCount', Writable => 'integer', List => 'Seq' },
+    Rating => { Writable => 'real', },
+    Identity => {
+        Struct => {
+            STRUCT_NAME => 'Identity',
+            reference => { Writable => 'string' },
+            Date => { Writable => 'date' },
+        },
+    },
+    Keywords => { List => [ 'Bag', 'Seq', ], },
+);
+
+%Image::ExifTool::UserDefined::other = (
+    GROUPS => { 1 => 'XMP-other' },
+    WRITABLE => 'integer',
+    Level => { },
+);
+1;  # end
+"""
+
+
+def _config(tmp_path, text: str) -> str:
+    filepath = tmp_path / 'test.config'
+    filepath.write_text(text, encoding='utf-8')
+    return str(filepath)
+
+
+def test_tokenize():
+    assert preflight._tokenize("""Name => 'Work Title', "a \\"b\\"" => [1, $x], ( )""") == [
+        ('word', 'Name'), ('symbol', '=>'), ('string', 'Work Title'), ('symbol', ','), ('string', 'a \\"b\\"'),
+        ('symbol', '=>'), ('symbol', '['), ('word', '1'), ('symbol', ','), ('word', '$x'), ('symbol', ']'),
+        ('symbol', ','), ('symbol', '('), ('symbol', ')')]
+    assert preflight._tokenize("'it\\'s' => ''") == [('string', "it\\'s"), ('symbol', '=>'), ('string', '')]
+    assert preflight._tokenize("work.agent-name => 1.5") == [('word', 'work.agent-name'), ('symbol', '=>'),
+                                                              ('word', '1.5')]
+
+
+def test_parse_hash():
+    tokens = preflight._tokenize("a => { b => 'c', d => [ 'e', { f => 1 } ], }, 'g' => ( h => 2 ) ) trailing")
+    assert preflight._parse_hash(tokens, 0) == ({'a': {'b': 'c', 'd': ['e', {'f': '1'}]}, 'g': {'h': '2'}},
+                                                len(tokens) - 1)
+    with pytest.raises(ValueError, match='Expected "=>"'):
+        preflight._parse_hash(preflight._tokenize('a , b )'), 0)
+    with pytest.raises(ValueError, match='Unexpected'):
+        preflight._parse_hash(preflight._tokenize('a => , )'), 0)
+
+
+def test_read_config_tags(tmp_path):
+    assert preflight.read_config_tags(_config(tmp_path, CONFIG)) == {
+        'xmp-test:worktitle': 'string',
+        'xmp-test:workcount': 'integer',
+        'xmp-test:rating': 'real',
+        'xmp-test:identity': 'struct',
+        'xmp-test:identityreference': 'string',
+        'xmp-test:identitydate': 'date',
+        'xmp-test:keywords': 'string',
+        'xmp-other:level': 'integer',
+    }
+
+
+def test_read_config_tags_unterminated(tmp_path):
+    with pytest.raises(ValueError, match='Unterminated table'):
+        preflight.read_config_tags(_config(tmp_path, "%Image::ExifTool::UserDefined::test = ( a => { b => 'c' "))
+
+
+def test_read_config_tags_of_the_configs():
+    vrae_tags = preflight.read_config_tags(os.path.join(CONFIGS_PATH, 'vrae.config'))
+    assert vrae_tags['xmp-vrae:workagent'] == 'string'
+    assert vrae_tags['xmp-vrae:collectionrefid'] == 'string'
+    isadg_tags = preflight.read_config_tags(os.path.join(CONFIGS_PATH, 'isadg.config'))
+    assert isadg_tags['xmp-isadg:identity'] == 'struct'
+    assert isadg_tags['xmp-isadg:identityreference'] == 'string'
+    assert isadg_tags['xmp-isadg:notesnote'] == 'string'
+
+
+def test_undefined_tags():
+    config_tags = {'xmp-test:worktitle': 'string'}
+    tag_maps = {'WRITE TEST TAGS': {'Title': 'XMP-test:WorkTitle', 'Date': 'xmp-test:WorkDate',
+                                    'Creator': 'XMP-dc:Creator'}}
+    assert preflight.undefined_tags(tag_maps, config_tags) == [('WRITE TEST TAGS', 'Date', 'xmp-test:WorkDate')]
+
+
+def test_value_checks():
+    config_tags = {'xmp-test:workcount': 'integer', 'xmp-test:worktitle': 'string'}
+    tag_maps = {'WRITE TEST TAGS': {'Count': 'XMP-test:WorkCount', 'Title': 'XMP-test:WorkTitle',
+                                    'Latitude': 'GPSLatitude', 'Date': 'IPTC:DateCreated'}}
+    checks = {key: check for _, key, _, check in preflight.value_checks(tag_maps, {'Count', 'Title', 'Latitude'},
+                                                                         config_tags)}
+    assert set(checks) == {'Count', 'Latitude'}  # Title is a string, Date is not a column
+    assert checks['Count']('12') is None
+    assert checks['Count']('12.5') == 'Not an integer'
+    assert checks['Latitude']('34 36 0 S') is None
+    assert checks['Latitude']('-34.6') is None
+    assert checks['Latitude']('95') == 'Out of range (more than 90 degrees)'
+    assert checks['Latitude']('north') == 'Error converting value (not a coordinate)'
+
+
+def test_value_check_types():
+    assert preflight.VALUE_CHECKS['real']('-1.5e3') is None
+    assert preflight.VALUE_CHECKS['rational']('1/250') is None
+    assert preflight.VALUE_CHECKS['boolean']('True') is None
+    assert preflight.VALUE_CHECKS['boolean']('yes') == 'Not True or False'
+    assert preflight.VALUE_CHECKS['iptc-date']('2022-07-06') == 'Invalid date format (use YYYY:mm:dd)'
+    assert preflight.VALUE_CHECKS['iptc-date']('2022:07:06') is None
+    assert preflight.VALUE_CHECKS['iptc-string128']('x' * 129) == 'Exceeds length limit of 128 (truncated)'
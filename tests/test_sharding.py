@@ -0,0 +1,100 @@
+""" Shard assignment of the rows of a CSV, and merge of the outputs of the shards """
+import json
+import os
+
+import pytest
+
+import sharding
+from journal import Journal
+
+
+def _write(filepath, lines: list[str]) -> str:
+    with open(filepath, 'w', encoding='utf-8') as w_file:
+        w_file.write('\n'.join(lines))
+    return str(filepath)
+
+
+def _read(filepath) -> list[str]:
+    with open(filepath, 'r', encoding='utf-8') as r_file:
+        return r_file.read().split('\n')
+
+
+def test_parse_shard():
+    assert sharding.parse_shard('2/4') == (2, 4)
+    assert sharding.parse_shard('1/1') == (1, 1)
+    for text in ('0/4', '5/4', '2', '2/4/8', 'a/b'):
+        with pytest.raises(ValueError):
+            sharding.parse_shard(text)
+
+
+def test_shard_of_is_stable_and_in_range():
+    filenames = [f'dir{n % 7}/image-{n}.jpg' for n in range(1000)]
+    shards = [sharding.shard_of(filename, 4) for filename in filenames]
+    assert shards == [sharding.shard_of(filename, 4) for filename in filenames]
+    assert set(shards) == {1, 2, 3, 4}
+    assert all(150 < shards.count(shard) < 350 for shard in (1, 2, 3, 4))  # Roughly even
+    assert sharding.shard_of('image-1.jpg', 4) == 3  # The same on every host and run (crc32, not hash())
+    assert {sharding.shard_of(filename, 1) for filename in filenames} == {1}
+
+
+def test_shard_filepath():
+    assert sharding.shard_filepath('/logs/mme_journal.sqlite', 2, 4) == '/logs/mme_journal.shard-2-of-4.sqlite'
+    assert sharding.shard_filepath('error_log_x.txt', 1, 3) == 'error_log_x.shard-1-of-3.txt'
+
+
+def test_shard_argv():
+    argv = ['csv/x.csv', 'images/', '--coordinate', '3', '--workers', '2']
+    assert sharding.shard_argv(argv, '--coordinate', 2, 3) == \
+        ['csv/x.csv', 'images/', '--workers', '2', '--shard', '2/3']
+    assert sharding.shard_argv(['csv/x.csv', '--coordinate=3'], '--coordinate', 1, 3) == \
+        ['csv/x.csv', '--shard', '1/3']
+
+
+def test_merge_logs_in_row_order(tmp_path):
+    run_entry = '[2022-06-10 10:00:00] MISSING KEY: Title - not mapped'
+    shard_1 = _write(tmp_path / 'log.shard-1-of-2.txt', [
+        run_entry, 'On WRITE DC TAGS: Row: "2", filepath: "a.jpg"', 'On WRITE DC TAGS: Row: "5", filepath: "d.jpg"',
+        'On WRITE VRAE TAGS: Row: "5", filepath: "d.jpg"'])
+    shard_2 = _write(tmp_path / 'log.shard-2-of-2.txt', [
+        run_entry, 'On WRITE DC TAGS: Row: "3", filepath: "b.jpg"', 'On WRITE DC TAGS: Row: "4", filepath: "c.jpg"'])
+    _write(tmp_path / 'log.shard-2-of-2.1.txt', ['On WRITE DC TAGS: Row: "6", filepath: "e.jpg"'])  # Rotated part
+    output_filepath = str(tmp_path / 'log.txt')
+    assert sharding.merge_logs([shard_1, shard_2], output_filepath) == 7
+    assert _read(output_filepath) == [
+        run_entry, 'On WRITE DC TAGS: Row: "2", filepath: "a.jpg"', 'On WRITE DC TAGS: Row: "3", filepath: "b.jpg"',
+        'On WRITE DC TAGS: Row: "4", filepath: "c.jpg"', 'On WRITE DC TAGS: Row: "5", filepath: "d.jpg"',
+        'On WRITE VRAE TAGS: Row: "5", filepath: "d.jpg"', 'On WRITE DC TAGS: Row: "6", filepath: "e.jpg"']
+
+
+def test_merge_jsonl_logs_in_row_order(tmp_path):
+    def entry(row, message):
+        return json.dumps({'row': row, 'message': message})
+
+    shard_1 = _write(tmp_path / 'log.shard-1-of-2.jsonl', [entry(None, 'missing'), entry(4, 'd'), entry(9, 'i')])
+    shard_2 = _write(tmp_path / 'log.shard-2-of-2.jsonl', [entry(None, 'missing'), entry(2, 'b'), entry(7, 'g')])
+    output_filepath = str(tmp_path / 'log.jsonl')
+    assert sharding.merge_logs([shard_1, shard_2], output_filepath) == 5
+    with open(output_filepath, 'r', encoding='utf-8') as r_file:
+        assert [json.loads(line)['message'] for line in r_file] == ['missing', 'b', 'd', 'g', 'i']
+
+
+def test_merge_names_the_outputs_after_shard_1(tmp_path):
+    filepaths = [_write(tmp_path / f'error_log_x-2022-06-10 10-00-0{shard}.shard-{shard}-of-2.txt',
+                        [f'On WRITE DC TAGS: Row: "{shard + 1}", filepath: "{shard}.jpg"']) for shard in (1, 2)]
+    for shard in (1, 2):
+        journal = Journal(sharding.shard_filepath(str(tmp_path / 'mme_journal.sqlite'), shard, 2), {})
+        journal.close()
+        filepaths.append(journal.journal_filepath)
+    counts = sharding.merge(filepaths)
+    assert counts == {str(tmp_path / 'error_log_x-2022-06-10 10-00-01.txt'): 2,
+                      str(tmp_path / 'mme_journal.sqlite'): 0}
+    assert os.path.exists(tmp_path / 'mme_journal.sqlite')
+
+
+def test_merge_needs_every_shard(tmp_path):
+    shard_1 = _write(tmp_path / 'log.shard-1-of-3.txt', [])
+    shard_3 = _write(tmp_path / 'log.shard-3-of-3.txt', [])
+    with pytest.raises(ValueError, match='Shards 2 of 3 missing'):
+        sharding.merge([shard_1, shard_3])
+    with pytest.raises(ValueError, match='Not the output of a shard'):
+        sharding.merge([str(tmp_path / 'log.txt')])
@@ -0,0 +1,42 @@
+""" Rows of the watched CSV: the rows appended, and the rows edited, found when it changes """
+import os
+
+from watch import CsvRows
+
+HEADER = '﻿File Name,Title\n'
+
+
+def _write(filepath, text: str, mode: str = 'w') -> None:
+    with open(filepath, mode, encoding='utf-8', newline='') as w_file:
+        w_file.write(text)
+    stat = os.stat(filepath)
+    os.utime(filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))  # A change, however fast the test
+
+
+def test_appended_rows(tmp_path):
+    filepath = tmp_path / 'rows.csv'
+    _write(filepath, HEADER + 'a.jpg,A\nb.jpg,B\n')
+    rows = CsvRows(str(filepath))
+    assert rows.rows_by_filename == {'a.jpg': {2}, 'b.jpg': {3}}
+    assert rows.update() == set()
+    _write(filepath, 'c.jpg,C\nd.jpg,D', mode='a')  # The last line is still being written
+    assert rows.update() == {4}
+    _write(filepath, 'D\na.jpg,A2\n', mode='a')
+    assert rows.update() == {5, 6}
+    assert rows.rows_by_filename == {'a.jpg': {2, 6}, 'b.jpg': {3}, 'c.jpg': {4}, 'd.jpg': {5}}
+    assert rows.rows_of({str(tmp_path / 'd.jpg')}) == {5}
+
+
+def test_rewritten_csv(tmp_path):
+    filepath = tmp_path / 'rows.csv'
+    _write(filepath, HEADER + 'a.jpg,A\nb.jpg,B\nc.jpg,C\n')
+    rows = CsvRows(str(filepath))
+    _write(filepath, HEADER + 'a.jpg,A\nb.jpg,B2\nc.jpg,C\nd.jpg,D\n')  # Edited and grown
+    assert rows.update() == {3, 5}
+    _write(filepath, HEADER + 'a.jpg,A\nb.jpg,B2\n')  # Shrunk
+    assert rows.update() == set()
+    assert rows.rows_by_filename == {'a.jpg': {2}, 'b.jpg': {3}}
+    _write(filepath, HEADER + 'a.jpg,X\nb.jpg,B2\n')  # Edited, same size
+    assert rows.update() == {2}
+    _write(filepath, '﻿File Name,Other\na.jpg,X\nb.jpg,B2\n')  # Header changed
+    assert rows.update() == {2, 3}
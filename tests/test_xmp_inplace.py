@@ -0,0 +1,154 @@
+""" In-place update of the XMP packet of JPEG and TIFF files """
+import os
+import struct
+
+import xmp_inplace
+from mme import MME
+
+PACKET_HEADER = b"<?xpacket begin='\xef\xbb\xbf' id='W5M0MpCehiHzreSzNTczkc9d'?>\n"
+
+
+def _packet(body: bytes, padding: int = 400) -> bytes:
+    """ An XMP packet padded as exiftool pads it """
+    return PACKET_HEADER + body + b'\n' + b' ' * padding + b'\n' + xmp_inplace.PACKET_TRAILER
+
+
+def _jpeg(packet: bytes, extended: bool = False) -> bytes:
+    """ A JPEG with an EXIF segment, an XMP segment (and an extended XMP segment) and some image data """
+    def segment(marker: int, data: bytes) -> bytes:
+        return struct.pack('>BBH', 0xFF, marker, len(data) + 2) + data
+
+    segments = segment(0xE1, b'Exif\x00\x00' + b'\x00' * 20) + segment(0xE1, xmp_inplace.JPEG_XMP_HEADER + packet)
+    if extended:
+        segments += segment(0xE1, xmp_inplace.JPEG_EXTENDED_XMP_HEADER + b'0' * 40)
+    return b'\xff\xd8' + segments + segment(0xDA, b'\x00' * 10) + b'\x12\x34' * 50 + b'\xff\xd9'
+
+
+def _tiff(packet: bytes, byte_order: str = '<') -> bytes:
+    """ A TIFF whose first IFD has an XMLPacket tag, its packet after the IFD """
+    magic = b'II*\x00' if byte_order == '<' else b'MM\x00*'
+    packet_offset = 8 + 2 + 2 * 12 + 4
+    ifd = struct.pack(f'{byte_order}H', 2) + \
+        struct.pack(f'{byte_order}HHII', 256, 4, 1, 16) + \
+        struct.pack(f'{byte_order}HHII', xmp_inplace.TIFF_XMP_TAG, 7, len(packet), packet_offset) + \
+        struct.pack(f'{byte_order}I', 0)
+    return magic + struct.pack(f'{byte_order}I', 8) + ifd + packet + b'\x00' * 64
+
+
+def _write(filepath, data: bytes) -> str:
+    with open(filepath, 'wb') as w_file:
+        w_file.write(data)
+    return str(filepath)
+
+
+def test_xmp_only():
+    assert xmp_inplace.xmp_only(['-XMP-vrae:WorkTitle=Title', '-xmp-dc:all=', '-xmp:Creator='])
+    assert not xmp_inplace.xmp_only(['-XMP-vrae:WorkTitle=Title', '-IPTC:DateCreated=2022:07:06'])
+    assert not xmp_inplace.xmp_only(['-GPSLatitude=34.6'])
+
+
+def test_fit_packet_pads_to_the_current_length():
+    packet = _packet(b'<x:xmpmeta>old</x:xmpmeta>')
+    new_packet = xmp_inplace.fit_packet(packet, _packet(b'<x:xmpmeta>a longer value</x:xmpmeta>', padding=2400))
+    assert len(new_packet) == len(packet)
+    assert new_packet.startswith(PACKET_HEADER + b'<x:xmpmeta>a longer value</x:xmpmeta>\n')
+    assert new_packet.endswith(xmp_inplace.PACKET_TRAILER)
+    padding = new_packet[len(PACKET_HEADER) + len(b'<x:xmpmeta>a longer value</x:xmpmeta>'):
+                         -len(xmp_inplace.PACKET_TRAILER)]
+    assert not padding.strip()
+    assert max(len(line) for line in padding.split(b'\n')) < xmp_inplace.PADDING_LINE
+
+
+def test_fit_packet_shrinks_to_the_current_length():
+    packet = _packet(b'<x:xmpmeta>a long value</x:xmpmeta>', padding=10)
+    new_packet = xmp_inplace.fit_packet(packet, _packet(b'<x:xmpmeta>v</x:xmpmeta>', padding=0))
+    assert len(new_packet) == len(packet)
+    assert new_packet.endswith(xmp_inplace.PACKET_TRAILER)
+
+
+def test_fit_packet_none_when_the_packet_grows():
+    packet = _packet(b'<x:xmpmeta>old</x:xmpmeta>', padding=10)
+    assert xmp_inplace.fit_packet(packet, _packet(b'<x:xmpmeta>' + b'new ' * 10 + b'</x:xmpmeta>')) is None
+
+
+def test_fit_packet_none_without_trailer():
+    assert xmp_inplace.fit_packet(_packet(b'<x:xmpmeta/>'), PACKET_HEADER + b'<x:xmpmeta/>') is None
+
+
+def test_read_packet_jpeg(tmp_path):
+    packet = _packet(b'<x:xmpmeta>jpeg</x:xmpmeta>')
+    data = _jpeg(packet)
+    offset, read = xmp_inplace.read_packet(_write(tmp_path / 'image.jpg', data))
+    assert read == packet
+    assert data[offset:offset + len(packet)] == packet
+
+
+def test_read_packet_tiff(tmp_path):
+    packet = _packet(b'<x:xmpmeta>tiff</x:xmpmeta>')
+    for byte_order in ('<', '>'):
+        data = _tiff(packet, byte_order)
+        offset, read = xmp_inplace.read_packet(_write(tmp_path / 'image.tif', data))
+        assert read == packet
+        assert data[offset:offset + len(packet)] == packet
+
+
+def test_read_packet_none_when_left_to_exiftool(tmp_path):
+    packet = _packet(b'<x:xmpmeta/>')
+    assert xmp_inplace.read_packet(_write(tmp_path / 'extended.jpg', _jpeg(packet, extended=True))) is None
+    assert xmp_inplace.read_packet(_write(tmp_path / 'image.png', b'\x89PNG\r\n\x1a\n' + packet)) is None
+    assert xmp_inplace.read_packet(_write(tmp_path / 'truncated.jpg', _jpeg(packet)[:80])) is None
+
+
+def test_write_packet_in_place(tmp_path):
+    packet = _packet(b'<x:xmpmeta>old</x:xmpmeta>')
+    data = _jpeg(packet)
+    filepath = _write(tmp_path / 'image.jpg', data)
+    offset, _ = xmp_inplace.read_packet(filepath)
+    new_packet = xmp_inplace.fit_packet(packet, _packet(b'<x:xmpmeta>new</x:xmpmeta>'))
+    assert xmp_inplace.write_packet(filepath, offset, packet, new_packet)
+    with open(filepath, 'rb') as r_file:
+        written = r_file.read()
+    assert written == data[:offset] + new_packet + data[offset + len(packet):]
+    assert xmp_inplace.read_packet(filepath) == (offset, new_packet)
+
+
+def test_write_packet_refuses_a_changed_file(tmp_path):
+    packet = _packet(b'<x:xmpmeta>old</x:xmpmeta>')
+    filepath = _write(tmp_path / 'image.tif', _tiff(packet))
+    offset, _ = xmp_inplace.read_packet(filepath)
+    new_packet = xmp_inplace.fit_packet(packet, _packet(b'<x:xmpmeta>new</x:xmpmeta>'))
+    other_packet = packet.replace(b'old', b'odd')
+    assert not xmp_inplace.write_packet(filepath, offset, other_packet, new_packet)
+    assert not xmp_inplace.write_packet(filepath, offset, packet, new_packet + b' ')
+    assert xmp_inplace.read_packet(filepath) == (offset, packet)
+
+
+def _in_place(filepath: str, exiftool_packet: bytes):
+    """ Run the in-place command of MME on a file, exiftool writing exiftool_packet to the packet copy. Return its
+    result (the bytes written, or None for a full rewrite) """
+    command = MME._MME__in_place_command(MME.__new__(MME), filepath, ['-XMP-vrae:WorkTitle=new'])
+    prefix, (arguments,) = next(command)
+    assert prefix == MME.IN_PLACE_TAGS
+    _write(arguments[-1], exiftool_packet)  # The packet copy
+    try:
+        command.send([('', '')])
+    except StopIteration as stop:
+        return stop.value
+    raise AssertionError('More than one exiftool command')
+
+
+def test_in_place_command_writes_a_packet_that_fits(tmp_path):
+    packet = _packet(b'<x:xmpmeta>old</x:xmpmeta>')
+    filepath = _write(tmp_path / 'image.jpg', _jpeg(packet))
+    assert _in_place(filepath, _packet(b'<x:xmpmeta>new</x:xmpmeta>', padding=2400)) == len(packet)
+    assert b'<x:xmpmeta>new</x:xmpmeta>' in xmp_inplace.read_packet(filepath)[1]
+
+
+def test_in_place_command_falls_back_to_a_rewrite_when_the_packet_grows(tmp_path):
+    packet = _packet(b'<x:xmpmeta>old</x:xmpmeta>', padding=10)
+    data = _jpeg(packet)
+    filepath = _write(tmp_path / 'image.jpg', data)
+    assert _in_place(filepath, _packet(b'<x:xmpmeta>' + b'new ' * 10 + b'</x:xmpmeta>')) is None
+    with open(filepath, 'rb') as r_file:
+        assert r_file.read() == data
+    assert os.path.getsize(filepath) == len(data)
@@ -41,10 +41,12 @@ def create_and_show_gui():
         [sg.Frame('CSV file and JPGs root folder', folderfileframelayout)],
         [sg.Frame('Options', optionslayout)],
         [sg.Text('Output:'), sg.Push(), sg.Text(f'All logs are written to folder: ' + str(Path.home()) + os.path.sep + 'Museum-Metadata-Embedder_logs', font=('any', 10, 'italic'))],
-        [sg.Multiline(size=(140, 30), key = '_sgOutput_', autoscroll=True, auto_refresh=True)],
+        [sg.Multiline(size=(140, 30), key = '_sgOutput_', autoscroll=True)], # Updated by the main loop, not on every line
+        [sg.ProgressBar(max_value=1, orientation='h', size=(80, 15), key='_progress_'), sg.Text('', size=(20, 1), key='_progress_text_')],
         [sg.Checkbox('Empty Output window before next run', key='_clean_output_', default=True),
          sg.Push(),
          sg.Button('write EXIF metadata', font=('Calibri', 10, 'bold'), key='_WriteExif_'),
+         sg.Button('Cancel', font=('Calibri', 10, 'bold'), key='_Cancel_', disabled=True),
          sg.Button('View logs', font=('Calibri', 10, 'bold'), key='_ViewLogs_', disabled=True),
          sg.Button('Close', font=('Calibri', 10, 'bold'), key='_Close_')]
     ]
@@ -0,0 +1,302 @@
+"""
+Watch mode: embed the rows of a CSV as their images arrive (python mme.py CSV_PATH IMAGES_ROOT_PATH --watch).
+
+After a first run of the CSV, the images root (up to max_depth, the directories of the file index, as mme.py finds the
+files) and the CSV are watched:
+- on Linux with inotify: a file closed after writing, or moved into a directory, is a changed file, and a directory
+  created, moved or removed updates the file index and the watched directories,
+- elsewhere (or if inotify is not available) by polling: the file index is refreshed every POLL_INTERVAL seconds,
+  which only lists again the directories whose mtime changed, and their new files, or the files modified since the
+  last poll, are the changed files. A file rewritten in place (without a new file nor a rename) is only seen by
+  inotify,
+- the CSV is checked at every poll: when it grows, only the bytes appended since the last read are parsed, and their
+  rows are the changed rows (a last line without a line break is still being written, it is left for the next
+  change). When it shrank, did not grow, or its header or the last bytes before the read offset changed, it was
+  rewritten: it is read again in full, and the rows edited are found from a digest of every row.
+
+The rows of the changed files (by "File Name") and the changed rows are gathered, and run together once nothing
+changed for the debounce time (or once BATCH_ROWS rows, or MAX_DELAY seconds, are waiting), with the exiftool
+processes and the file index kept warm between batches. The files written by a batch are changed by it: their size
+and mtime right after the batch are kept, and their events are ignored while they stay the same. The work of a batch
+grows with the number of changes, not with the size of the collection.
+"""
+import os
+import csv
+import time
+import errno
+import ctypes
+import select
+import struct
+import hashlib
+import threading
+import ctypes.util
+
+from typing import Callable, Iterator, Optional
+
+from file_index import FileIndex
+from row_results import RowResult
+
+POLL_INTERVAL = 1.0  # Seconds between two checks of the CSV (and of the images root, when polling)
+BATCH_ROWS = 1000  # Rows run by a batch at most, the other rows wait for the next batch
+MAX_DELAY = 60.0  # Seconds a changed row waits at most, while changes keep arriving
+MIN_BATCH_INTERVAL = 1.0  # Seconds between the start of two batches, so every batch has its own logs
+
+# inotify (see inotify(7))
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len (of the name that follows)
+
+
+class PollingWatcher:
+    """ Changed files of the file index, found by refreshing it (only the directories whose mtime changed) """
+
+    def __init__(self, file_index: FileIndex):
+        self.file_index: FileIndex = file_index
+        self._last_poll: float = time.time()
+
+    def changes(self, timeout: float) -> set[str]:
+        """ Wait timeout seconds, and return the files that are new or were modified since the last poll, in the
+        directories that changed """
+        time.sleep(timeout)
+        return self.poll()
+
+    def poll(self) -> set[str]:
+        """ Refresh the index, and return the new or modified files of the directories that changed """
+        last_poll, self._last_poll = self._last_poll, time.time()
+        before = dict(self.file_index.directories)
+        if not self.file_index.refresh():
+            return set()
+        changed = set()
+        for relative_path, (mtime, filenames) in self.file_index.directories.items():
+            if before.get(relative_path, (None,))[0] == mtime:
+                continue
+            known = set(before[relative_path][1]) if relative_path in before else set()
+            directory = self.file_index.full_path(relative_path)
+            for filename in filenames:
+                filepath = os.path.join(directory, filename)
+                try:
+                    if filename not in known or os.stat(filepath).st_mtime >= last_poll:
+                        changed.add(filepath)
+                except OSError:
+                    continue  # Removed since it was listed
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyWatcher:
+    """ Changed files of the directories of the file index, from inotify events (Linux only, OSError elsewhere) """
+
+    def __init__(self, file_index: FileIndex):
+        self.file_index: FileIndex = file_index
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._fd: int = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._directories: dict[int, str] = {}  # Watch descriptor -> directory relative to the images root
+        self._poller = PollingWatcher(file_index)  # To find the files of the directories that changed
+        self._sync_watches()
+
+    def _sync_watches(self) -> None:
+        """ Watch the directories of the file index, and only them """
+        watched = {relative_path: wd for wd, relative_path in self._directories.items()}
+        for relative_path in self.file_index.directories.keys() - watched.keys():
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(self.file_index.full_path(relative_path)),
+                                              WATCH_MASK)
+            if wd >= 0:  # A directory removed since it was indexed can not be watched
+                self._directories[wd] = relative_path
+        for relative_path in watched.keys() - self.file_index.directories.keys():
+            self._libc.inotify_rm_watch(self._fd, watched[relative_path])
+            self._directories.pop(watched[relative_path], None)
+
+    def _events(self, timeout: float) -> Iterator[tuple[int, int, str]]:
+        """ (watch descriptor, mask, name) of the events that arrive within timeout seconds """
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                yield wd, mask, name
+
+    def changes(self, timeout: float) -> set[str]:
+        """ Wait up to timeout seconds for events, and return the files written or moved in """
+        changed, directories_changed = set(), False
+        for wd, mask, name in self._events(timeout):
+            if mask & IN_Q_OVERFLOW:  # Events were lost: find the changes as the poller does
+                directories_changed = True
+                changed |= self._poller.poll()
+            elif mask & (IN_ISDIR | IN_DELETE_SELF | IN_IGNORED):
+                directories_changed = True
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and wd in self._directories:
+                changed.add(os.path.join(self.file_index.full_path(self._directories[wd]), name))
+        if directories_changed:
+            self.file_index.refresh()
+            self._sync_watches()
+        return changed
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class CsvRows:
+    """ Rows of a CSV, and their files: the rows appended are read when the CSV grows, the rows edited are found when
+    it is rewritten """
+    CHECK_BYTES = 4096  # Bytes before the read offset that must be unchanged for the CSV to have only grown
+    DIGEST_SIZE = 20  # SHA-1
+
+    def __init__(self, csv_filepath: str):
+        self.csv_filepath: str = csv_filepath
+        self.rows_by_filename: dict[str, set[int]] = {}  # File Name -> CSV row indexes (the header is row 1)
+        self._digests = bytearray()  # Digest of every row, in CSV order
+        self._rows: int = 0  # Rows read
+        self._header: Optional[list[str]] = None
+        self._header_bytes: bytes = b''  # First line of the CSV
+        self._offset: int = 0  # Bytes read, up to the end of the last complete line
+        self._check: bytes = b''  # The last CHECK_BYTES bytes read
+        self._stat: Optional[tuple[int, int]] = None  # (size, mtime) of the CSV when it was read
+        self.update()
+
+    def update(self) -> set[int]:
+        """ Read the rows appended to the CSV, or the whole CSV again if it was rewritten, and return the CSV row
+        indexes of the rows appended or edited (every row if the header changed) """
+        try:
+            stat = os.stat(self.csv_filepath)
+            if (stat.st_size, stat.st_mtime_ns) == self._stat:
+                return set()
+            with open(self.csv_filepath, 'rb') as r_file:
+                grown = self._header is not None and stat.st_size > self._stat[0] and self._only_grown(r_file)
+                r_file.seek(self._offset if grown else 0)
+                data = r_file.read()
+        except OSError:
+            return set()  # Being replaced, read it on the next change
+        self._stat = (stat.st_size, stat.st_mtime_ns)
+        data = data[:data.rfind(b'\n') + 1]  # A last line without a line break is still being written
+        if grown:
+            changed = self._read_rows(csv.reader(data.decode('utf-8', 'replace').splitlines(keepends=True)))
+        else:
+            changed = self._read_all(data)
+        self._offset += len(data)
+        self._check = (self._check + data)[-CsvRows.CHECK_BYTES:]
+        return changed
+
+    def _only_grown(self, r_file) -> bool:
+        """ True if the header and the last bytes read are unchanged, so only the bytes past them are new """
+        if r_file.read(len(self._header_bytes)) != self._header_bytes:
+            return False
+        r_file.seek(self._offset - len(self._check))
+        return r_file.read(len(self._check)) == self._check
+
+    def _read_all(self, data: bytes) -> set[int]:
+        """ Read every row of the CSV, return the CSV row indexes of the rows edited or added since the last read """
+        self._offset, self._check = 0, b''
+        reader = csv.reader(data.decode('utf-8-sig', 'replace').splitlines(keepends=True))
+        header = next(reader, None)
+        if header is None:
+            return set()
+        previous = self._digests if header == self._header else None
+        self._header, self._header_bytes = header, data[:data.find(b'\n') + 1]
+        self._digests, self._rows, self.rows_by_filename = bytearray(), 0, {}
+        return self._read_rows(reader, previous)
+
+    def _read_rows(self, reader: Iterator[list[str]], previous: Optional[bytearray] = None) -> set[int]:
+        """ Add the rows of a reader after the rows read, return the CSV row indexes of the rows that are not the same
+        in the previous digests (every row, without them) """
+        file_name = self._header.index('File Name') if 'File Name' in self._header else None
+        changed = set()
+        for values in reader:
+            digest = hashlib.sha1('\0'.join(values).encode('utf-8')).digest()
+            start = self._rows * CsvRows.DIGEST_SIZE
+            if previous is None or previous[start:start + CsvRows.DIGEST_SIZE] != digest:
+                changed.add(self._rows + 2)
+            self._digests += digest
+            if file_name is not None and file_name < len(values) and values[file_name]:
+                self.rows_by_filename.setdefault(values[file_name], set()).add(self._rows + 2)
+            self._rows += 1
+        return changed
+
+    def rows_of(self, filepaths: set[str]) -> set[int]:
+        """ CSV row indexes of the rows of some files """
+        return {row for filepath in filepaths for row in self.rows_by_filename.get(os.path.basename(filepath), ())}
+
+
+def watcher(file_index: FileIndex, polling: bool = False):
+    """ An InotifyWatcher, or a PollingWatcher if polling or if inotify is not available """
+    if not polling:
+        try:
+            return InotifyWatcher(file_index)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(file_index)
+
+
+def watch(csv_filepath: str, file_index: FileIndex, run_rows: Callable[[set[int]], Iterator[RowResult]],
+          debounce: float = 2.0, polling: bool = False, stop: Optional[threading.Event] = None,
+          on_changes: Optional[Callable[[set[int]], None]] = None) -> None:
+    """ Watch the images of the file index and the CSV, and run the rows of the changes in batches with
+    run_rows(rows), which yields their results, until stop is set. on_changes is called with the rows of every
+    batch, before it runs """
+    stop = stop or threading.Event()
+    csv_rows = CsvRows(csv_filepath)
+    files_watcher = watcher(file_index, polling)
+    written: dict[str, tuple[int, int]] = {}  # Filepath -> (size, mtime) right after a batch wrote it
+    pending: set[int] = set()
+    first_change = last_change = last_batch = 0.0
+    try:
+        while not stop.is_set():
+            changed_files = set()
+            for filepath in files_watcher.changes(POLL_INTERVAL):
+                try:
+                    stat = os.stat(filepath)
+                except OSError:
+                    continue  # Removed, or a temporary file
+                if written.get(filepath) != (stat.st_size, stat.st_mtime_ns):
+                    written.pop(filepath, None)
+                    changed_files.add(filepath)
+            rows = csv_rows.update() | csv_rows.rows_of(changed_files)
+            now = time.monotonic()
+            if rows:
+                first_change = first_change if pending else now
+                last_change = now
+                pending |= rows
+
+            if not pending or now - last_batch < MIN_BATCH_INTERVAL:
+                continue
+            if now - last_change < debounce and len(pending) < BATCH_ROWS and now - first_change < MAX_DELAY:
+                continue
+            batch = set(sorted(pending)[:BATCH_ROWS])
+            pending -= batch
+            first_change = now if pending else 0.0
+            last_batch = now
+            if on_changes:
+                on_changes(batch)
+            for result in run_rows(batch):
+                if result.filepath:
+                    try:
+                        stat = os.stat(result.filepath)
+                        written[result.filepath] = (stat.st_size, stat.st_mtime_ns)
+                    except OSError:
+                        continue
+    finally:
+        files_watcher.close()
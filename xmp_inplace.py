@@ -0,0 +1,105 @@
+"""
+In-place update of the XMP packet of JPEG and TIFF files, for the --in-place fast path.
+
+exiftool writes every change to a copy of the whole file, which is then renamed: gigabytes of I/O for a large TIFF,
+to change a few KB of XMP. When only XMP tags change, the new packet is built by exiftool from a copy of the current
+packet (a small .xmp file), and if it fits in the space of the current packet (exiftool pads the packets it writes),
+it is written over it, padded to the same length. Nothing else in the file moves, so no offset needs to be updated.
+
+Only a single standard XMP packet is updated: in the APP1 segment of a JPEG (not with extended XMP), or in the
+XMLPacket tag of the first IFD of a TIFF (not BigTIFF). Anything else is left to a full exiftool write.
+"""
+import os
+import struct
+
+from typing import BinaryIO, Optional
+
+JPEG_XMP_HEADER = b'http://ns.adobe.com/xap/1.0/\x00'
+JPEG_EXTENDED_XMP_HEADER = b'http://ns.adobe.com/xmp/extension/\x00'
+TIFF_XMP_TAG = 700
+PACKET_END = b'<?xpacket end='
+PACKET_TRAILER = b"<?xpacket end='w'?>"
+PADDING_LINE = 100  # Length of the lines of whitespace padding, as exiftool pads
+
+
+def xmp_only(arguments: list[str]) -> bool:
+    """ True if every "-tag=value" argument writes (or clears) an XMP tag """
+    return all(argument[1:].partition('=')[0].rpartition(':')[0].lower().startswith('xmp') for argument in arguments)
+
+
+def _jpeg_packet(r_file: BinaryIO) -> Optional[tuple[int, int]]:
+    """ (offset, length) of the XMP packet of a JPEG, from its APP1 segment """
+    packets = []
+    r_file.seek(2)
+    while True:
+        marker = r_file.read(4)
+        if len(marker) < 4 or marker[0] != 0xFF or marker[1] in (0xD9, 0xDA):
+            break  # End of the metadata segments (or not a segment)
+        start, length = r_file.tell(), struct.unpack('>H', marker[2:])[0]
+        if marker[1] == 0xE1:
+            header = r_file.read(len(JPEG_EXTENDED_XMP_HEADER))
+            if header.startswith(JPEG_EXTENDED_XMP_HEADER):
+                return None  # The main packet points to the extension, it is left to exiftool
+            if header.startswith(JPEG_XMP_HEADER):
+                packets.append((start + len(JPEG_XMP_HEADER), length - 2 - len(JPEG_XMP_HEADER)))
+        r_file.seek(start + length - 2)
+    return packets[0] if len(packets) == 1 else None
+
+
+def _tiff_packet(r_file: BinaryIO, byte_order: str) -> Optional[tuple[int, int]]:
+    """ (offset, length) of the XMP packet of a TIFF, from the XMLPacket tag of its first IFD """
+    r_file.seek(4)
+    ifd_offset = struct.unpack(f'{byte_order}I', r_file.read(4))[0]
+    r_file.seek(ifd_offset)
+    entries = struct.unpack(f'{byte_order}H', r_file.read(2))[0]
+    for _ in range(entries):
+        tag, tag_type, count, value_offset = struct.unpack(f'{byte_order}HHII', r_file.read(12))
+        if tag == TIFF_XMP_TAG and tag_type in (1, 7) and count > 4:  # BYTE or UNDEFINED, not inline
+            return value_offset, count
+    return None
+
+
+def read_packet(filepath: str) -> Optional[tuple[int, bytes]]:
+    """ (offset, bytes) of the XMP packet of a JPEG or TIFF file, None if it has none that can be updated in place """
+    try:
+        with open(filepath, 'rb') as r_file:
+            magic = r_file.read(4)
+            if magic[:2] == b'\xff\xd8':
+                location = _jpeg_packet(r_file)
+            elif magic in (b'II*\x00', b'MM\x00*'):
+                location = _tiff_packet(r_file, '<' if magic[:2] == b'II' else '>')
+            else:
+                return None
+            if location is None:
+                return None
+            r_file.seek(location[0])
+            packet = r_file.read(location[1])
+    except (OSError, struct.error):
+        return None
+    return (location[0], packet) if len(packet) == location[1] else None
+
+
+def fit_packet(packet: bytes, new_packet: bytes) -> Optional[bytes]:
+    """ The new packet padded with whitespace to the length of the current packet, None if it does not fit """
+    end = new_packet.rfind(PACKET_END)
+    if end < 0:
+        return None
+    body = new_packet[:end].rstrip()
+    padding = len(packet) - len(body) - len(PACKET_TRAILER)
+    if padding < 1:
+        return None
+    lines = b'\n'.join([b' ' * (PADDING_LINE - 1)] * (padding // PADDING_LINE + 1))
+    return body + b'\n' + lines[:padding - 1] + PACKET_TRAILER
+
+
+def write_packet(filepath: str, offset: int, packet: bytes, new_packet: bytes) -> bool:
+    """ Write the new packet over the current one, if the file still has it (same length), return True if written """
+    with open(filepath, 'r+b') as rw_file:
+        rw_file.seek(offset)
+        if len(new_packet) != len(packet) or rw_file.read(len(packet)) != packet:
+            return False
+        rw_file.seek(offset)
+        rw_file.write(new_packet)
+        rw_file.flush()
+        os.fsync(rw_file.fileno())
+    return True